@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热点路径微基准
+
+不需要登录，也不发起网络请求，只测量纯 CPU / 本地 I/O 的热点：
+指令分发、消息体构建、图片加载与 md5、定时任务序列化与保存。
+
+绝对耗时取决于机器和当时的负载，因此每次运行都会在各项基准之间穿插测量一个固定的校准循环（纯 Python 的字典、
+字符串、json 操作），与基准对比时使用"耗时 / 校准耗时"的相对值。换机器或机器变慢时整体比例
+会被校准抵消，只有某个热点相对其他代码变慢才判定为退化。校准只能抵消整体快慢，磁盘、内存
+带宽等差异仍会影响 I/O 类基准，阈值不宜设得太小。
+
+用法：
+    python benchmarks/bench.py                     # 运行并与 baseline.json 对比，退化超过阈值时退出码为 1
+    python benchmarks/bench.py --update-baseline   # 运行并把结果（含校准耗时）写入 baseline.json
+    python benchmarks/bench.py --large             # 额外测量 100MB 文件
+    python benchmarks/bench.py -k dispatch         # 只运行名称包含 dispatch 的基准
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framework import CommandFramework, CommandHandler, TimedTask, TimedTaskManager  # noqa: E402
+from lib import Message, Utils  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# 基准文件中保存校准耗时的键
+CALIBRATION_KEY = "_calibration"
+
+
+class EchoCommandHandler(CommandHandler):
+    def __init__(self, name: str):
+        super().__init__(name, f"基准测试指令 {name}")
+
+    def handle(self, message: str) -> str:
+        return message
+
+
+def measure(func: Callable[[], object], min_time: float = 0.2, repeat: int = 5) -> float:
+    """返回单次调用的耗时（秒），取多轮中最快的一轮"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def calibration() -> object:
+    """校准循环：与被测代码相近的纯 Python 工作量，只用于衡量机器本身的快慢"""
+    data = {f"key{i}": [i, str(i) * 3, {"n": i}] for i in range(200)}
+    text = json.dumps(data, ensure_ascii=False)
+    return sum(len(key) + len(value[1]) for key, value in json.loads(text).items())
+
+
+def bench_dispatch(commands: int) -> Callable[[], object]:
+    framework = CommandFramework(Message())
+    names = [f"指令{i}" for i in range(commands)]
+    for name in names:
+        framework.register_command(name, EchoCommandHandler(name))
+    probe = names[commands // 2]
+
+    def run():
+        framework.current_handler = None
+        framework.handle_message(probe)
+        framework.handle_message("退出")
+        framework.handle_message("不存在的指令")
+    return run
+
+
+def bench_bind_msg_data() -> Callable[[], object]:
+    message = Message()
+    message.uin, message.sid, message.skey = "123456", "sid", "@crypt_skey"
+    message.username_hash = "@" + "f" * 64
+    content = "基准测试消息 " * 20
+    return lambda: message.bind_msg_data(type_=1, content=content)
+
+
+def bench_base_request() -> Callable[[], object]:
+    message = Message()
+    return message.generate_base_request
+
+
+def make_file(directory: str, size: int) -> str:
+    path = os.path.join(directory, f"image_{size}.png")
+    with open(path, "wb") as f:
+        chunk = os.urandom(min(size, 1 << 20))
+        written = 0
+        while written < size:
+            f.write(chunk[:size - written])
+            written += len(chunk)
+    return path
+
+
+def bench_load_image(path: str) -> Callable[[], object]:
+    return lambda: Utils.load_image(path)
+
+
+def bench_gen_md5(path: str) -> Callable[[], object]:
+    with open(path, "rb") as f:
+        content = f.read()
+    return lambda: Utils.gen_md5(content)
+
+
+def make_tasks(count: int) -> List[TimedTask]:
+    return [TimedTask(f"task_1700000000_{i}", "scripts/morning.py", f"{i % 24:02d}:{i % 60:02d}",
+                      description=f"任务 {i}") for i in range(count)]
+
+
+def bench_task_roundtrip(count: int) -> Callable[[], object]:
+    tasks = make_tasks(count)
+
+    def run():
+        for task in tasks:
+            TimedTask.from_dict(task.to_dict())
+    return run
+
+
+def bench_save_tasks(directory: str, count: int) -> Callable[[], object]:
+    manager = TimedTaskManager(Message())
+    manager.task_file = os.path.join(directory, "timed_tasks.json")
+    manager.tasks = {task.task_id: task for task in make_tasks(count)}
+    return manager.save_tasks
+
+
+def collect(directory: str, large: bool) -> List[Tuple[str, Callable[[], Callable[[], object]]]]:
+    """(名称, 构造被测函数) 列表，构造延迟到运行时以便 -k 过滤时跳过准备工作"""
+    sizes = [("1KB", 1 << 10), ("1MB", 1 << 20), ("10MB", 10 << 20)]
+    if large:
+        sizes.append(("100MB", 100 << 20))
+    benches = [
+        ("dispatch_100_commands", lambda: bench_dispatch(100)),
+        ("dispatch_500_commands", lambda: bench_dispatch(500)),
+        ("bind_msg_data", bench_bind_msg_data),
+        ("generate_base_request", bench_base_request),
+    ]
+    for label, size in sizes:
+        benches.append((f"load_image_{label}", lambda size=size: bench_load_image(make_file(directory, size))))
+        benches.append((f"gen_md5_{label}", lambda size=size: bench_gen_md5(make_file(directory, size))))
+    benches += [
+        ("task_to_from_dict_10k", lambda: bench_task_roundtrip(10000)),
+        ("save_tasks_10k", lambda: bench_save_tasks(directory, 10000)),
+    ]
+    return benches
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f}{unit}"
+    return f"{seconds / 1e-9:8.1f}ns"
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="热点路径微基准")
+    parser.add_argument("--update-baseline", "--update", dest="update", action="store_true",
+                        help="把本次结果写入基准文件")
+    parser.add_argument("--threshold", type=float, default=0.3,
+                        help="允许的退化比例，默认 0.3 即慢 30%% 以上判定为退化")
+    parser.add_argument("--large", action="store_true", help="包含 100MB 文件的基准")
+    parser.add_argument("-k", dest="keyword", default="", help="只运行名称包含该关键字的基准")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基准文件路径")
+    args = parser.parse_args(argv)
+
+    baseline: Dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # 旧的基准文件没有校准耗时，此时退回到直接比较绝对耗时
+    baseline_calibration = baseline.pop(CALIBRATION_KEY, None)
+
+    results: Dict[str, float] = {}
+    # 校准穿插在各项基准之间反复测量，与基准一样取最快的一次，减小负载波动的影响
+    current_calibration = measure(calibration)
+    with tempfile.TemporaryDirectory() as directory:
+        # TimedTaskManager 会在当前目录读取任务文件，切到临时目录避免影响真实数据
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for name, setup in collect(directory, args.large):
+                if args.keyword not in name:
+                    continue
+                results[name] = measure(setup())
+                current_calibration = min(current_calibration, measure(calibration))
+        finally:
+            os.chdir(cwd)
+
+    line = f"{'校准':<26}{format_time(current_calibration)}"
+    if baseline_calibration:
+        scale = current_calibration / baseline_calibration
+        line += f"  基准 {format_time(baseline_calibration)}  本机速度系数 {scale:.2f}"
+    else:
+        scale = 1.0
+        line += "  基准文件没有校准数据，按绝对耗时比较"
+    print(line)
+
+    regressions = []
+    for name, seconds in results.items():
+        line = f"{name:<28}{format_time(seconds)}"
+        if name in baseline:
+            # 先把基准按本机速度换算，再计算比例
+            expected = baseline[name] * scale
+            ratio = seconds / expected
+            line += f"  换算基准 {format_time(expected)}  {ratio:6.2f}x"
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                line += "  ⚠️ 退化"
+        print(line)
+
+    if args.update:
+        if baseline_calibration:
+            # 未重新测量的旧条目换算到本次的校准耗时，保持整个文件使用同一个参照
+            baseline = {name: seconds * scale for name, seconds in baseline.items()}
+        baseline.update(results)
+        baseline[CALIBRATION_KEY] = current_calibration
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n已更新基准文件: {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} 项基准退化超过 {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\n✅ 没有发现退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
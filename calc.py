@@ -0,0 +1,307 @@
+"""
+安全的算术表达式引擎
+
+替代直接 eval 用户输入：表达式先用 ast 解析，只允许数字、四则运算、乘方、取模、
+白名单中的数学函数和事先声明的变量，其余语法（属性访问、下标、字符串、lambda、
+__import__ 等）一律拒绝。校验通过的语法树会把乘法和乘方替换为带大小检查的函数后编译成
+字节码，按表达式文本缓存在 LRU 中，重复计算不再解析。
+
+代价上限：
+    max_length      表达式的字符数，超过时不做解析
+    max_nodes       表达式的语法节点数
+    max_int_bits    整数运算结果的位数，9**9**9 这类在计算前就会被拒绝
+    max_values      批量计算时的取值个数
+    max_steps       批量计算的总步数（节点数 × 取值个数）
+"""
+import ast
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+Number = Union[int, float]
+
+
+class CalcError(ValueError):
+    """表达式不合法或超出计算限制"""
+
+
+# round 的小数位数上限，round(5, -10**100) 这类调用会在 int 运算中耗尽 CPU
+MAX_ROUND_DIGITS = 100
+
+
+def _round(number: Number, ndigits: Optional[int] = None) -> Number:
+    if ndigits is None:
+        return round(number)
+    if isinstance(ndigits, bool) or not isinstance(ndigits, int):
+        raise CalcError("round 的小数位数必须是整数")
+    if abs(ndigits) > MAX_ROUND_DIGITS:
+        raise CalcError(f"round 的小数位数不能超过 {MAX_ROUND_DIGITS}")
+    return round(number, ndigits)
+
+
+FUNCTIONS = {
+    "abs": abs, "round": _round, "min": min, "max": max,
+    "sqrt": math.sqrt, "exp": math.exp, "log": math.log, "log2": math.log2, "log10": math.log10,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "floor": math.floor, "ceil": math.ceil,
+}
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+_BIN_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_UNARY_OPS = (ast.UAdd, ast.USub)
+# 批量计算时存放取值序列的全局变量名，用户表达式中的名字不能以下划线开头，不会冲突
+_VALUES = "_values"
+
+
+class CompiledExpression:
+    """编译后的表达式，可以反复求值"""
+
+    def __init__(self, source: str, names: Tuple[str, ...], code, node_count: int, env: Dict):
+        self.source = source
+        self.names = names
+        self.node_count = node_count
+        self._code = code
+        self._env = env
+
+    def __call__(self, **variables: Number) -> Number:
+        missing = [name for name in self.names if name not in variables]
+        if missing:
+            raise CalcError(f"缺少变量: {', '.join(missing)}")
+        return _run(self._code, dict(self._env, **variables))
+
+
+def _run(code, env: Dict):
+    try:
+        result = eval(code, env)
+    except CalcError:
+        raise
+    except ZeroDivisionError:
+        raise CalcError("除数不能为 0")
+    except OverflowError:
+        raise CalcError("结果超出浮点数范围")
+    except (RecursionError, MemoryError):
+        raise CalcError("表达式太复杂")
+    except (ValueError, TypeError) as e:
+        raise CalcError(f"计算错误: {e}")
+    if isinstance(result, complex) or (isinstance(result, list) and any(isinstance(v, complex) for v in result)):
+        raise CalcError("结果为复数，不支持")
+    return result
+
+
+class _Validator(ast.NodeVisitor):
+    """检查语法树只包含白名单中的节点，并统计节点数"""
+
+    def __init__(self, names: Sequence[str], max_int_bits: int):
+        self.names = set(names)
+        self.max_int_bits = max_int_bits
+        self.count = 0
+
+    def generic_visit(self, node):
+        raise CalcError(f"不支持的语法: {type(node).__name__}")
+
+    def visit(self, node):
+        self.count += 1
+        return super().visit(node)
+
+    def visit_Expression(self, node):
+        self.visit(node.body)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise CalcError(f"不支持的常量: {node.value!r}")
+        if isinstance(node.value, int) and node.value.bit_length() > self.max_int_bits:
+            raise CalcError("数字太大")
+
+    def visit_Name(self, node):
+        if node.id not in self.names and node.id not in CONSTANTS:
+            raise CalcError(f"未知的名称: {node.id}")
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _BIN_OPS):
+            raise CalcError(f"不支持的运算: {type(node.op).__name__}")
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, _UNARY_OPS):
+            raise CalcError(f"不支持的运算: {type(node.op).__name__}")
+        self.visit(node.operand)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise CalcError("只能调用内置的数学函数")
+        if node.keywords:
+            raise CalcError("函数不支持关键字参数")
+        for arg in node.args:
+            self.visit(arg)
+
+
+class _Guard(ast.NodeTransformer):
+    """把乘法和乘方替换为 _mul(a, b) / _pow(a, b)，运算前检查结果大小"""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        name = {ast.Mult: "_mul", ast.Pow: "_pow"}.get(type(node.op))
+        if name is None:
+            return node
+        return ast.copy_location(
+            ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[node.left, node.right], keywords=[]),
+            node)
+
+
+def _make_guards(max_int_bits: int) -> Dict:
+    def check_int(value):
+        if isinstance(value, int) and value.bit_length() > max_int_bits:
+            raise CalcError("结果太大")
+        return value
+
+    def mul(a, b):
+        if isinstance(a, int) and isinstance(b, int) and a.bit_length() + b.bit_length() > max_int_bits + 1:
+            raise CalcError("结果太大")
+        return a * b
+
+    def pow_(a, b):
+        if isinstance(a, int) and isinstance(b, int) and abs(a) > 1:
+            if b > 0 and (a.bit_length() - 1) * b > max_int_bits:
+                raise CalcError("结果太大")
+        return check_int(a ** b)
+
+    return {"_mul": mul, "_pow": pow_}
+
+
+class ExpressionEngine:
+    """安全的算术表达式引擎，编译结果按 (表达式, 变量名) 缓存"""
+
+    def __init__(self, cache_size: int = 256, max_nodes: int = 200, max_int_bits: int = 4096,
+                 max_values: int = 10000, max_steps: int = 1000000, max_length: int = 1000):
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self.max_nodes = max_nodes
+        self.max_int_bits = max_int_bits
+        self.max_values = max_values
+        self.max_steps = max_steps
+        self._env = {"__builtins__": {}, **FUNCTIONS, **CONSTANTS, **_make_guards(max_int_bits)}
+        self._cache: "OrderedDict[Tuple[str, Tuple[str, ...], bool], CompiledExpression]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, expression: str, names: Sequence[str] = (), _vector: bool = False) -> CompiledExpression:
+        """解析并编译表达式，names 为允许出现的变量名"""
+        names = tuple(names)
+        key = (expression, names, _vector)
+        with self._lock:
+            compiled = self._cache.get(key)
+            if compiled is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        for name in names:
+            if not name.isidentifier() or name.startswith("_") or name in FUNCTIONS:
+                raise CalcError(f"变量名不合法: {name}")
+        # 先限制长度再解析：((((…)))) 这类深层嵌套在节点计数之前就会耗尽解析器的栈
+        if len(expression) > self.max_length:
+            raise CalcError(f"表达式太长（超过 {self.max_length} 个字符）")
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+            validator = _Validator(names, self.max_int_bits)
+            validator.visit(tree)
+            if validator.count > self.max_nodes:
+                raise CalcError(f"表达式太长（超过 {self.max_nodes} 个节点）")
+            tree = _Guard().visit(tree)
+        except CalcError:
+            raise
+        except (SyntaxError, ValueError):
+            # ValueError: 表达式中含有空字符
+            raise CalcError("表达式格式错误")
+        except (RecursionError, MemoryError):
+            raise CalcError("表达式嵌套太深")
+
+        if _vector:
+            # [表达式 for 变量 in _values]，整个批量计算在一段字节码中完成
+            tree = ast.Expression(body=ast.ListComp(
+                elt=tree.body,
+                generators=[ast.comprehension(target=ast.Name(id=names[0], ctx=ast.Store()),
+                                              iter=ast.Name(id=_VALUES, ctx=ast.Load()),
+                                              ifs=[], is_async=0)]))
+        ast.fix_missing_locations(tree)
+        try:
+            code = compile(tree, "<calc>", "eval")
+        except (RecursionError, MemoryError):
+            raise CalcError("表达式嵌套太深")
+        compiled = CompiledExpression(expression, names, code, validator.count, self._env)
+
+        with self._lock:
+            self._cache[key] = compiled
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return compiled
+
+    def evaluate(self, expression: str, **variables: Number) -> Number:
+        """计算表达式的值"""
+        return self.compile(expression, tuple(sorted(variables)))(**variables)
+
+    def evaluate_many(self, expression: str, name: str, values: Iterable[Number]) -> List[Number]:
+        """对变量 name 的每个取值计算表达式，values 可以是 range 或数字列表"""
+        if not isinstance(values, (range, list, tuple)):
+            values = list(values)
+        if len(values) > self.max_values:
+            raise CalcError(f"取值太多（最多 {self.max_values} 个）")
+        compiled = self.compile(expression, (name,), _vector=True)
+        if compiled.node_count * len(values) > self.max_steps:
+            raise CalcError("计算量超出限制")
+        for value in values if not isinstance(values, range) else (values.start, values.stop):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise CalcError(f"取值必须是数字: {value!r}")
+            if isinstance(value, int) and value.bit_length() > self.max_int_bits:
+                raise CalcError("数字太大")
+        return _run(compiled._code, dict(compiled._env, **{_VALUES: values}))
+
+    def parse_values(self, text: str) -> Union[range, List[Number]]:
+        """
+        解析批量计算的取值
+
+        1..10 表示 1 到 10（含），1..10..2 指定步长，[1, 2.5, 4] 为列表
+        """
+        text = text.strip()
+        if ".." in text:
+            parts = text.split("..")
+            if len(parts) not in (2, 3):
+                raise CalcError("范围格式应为 起点..终点 或 起点..终点..步长")
+            try:
+                start, stop, *step = (int(part) for part in parts)
+            except ValueError:
+                raise CalcError("范围的起点、终点和步长必须是整数")
+            step = step[0] if step else 1
+            if step == 0:
+                raise CalcError("步长不能为 0")
+            return range(start, stop + (1 if step > 0 else -1), step)
+        try:
+            values = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            raise CalcError("取值格式错误")
+        if not isinstance(values, (list, tuple)):
+            raise CalcError("取值应为范围或列表")
+        return list(values)
+
+    def cache_info(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._cache), "max_size": self.cache_size}
+
+
+_default_engine: Optional[ExpressionEngine] = None
+_default_engine_lock = threading.Lock()
+
+
+def get_default_engine() -> ExpressionEngine:
+    """进程内共享的默认引擎"""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = ExpressionEngine()
+        return _default_engine
@@ -10,6 +10,7 @@
 """
 
 from framework import WXFramework, CommandHandler, TimedTaskManager
+from calc import CalcError, get_default_engine
 
 
 class CustomCommandHandler(CommandHandler):
@@ -39,25 +40,40 @@ class CustomCommandHandler(CommandHandler):
 class CalculatorCommandHandler(CommandHandler):
     """计算器功能示例"""
     
+    # 批量计算放到进程池中执行，不阻塞消息接收
+    cpu_bound = True
+    timeout = 5
+    
     def __init__(self):
         super().__init__("计算器", "简单的数学计算功能")
     
     def handle(self, message: str) -> str:
         try:
-            # 简单的数学表达式计算
             if message.startswith("计算"):
                 expression = message[2:].strip()
-                result = eval(expression)  # 注意：生产环境中应该使用更安全的方法
+                engine = get_default_engine()
+                # 计算 x**2; x=1..10 对变量的每个取值分别计算
+                if ";" in expression:
+                    expression, binding = (part.strip() for part in expression.split(";", 1))
+                    name, _, values_text = binding.partition("=")
+                    name, values = name.strip(), engine.parse_values(values_text)
+                    results = engine.evaluate_many(expression, name, values)
+                    lines = [f"{name}={value}: {result}" for value, result in zip(values, results)]
+                    return f"计算结果: {expression}\n" + "\n".join(lines[:50]) + \
+                        (f"\n… 共 {len(lines)} 个结果" if len(lines) > 50 else "")
+                result = engine.evaluate(expression)
                 return f"计算结果: {expression} = {result}"
             else:
                 return """🧮 计算器功能：
                 
 • 计算 1+1 - 计算数学表达式
 • 计算 2*3+4 - 支持复杂表达式
+• 计算 sqrt(2)*pi - 支持常用数学函数
+• 计算 x**2; x=1..10 - 对一组取值批量计算
 • 退出 - 返回主菜单
 
 💡 示例: 计算 10+5*2"""
-        except Exception as e:
+        except CalcError as e:
             return f"❌ 计算错误: {str(e)}"
 
 
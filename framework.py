@@ -1,3 +1,10 @@
+import asyncio
+import contextlib
+import contextvars
+import csv
+import functools
+import inspect
+import multiprocessing
 import threading
 import time
 import schedule
@@ -5,16 +12,54 @@ import json
 import os
 import subprocess
 import sys
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from typing import Dict, List, Callable, Any, Optional
+from typing import Deque, Dict, List, Callable, Any, Optional, Tuple, Iterable, Iterator
 from abc import ABC, abstractmethod
-from lib import WXFilehelper, Message
+from lib import WXFilehelper, Message, SessionExpiredError, EXPIRED_RETCODES
+from session import SessionHealthMonitor
+from memory_monitor import MemoryMonitor
+from log import get_logger
+from media import MediaDownloader, MediaFile
+from middleware import DROP, MessageContext, Middleware, DebounceMiddleware, TimingMiddleware
+from script_registry import ScriptRegistry
+from kvstore import KVStore, get_default_store
+from http_client import HttpClient, get_default_client
+from history import MessageHistory, DIRECTION_IN
+from gateway import SendGateway
+from plugins import PluginLoader, PluginSpec, create_handler
+from suggest import CommandSuggester
+from task_history import TaskRun, TaskRunHistory, percentile, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_SKIPPED
+from heartbeat import Heartbeat, Watchdog
+from tracing import get_tracer, is_recording, NOOP_SPAN, setup_tracing, shutdown_tracing, Tracer, SPAN_KIND_CLIENT, SPAN_KIND_SERVER
 WX_LOGIN_HOST = "https://login.wx.qq.com"
 WX_FILEHELPER_HOST = "https://szfilehelper.weixin.qq.com"
 WX_FILEUPLOAD_HOST = "https://file.wx2.qq.com"
 
+logger = get_logger("framework")
+
 class CommandHandler(ABC):
-    """指令处理器基类"""
+    """指令处理器基类
+
+    handle 可以是普通方法，也可以是 async def 协程。
+    协程处理器会在 CommandFramework 的共享事件循环上执行，超过 timeout 秒自动取消。
+    
+    cpu_bound 为 True 的处理器会被序列化后放到进程池中执行，不受 GIL 限制，
+    超过 timeout 秒时终止执行它的子进程。注意 handle 在子进程中对 self 的修改不会带回主进程。
+    
+    takes_arguments 为 True 时，除了先进入功能再发送内容，也可以在主菜单直接发送
+    “指令 参数”（如 “搜索 关键词”），此时 handle 收到的是完整消息。
+    """
+    
+    # 异步 / CPU 密集型处理器的超时时间（秒）
+    timeout: float = 30
+    # 是否在进程池中执行
+    cpu_bound: bool = False
+    # 是否支持 “指令 参数” 形式的一次性调用
+    takes_arguments: bool = False
     
     def __init__(self, name: str, description: str):
         self.name = name
@@ -25,11 +70,93 @@ class CommandHandler(ABC):
         """处理指令，返回回复内容"""
         pass
     
+    def handle_media(self, media: MediaFile) -> Optional[str]:
+        """处理收到的图片/文件等媒体消息，返回回复内容，None 表示不回复
+        
+        media 是下载中的文件句柄，访问 media.path 或 media.open() 会等待下载完成，
+        不想阻塞时可以用 media.add_done_callback 在下载完成后再处理。
+        """
+        return None
+    
+    def is_async(self) -> bool:
+        """是否为异步处理器"""
+        handle = self.handle
+        return _is_coroutine_function(getattr(handle, "__func__", handle))
+    
     def get_help(self) -> str:
         """获取帮助信息"""
         return f"{self.name}: {self.description}"
 
 
+@functools.lru_cache(maxsize=256)
+def _is_coroutine_function(func) -> bool:
+    """inspect.iscoroutinefunction 的缓存版本，每条消息分发时都要判断一次"""
+    return inspect.iscoroutinefunction(func)
+
+
+class LazyCommandHandler(CommandHandler):
+    """插件指令的占位处理器，第一次处理消息时才导入插件模块"""
+    
+    def __init__(self, spec: PluginSpec, loader: PluginLoader):
+        super().__init__(spec.name, spec.description)
+        self.spec = spec
+        self.loader = loader
+        self.aliases = spec.aliases
+        # 路由和调度需要的属性从源码中读取，不必为此导入模块
+        for attr, value in spec.attributes.items():
+            if attr != "cpu_bound":
+                setattr(self, attr, value)
+        self._target: Optional[CommandHandler] = None
+        self._error: Optional[str] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def loaded(self) -> bool:
+        return self._target is not None
+    
+    @property
+    def cpu_bound(self) -> bool:
+        # 加载失败时在当前进程中回复错误信息，不再交给进程池
+        return bool(self.spec.attributes.get("cpu_bound")) and self._load() is not None
+    
+    def _load(self) -> Optional[CommandHandler]:
+        if self._target is None and self._error is None:
+            with self._lock:
+                if self._target is None and self._error is None:
+                    try:
+                        self._target = self.loader.load(self.spec)
+                    except Exception as e:
+                        self._error = str(e)
+                        logger.error("插件加载失败: %s", e, extra={"plugin": self.name})
+        return self._target
+    
+    def handle(self, message: str) -> str:
+        target = self._load()
+        if target is None:
+            return f"❌ 插件 {self.name} 加载失败: {self._error}"
+        return target.handle(message)
+    
+    def handle_media(self, media: MediaFile) -> Optional[str]:
+        target = self._load()
+        return target.handle_media(media) if target else None
+    
+    def is_async(self) -> bool:
+        target = self._load()
+        return target.is_async() if target else False
+    
+    def get_help(self) -> str:
+        text = super().get_help()
+        if self.aliases:
+            text += f"（别名: {'、'.join(self.aliases)}）"
+        return text
+    
+    def __reduce__(self):
+        # CPU 密集型插件传给进程池时，子进程同样注入 namespace 后导入插件并创建处理器，
+        # 不会按模块名直接导入插件（插件中没有 import framework）
+        self._load()
+        return create_handler, (self.spec, self.loader.namespace)
+
+
 class MenuCommandHandler(CommandHandler):
     """菜单指令处理器"""
     
@@ -39,8 +166,11 @@ class MenuCommandHandler(CommandHandler):
     
     def handle(self, message: str) -> str:
         help_text = "📋 可用功能列表：\n\n"
+        listed = set()
         for name, handler in self.command_handlers.items():
-            if name != "菜单":
+            # 别名指向同一个处理器，只列出一次
+            if name != "菜单" and id(handler) not in listed:
+                listed.add(id(handler))
                 help_text += f"• {handler.get_help()}\n"
         help_text += "\n💡 输入功能名称即可使用对应功能"
         help_text += "\n🔙 输入 '退出' 可返回主菜单"
@@ -70,17 +200,44 @@ class CloseCommandHandler(CommandHandler):
         return "程序正在关闭..."
 
 
+# 上一次执行尚未结束时的处理策略
+OVERLAP_SKIP = "skip"    # 跳过本次执行
+OVERLAP_QUEUE = "queue"  # 排队，等上一次结束后再执行
+OVERLAP_ALLOW = "allow"  # 允许并行执行
+OVERLAP_POLICIES = (OVERLAP_SKIP, OVERLAP_QUEUE, OVERLAP_ALLOW)
+
+TASK_TYPES = ("daily", "weekly", "once")
+
+# 错峰/抖动窗口（秒）必须小于一天，否则偏移量会绕回设定时间附近
+DAY_SECONDS = 86400
+
+
+def validate_fire_window(window: int, name: str = "抖动窗口"):
+    """检查错峰/抖动窗口，不合法时抛出 ValueError"""
+    if window < 0:
+        raise ValueError(f"{name}不能为负数")
+    if window >= DAY_SECONDS:
+        raise ValueError(f"{name}必须小于一天（{DAY_SECONDS} 秒）")
+
+# 批量导入/导出使用的字段
+TASK_EXPORT_FIELDS = ["task_id", "script_path", "schedule_time", "task_type", "enabled",
+                      "description", "overlap_policy", "jitter", "created_at"]
+
+
 class TimedTask:
     """定时任务类"""
     
     def __init__(self, task_id: str, script_path: str, schedule_time: str, 
-                 task_type: str = "daily", enabled: bool = True, description: str = ""):
+                 task_type: str = "daily", enabled: bool = True, description: str = "",
+                 overlap_policy: str = OVERLAP_SKIP, jitter: Optional[int] = None):
         self.task_id = task_id
         self.script_path = script_path  # 脚本文件路径
         self.schedule_time = schedule_time  # "HH:MM" 格式
         self.task_type = task_type  # "daily", "weekly", "once"
         self.enabled = enabled
         self.description = description  # 任务描述
+        self.overlap_policy = overlap_policy  # "skip", "queue", "allow"
+        self.jitter = jitter  # 抖动窗口（秒），None 表示使用管理器的错峰设置，0 表示不错峰
         self.created_at = datetime.now()
     
     def to_dict(self) -> Dict:
@@ -91,6 +248,8 @@ class TimedTask:
             "task_type": self.task_type,
             "enabled": self.enabled,
             "description": self.description,
+            "overlap_policy": self.overlap_policy,
+            "jitter": self.jitter,
             "created_at": self.created_at.isoformat()
         }
     
@@ -102,7 +261,9 @@ class TimedTask:
             data["schedule_time"],
             data["task_type"],
             data["enabled"],
-            data.get("description", "")
+            data.get("description", ""),
+            data.get("overlap_policy", OVERLAP_SKIP),
+            data.get("jitter")
         )
         task.created_at = datetime.fromisoformat(data["created_at"])
         return task
@@ -111,12 +272,25 @@ class TimedTask:
 class ScriptEnvironment:
     """脚本执行环境，为脚本提供发送消息的权限"""
     
-    def __init__(self, message_instance: Message):
+    def __init__(self, message_instance: Message, script_registry: Optional[ScriptRegistry] = None,
+                 kv_store: Optional[KVStore] = None, http_client: Optional[HttpClient] = None):
         self.message = message_instance
+        self.script_registry = script_registry
+        self.kv_store = kv_store or get_default_store()
+        # 所有脚本共用的 HTTP 客户端，连接和响应缓存在多次运行之间复用
+        self.http_client = http_client or get_default_client()
+        # 本次执行中发送的消息数
+        self.sent_count = 0
         self.globals = {
             'send_message': self.send_message,
             'send_file': self.send_file,
+            'send_files': self.send_files,
             'get_time': self.get_time,
+            'kv_get': self.kv_store.get,
+            'kv_set': self.kv_store.set,
+            'kv_incr': self.kv_store.incr,
+            'http_get': self.http_client.get,
+            'http_post': self.http_client.post,
             'print': self.print_with_timestamp,
             'datetime': datetime,
             'time': time,
@@ -125,33 +299,62 @@ class ScriptEnvironment:
             'sys': sys
         }
     
-    def send_message(self, content: str):
-        """发送文本消息"""
+    def send_message(self, content: str) -> bool:
+        """发送文本消息，返回是否已发送（会话失效期间进入待发送队列时为 False）"""
         try:
-            self.message.send_msg(content=content)
-            print(f"消息已发送: {content}")
+            sent = bool(self.message.send_msg(content=content))
         except Exception as e:
-            print(f"发送消息失败: {e}")
+            logger.error("发送消息失败: %s", e)
+            return False
+        if sent:
+            self.sent_count += 1
+            logger.info("消息已发送", extra={"content": content})
+        else:
+            logger.warning("消息未发送（会话失效时已进入待发送队列）", extra={"content": content})
+        return sent
     
-    def send_file(self, file_path: str):
-        """发送文件"""
+    def send_file(self, file_path: str) -> bool:
+        """发送文件，返回是否已发送（会话失效期间进入待发送队列时为 False）"""
+        if not os.path.exists(file_path):
+            logger.warning("文件不存在: %s", file_path)
+            return False
         try:
+            sent = bool(self.message.send_msg(file_path=file_path))
+        except Exception as e:
+            logger.error("发送文件失败: %s", e)
+            return False
+        if sent:
+            self.sent_count += 1
+            logger.info("文件已发送", extra={"file_path": file_path})
+        else:
+            logger.warning("文件未发送（会话失效时已进入待发送队列）", extra={"file_path": file_path})
+        return sent
+    
+    def send_files(self, file_paths: List[str], max_workers: Optional[int] = None) -> int:
+        """批量发送文件：并发上传，按顺序发送，返回成功发送的数量"""
+        existing = []
+        for file_path in file_paths:
             if os.path.exists(file_path):
-                self.message.send_msg(file_path=file_path)
-                print(f"文件已发送: {file_path}")
+                existing.append(file_path)
             else:
-                print(f"文件不存在: {file_path}")
+                logger.warning("文件不存在: %s", file_path)
+        try:
+            results = self.message.send_files(existing, max_workers=max_workers)
         except Exception as e:
-            print(f"发送文件失败: {e}")
+            logger.error("批量发送文件失败: %s", e)
+            return 0
+        sent = sum(1 for result in results if result)
+        self.sent_count += sent
+        logger.info("文件已批量发送", extra={"count": sent, "total": len(file_paths)})
+        return sent
     
     def get_time(self):
         """获取当前时间"""
         return datetime.now()
     
-    def print_with_timestamp(self, *args, **kwargs):
-        """带时间戳的打印"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}]", *args, **kwargs)
+    def print_with_timestamp(self, *args, sep: str = " ", **kwargs):
+        """脚本的 print，输出到结构化日志（时间戳由日志记录）"""
+        logger.info(sep.join(str(arg) for arg in args), extra={"source": "script"})
     
     def execute_script(self, script_path: str):
         """执行脚本文件"""
@@ -159,43 +362,214 @@ class ScriptEnvironment:
             raise FileNotFoundError(f"脚本文件不存在: {script_path}")
         
         try:
-            # 读取脚本内容
-            with open(script_path, 'r', encoding='utf-8') as f:
-                script_content = f.read()
+            # 优先使用脚本索引中预编译的代码，索引外的脚本直接读取
+            code = self.script_registry.get_code(script_path) if self.script_registry else None
+            if code is None:
+                with open(script_path, 'r', encoding='utf-8') as f:
+                    code = f.read()
             
             # 在安全环境中执行脚本
-            exec(script_content, self.globals, {})
+            exec(code, self.globals, {})
             
         except Exception as e:
-            print(f"脚本执行错误: {e}")
+            logger.error("脚本执行错误: %s", e, extra={"script_path": script_path})
             raise
 
 
 class TimedTaskManager:
-    """定时任务管理器"""
+    """定时任务管理器
+    
+    到期的任务会提交到线程池并发执行，max_workers 控制最大并行数，
+    调度线程本身只负责触发，不会被慢任务拖住。
+    
+    stagger_window 大于 0 时，任务的实际触发时间会在设定时间之后的
+    stagger_window 秒内错开，偏移量由任务ID哈希得出，重启后保持不变；
+    任务自身的 jitter 不为 None 时优先于 stagger_window（0 表示该任务不错峰）。
+    偏移后会跨过午夜的任务改为提前相同的秒数，仍然错开而不是都挤在 23:59:59；
+    窗口必须小于一天（DAY_SECONDS），设置时不合法的窗口抛出 ValueError。
+    
+    每次运行（包括因重叠策略跳过的运行）都会记录到 run_history，
+    可以通过 get_task_stats / get_slot_stats 查看耗时和调度延迟。
+    
+    scheduler 和 clock 默认使用 schedule 的全局调度器和 time.time，
+    模拟运行（见 simulate.py）时替换为独立的调度器和虚拟时钟，
+    kv_store 和 http_client 也替换为内存存储和只记录请求的客户端。
+    
+    调度线程每轮更新 heartbeat；设置了 watchdog 和 script_stall_timeout 时，
+    运行超过 script_stall_timeout 秒的脚本也会被视为卡死并转储线程栈。
+    
+    设置了 on_upcoming 时，距下一次触发不到 prewarm_lead 秒时调用一次 on_upcoming(触发时间)，
+    用于提前预热连接，每个触发时间只调用一次。
+    """
+    
+    # 运行记录落盘间隔（秒）
+    RUN_HISTORY_SAVE_INTERVAL = 30
     
-    def __init__(self, message_instance: Message):
+    def __init__(self, message_instance: Message, max_workers: int = 4, stagger_window: int = 0,
+                 script_registry: Optional[ScriptRegistry] = None, kv_store: Optional[KVStore] = None,
+                 run_history: Optional[TaskRunHistory] = None,
+                 scheduler: Optional[schedule.Scheduler] = None, clock: Callable[[], float] = time.time,
+                 http_client: Optional[HttpClient] = None):
         self.message = message_instance
+        self.scheduler = scheduler or schedule.default_scheduler
+        self.clock = clock
+        self.run_history = run_history or TaskRunHistory()
+        self.script_registry = script_registry or ScriptRegistry("scripts")
+        self.kv_store = kv_store or get_default_store()
+        # 脚本使用的 HTTP 客户端，None 时使用进程内共享的默认客户端
+        self.http_client = http_client
         self.tasks: Dict[str, TimedTask] = {}
         self.task_file = "timed_tasks.json"
         self.load_tasks()
         self.scheduler_thread = None
         self.running = False
+        self.max_workers = max_workers
+        validate_fire_window(stagger_window, "错峰窗口")
+        self.stagger_window = stagger_window
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # 每个任务正在执行/排队等待的次数
+        self._run_lock = threading.Lock()
+        self._active_runs: Dict[str, int] = {}
+        # 排队等待的运行，记录各自的计划触发时间
+        self._queued_runs: Dict[str, Deque[float]] = {}
+        # 任务ID生成状态，保证同一秒内添加多个任务也不会冲突
+        self._id_lock = threading.Lock()
+        self._last_id_ts = 0
+        self._id_seq = 0
+        # 卡死检测：调度线程的心跳，重启时旧线程根据 generation 退出
+        self.heartbeat = Heartbeat("scheduler", deadline=30)
+        self.watchdog: Optional[Watchdog] = None
+        self.script_stall_timeout: Optional[float] = None
+        self._scheduler_generation = 0
+        # 触发前的准备回调，如预热连接
+        self.on_upcoming: Optional[Callable[[float], Any]] = None
+        self.prewarm_lead = 20
+        self._prepared_fire_time: Optional[float] = None
     
-    def add_task(self, script_path: str, schedule_time: str, task_type: str = "daily", description: str = "") -> str:
+    def _generate_task_id(self) -> str:
+        """生成单调递增且唯一的任务ID：task_<秒> 或 task_<秒>_<序号>"""
+        with self._id_lock:
+            ts = int(time.time())
+            if ts > self._last_id_ts:
+                self._last_id_ts = ts
+                self._id_seq = 0
+            else:
+                self._id_seq += 1
+            while True:
+                task_id = f"task_{self._last_id_ts}"
+                if self._id_seq:
+                    task_id += f"_{self._id_seq}"
+                if task_id not in self.tasks:
+                    return task_id
+                self._id_seq += 1
+    
+    def add_task(self, script_path: str, schedule_time: str, task_type: str = "daily", description: str = "",
+                 overlap_policy: str = OVERLAP_SKIP) -> str:
         """添加定时任务"""
-        task_id = f"task_{int(time.time())}"
-        task = TimedTask(task_id, script_path, schedule_time, task_type, True, description)
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError(f"未知的重叠策略: {overlap_policy}")
+        task_id = self._generate_task_id()
+        task = TimedTask(task_id, script_path, schedule_time, task_type, True, description, overlap_policy)
         self.tasks[task_id] = task
         self.save_tasks()
         self._schedule_task(task)
         return task_id
     
+    def _task_from_record(self, record: Dict) -> TimedTask:
+        """校验一条导入记录并生成任务（分配新ID），不合法时抛出 ValueError"""
+        if not isinstance(record, dict):
+            raise ValueError(f"记录应为对象，实际为 {type(record).__name__}")
+        script_path = str(record.get("script_path") or "").strip()
+        schedule_time = str(record.get("schedule_time") or "").strip()
+        task_type = str(record.get("task_type") or "daily").strip()
+        overlap_policy = str(record.get("overlap_policy") or OVERLAP_SKIP).strip()
+        enabled = record.get("enabled", True)
+        if isinstance(enabled, str):
+            enabled = enabled.strip().lower() not in ("false", "0", "no", "")
+        
+        datetime.strptime(schedule_time, "%H:%M")
+        if not self.script_registry.exists(script_path):
+            raise ValueError(f"脚本文件不存在: {script_path}")
+        if task_type not in TASK_TYPES:
+            raise ValueError(f"未知的任务类型: {task_type}")
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError(f"未知的重叠策略: {overlap_policy}")
+        jitter = record.get("jitter")
+        jitter = None if jitter is None or str(jitter).strip() == "" else int(jitter)
+        if jitter is not None:
+            validate_fire_window(jitter)
+        
+        return TimedTask(self._generate_task_id(), script_path, schedule_time, task_type,
+                         bool(enabled), str(record.get("description") or ""), overlap_policy, jitter)
+    
+    def import_tasks(self, records: Iterable[Dict]) -> List[str]:
+        """批量导入任务
+        
+        先校验全部记录，任意一条不合法则整体放弃（抛出 ValueError 并指明行号）；
+        全部合法后一次性加入、只写一次任务文件，返回新任务ID列表。
+        """
+        new_tasks = []
+        for index, record in enumerate(records, 1):
+            try:
+                new_tasks.append(self._task_from_record(record))
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"第 {index} 条记录无效: {e}") from e
+        
+        for task in new_tasks:
+            self.tasks[task.task_id] = task
+        self.save_tasks()
+        if self.running:
+            for task in new_tasks:
+                self._schedule_task(task)
+        return [task.task_id for task in new_tasks]
+    
+    def import_tasks_from_file(self, file_path: str) -> List[str]:
+        """从 CSV / JSON / JSON Lines 文件批量导入任务"""
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            if file_path.endswith(".csv"):
+                return self.import_tasks(csv.DictReader(f))
+            if file_path.endswith(".jsonl"):
+                return self.import_tasks(json.loads(line) for line in f if line.strip())
+            data = json.load(f)
+            if not isinstance(data, (list, dict)):
+                raise ValueError(f"JSON 文件顶层应为数组或对象，实际为 {type(data).__name__}")
+            # 兼容 timed_tasks.json 的 {task_id: task} 格式
+            if isinstance(data, dict):
+                data = list(data.values())
+            return self.import_tasks(data)
+    
+    def iter_export(self, fmt: str = "jsonl") -> Iterator[str]:
+        """逐行生成导出内容，fmt 为 jsonl 或 csv"""
+        if fmt not in ("jsonl", "csv"):
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        if fmt == "csv":
+            buffer = _LineBuffer()
+            writer = csv.DictWriter(buffer, fieldnames=TASK_EXPORT_FIELDS)
+            writer.writeheader()
+            yield buffer.pop()
+            for task in list(self.tasks.values()):
+                writer.writerow(task.to_dict())
+                yield buffer.pop()
+        else:
+            for task in list(self.tasks.values()):
+                yield json.dumps(task.to_dict(), ensure_ascii=False) + "\n"
+    
+    def export_tasks(self, file_path: str) -> int:
+        """流式导出任务到文件，格式由扩展名决定（.csv 或 .jsonl），返回导出数量"""
+        fmt = "csv" if file_path.endswith(".csv") else "jsonl"
+        count = -1 if fmt == "csv" else 0
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            for line in self.iter_export(fmt):
+                f.write(line)
+                count += 1
+        return count
+    
     def remove_task(self, task_id: str) -> bool:
         """删除定时任务"""
         if task_id in self.tasks:
-            schedule.clear(task_id)
+            self.scheduler.clear(task_id)
             del self.tasks[task_id]
+            self.run_history.forget(task_id)
             self.save_tasks()
             return True
         return False
@@ -216,60 +590,267 @@ class TimedTaskManager:
         """禁用任务"""
         if task_id in self.tasks:
             self.tasks[task_id].enabled = False
-            schedule.clear(task_id)
+            self.scheduler.clear(task_id)
             self.save_tasks()
             return True
         return False
     
+    def set_overlap_policy(self, task_id: str, overlap_policy: str) -> bool:
+        """设置任务的重叠策略"""
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError(f"未知的重叠策略: {overlap_policy}")
+        if task_id in self.tasks:
+            self.tasks[task_id].overlap_policy = overlap_policy
+            self.save_tasks()
+            return True
+        return False
+    
+    def set_jitter(self, task_id: str, jitter: Optional[int]) -> bool:
+        """设置任务的抖动窗口（秒）并重新调度，None 表示恢复使用管理器的错峰设置"""
+        if jitter is not None:
+            validate_fire_window(jitter)
+        if task_id in self.tasks:
+            task = self.tasks[task_id]
+            task.jitter = jitter
+            self.scheduler.clear(task_id)
+            self._schedule_task(task)
+            self.save_tasks()
+            return True
+        return False
+    
+    def get_fire_offset(self, task: TimedTask) -> int:
+        """任务相对设定时间的确定性偏移（秒）"""
+        window = self.stagger_window if task.jitter is None else task.jitter
+        if window <= 0:
+            return 0
+        return zlib.crc32(task.task_id.encode("utf-8")) % (window + 1)
+    
+    def get_fire_time(self, task: TimedTask) -> str:
+        """任务的实际触发时间，格式 HH:MM:SS，不跨越当天"""
+        base = datetime.strptime(task.schedule_time, "%H:%M")
+        base_seconds = base.hour * 3600 + base.minute * 60
+        offset = self.get_fire_offset(task)
+        seconds = base_seconds + offset
+        if seconds >= DAY_SECONDS:
+            if offset <= base_seconds:
+                # 跨过午夜时改为提前，保持偏移量的分散
+                seconds = base_seconds - offset
+            else:
+                # 前后都放不下时在设定时间到午夜之间按偏移量取余，仍然分散且不跨越当天
+                seconds = base_seconds + offset % (DAY_SECONDS - base_seconds)
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    
+    def _execute_task(self, task: TimedTask, scheduled_at: float):
+        """在工作线程中执行一次任务脚本，并记录耗时和相对计划时间的延迟"""
+        started_at = self.clock()
+        start = time.perf_counter()
+        lag = max(0.0, started_at - scheduled_at)
+        # 创建脚本执行环境，提供发送消息的权限
+        script_env = ScriptEnvironment(self.message, self.script_registry, self.kv_store, self.http_client)
+        script_heartbeat = None
+        if self.watchdog and self.script_stall_timeout:
+            script_heartbeat = Heartbeat(f"task-{task.task_id}", self.script_stall_timeout)
+            self.watchdog.watch(script_heartbeat)
+            script_heartbeat.beat()
+        with get_tracer().start_trace("task.run", attributes={
+                "task.id": task.task_id, "task.script": task.script_path, "task.lag": lag}) as trace:
+            try:
+                script_env.execute_script(task.script_path)
+                outcome = OUTCOME_OK
+                logger.info("定时任务已执行", extra={"task_id": task.task_id, "script_path": task.script_path,
+                                                  "trace_id": trace.trace_id})
+            except Exception as e:
+                outcome = OUTCOME_ERROR
+                trace.set_error(e)
+                logger.error("定时任务执行失败: %s", e, extra={"task_id": task.task_id, "trace_id": trace.trace_id})
+            finally:
+                if script_heartbeat:
+                    self.watchdog.unwatch(script_heartbeat)
+            trace.set_attribute("task.sent", script_env.sent_count)
+        self.run_history.record(task.task_id, TaskRun(
+            started_at, time.perf_counter() - start, lag, outcome, script_env.sent_count))
+    
+    def _submit_task(self, task: TimedTask, scheduled_at: Optional[float] = None):
+        """任务到期时由调度线程调用，按重叠策略提交到线程池"""
+        if scheduled_at is None:
+            scheduled_at = self.clock()
+        with self._run_lock:
+            active = self._active_runs.get(task.task_id, 0)
+            if active and task.overlap_policy == OVERLAP_SKIP:
+                logger.warning("定时任务仍在执行，跳过本次", extra={"task_id": task.task_id})
+                now = self.clock()
+                self.run_history.record(task.task_id, TaskRun(
+                    now, 0.0, max(0.0, now - scheduled_at), OUTCOME_SKIPPED, 0))
+                return
+            if active and task.overlap_policy == OVERLAP_QUEUE:
+                self._queued_runs.setdefault(task.task_id, deque()).append(scheduled_at)
+                logger.info("定时任务仍在执行，已排队", extra={"task_id": task.task_id})
+                return
+            self._active_runs[task.task_id] = active + 1
+        future = self.executor.submit(self._run_task, task, scheduled_at)
+        future.add_done_callback(functools.partial(self._on_run_done, task.task_id))
+    
+    def _on_run_done(self, task_id: str, future: Future):
+        """stop() 取消了尚未开始的运行时 _run_task 不会执行，在这里归还计数"""
+        if future.cancelled():
+            with self._run_lock:
+                self._release_run(task_id)
+    
+    def _release_run(self, task_id: str):
+        """一次运行结束，需持有 _run_lock"""
+        self._active_runs[task_id] -= 1
+        if not self._active_runs[task_id]:
+            del self._active_runs[task_id]
+            self._queued_runs.pop(task_id, None)
+    
+    def _run_task(self, task: TimedTask, scheduled_at: float):
+        """执行任务，并在同一工作线程中依次执行排队的运行"""
+        while True:
+            self._execute_task(task, scheduled_at)
+            with self._run_lock:
+                queued = self._queued_runs.get(task.task_id)
+                if queued:
+                    scheduled_at = queued.popleft()
+                    continue
+                self._release_run(task.task_id)
+                return
+    
+    def get_task_runs(self, task_id: str) -> List[TaskRun]:
+        """任务最近的运行记录，按时间从早到晚"""
+        return self.run_history.runs(task_id)
+    
+    def get_task_stats(self, task_id: str) -> Dict:
+        """任务最近运行的统计：次数、失败/跳过数、发送消息数、耗时和延迟的 p50/p95（秒）"""
+        return self.run_history.stats(task_id)
+    
+    def get_slot_stats(self) -> List[Dict]:
+        """按实际触发时间（分钟）汇总延迟，延迟最大的时间段排在前面，用于发现过于拥挤的时间段"""
+        slots: Dict[str, List[TaskRun]] = {}
+        tasks: Dict[str, List[str]] = {}
+        for task in self.tasks.values():
+            slot = self.get_fire_time(task)[:5]
+            tasks.setdefault(slot, []).append(task.task_id)
+            slots.setdefault(slot, []).extend(self.run_history.runs(task.task_id))
+        result = []
+        for slot, runs in slots.items():
+            executed = [run for run in runs if run.outcome != OUTCOME_SKIPPED]
+            result.append({
+                "slot": slot,
+                "tasks": tasks[slot],
+                "runs": len(executed),
+                "skipped": len(runs) - len(executed),
+                "lag_p50": percentile((run.lag for run in executed), 50),
+                "lag_p95": percentile((run.lag for run in executed), 95),
+                "duration_p95": percentile((run.duration for run in executed), 95),
+            })
+        result.sort(key=lambda item: item["lag_p95"] or 0, reverse=True)
+        return result
+    
     def _schedule_task(self, task: TimedTask):
         """调度任务"""
         if not task.enabled:
             return
             
         def execute_script():
-            try:
-                # 创建脚本执行环境，提供发送消息的权限
-                script_env = ScriptEnvironment(self.message)
-                script_env.execute_script(task.script_path)
-                print(f"定时任务已执行: {task.script_path}")
-            except Exception as e:
-                print(f"定时任务执行失败: {e}")
+            # 回调执行时 job.next_run 仍是本次的计划触发时间
+            self._submit_task(task, job.next_run.timestamp())
         
+        fire_time = self.get_fire_time(task)
         if task.task_type == "daily":
-            schedule.every().day.at(task.schedule_time).do(execute_script).tag(task.task_id)
+            job = self.scheduler.every().day.at(fire_time).do(execute_script).tag(task.task_id)
         elif task.task_type == "weekly":
             # 这里可以扩展为指定星期几
-            schedule.every().monday.at(task.schedule_time).do(execute_script).tag(task.task_id)
+            job = self.scheduler.every().monday.at(fire_time).do(execute_script).tag(task.task_id)
         elif task.task_type == "once":
             # 一次性任务，在指定时间执行一次
-            schedule.every().day.at(task.schedule_time).do(execute_script).tag(task.task_id)
+            job = self.scheduler.every().day.at(fire_time).do(execute_script).tag(task.task_id)
+    
+    def prune_jobs(self) -> int:
+        """清理不再对应有效任务的 schedule 任务，返回清理数量"""
+        orphans = [job for job in self.scheduler.get_jobs()
+                   if not any(tag in self.tasks and self.tasks[tag].enabled for tag in job.tags)]
+        for job in orphans:
+            self.scheduler.cancel_job(job)
+        return len(orphans)
     
     def start(self):
         """启动定时任务管理器"""
         self.running = True
-        self.scheduler_thread = threading.Thread(target=self._run_scheduler, daemon=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix="timed-task")
+        self.script_registry.start()
+        self._start_scheduler_thread()
+        self.schedule_all()
+    
+    def _start_scheduler_thread(self):
+        self._scheduler_generation += 1
+        self.heartbeat.beat()
+        self.scheduler_thread = threading.Thread(target=self._run_scheduler, args=(self._scheduler_generation,),
+                                                 name=f"scheduler-{self._scheduler_generation}", daemon=True)
         self.scheduler_thread.start()
-        
-        # 重新调度所有启用的任务
+    
+    def restart_scheduler(self, heartbeat: Optional[Heartbeat] = None):
+        """启动新的调度线程替换卡住的线程，旧线程恢复后自行退出；可直接作为 Watchdog 的 on_stall"""
+        if not self.running:
+            return
+        logger.warning("重启调度线程", extra={"generation": self._scheduler_generation + 1})
+        self._start_scheduler_thread()
+    
+    def schedule_all(self):
+        """调度所有启用的任务"""
         for task in self.tasks.values():
             self._schedule_task(task)
     
     def stop(self):
         """停止定时任务管理器"""
         self.running = False
-        schedule.clear()
+        self.scheduler.clear()
+        self.script_registry.stop()
+        if self.executor:
+            # 不等待正在执行的脚本，排队中的运行直接取消：
+            # 重叠策略排队的运行清空，线程池中尚未开始的运行由 _on_run_done 归还计数
+            with self._run_lock:
+                self._queued_runs.clear()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.run_history.save_if_dirty()
     
-    def _run_scheduler(self):
-        """运行调度器"""
-        while self.running:
-            schedule.run_pending()
+    def _run_scheduler(self, generation: int = 0):
+        """运行调度器，被 restart_scheduler 替换后退出"""
+        last_saved = time.monotonic()
+        while self.running and generation == self._scheduler_generation:
+            self.heartbeat.beat()
+            self.scheduler.run_pending()
+            self._prepare_upcoming()
+            if time.monotonic() - last_saved >= self.RUN_HISTORY_SAVE_INTERVAL:
+                self.run_history.save_if_dirty()
+                last_saved = time.monotonic()
             time.sleep(1)
     
+    def _prepare_upcoming(self):
+        """下一次触发临近时调用 on_upcoming"""
+        if not self.on_upcoming or not self.prewarm_lead:
+            return
+        next_run = self.scheduler.get_next_run()
+        if next_run is None:
+            return
+        fire_time = next_run.timestamp()
+        if fire_time == self._prepared_fire_time or fire_time - self.clock() > self.prewarm_lead:
+            return
+        self._prepared_fire_time = fire_time
+        try:
+            self.on_upcoming(fire_time)
+        except Exception as e:
+            logger.error("触发前准备失败: %s", e)
+    
     def save_tasks(self):
         """保存任务到文件"""
         data = {task_id: task.to_dict() for task_id, task in self.tasks.items()}
-        with open(self.task_file, 'w', encoding='utf-8') as f:
+        # 先写临时文件再替换，避免写到一半时进程退出导致任务文件损坏
+        tmp_file = f"{self.task_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.task_file)
     
     def load_tasks(self):
         """从文件加载任务"""
@@ -280,25 +861,110 @@ class TimedTaskManager:
                     self.tasks = {task_id: TimedTask.from_dict(task_data) 
                                  for task_id, task_data in data.items()}
             except Exception as e:
-                print(f"加载定时任务失败: {e}")
+                logger.error("加载定时任务失败: %s", e)
                 self.tasks = {}
 
 
+class _LineBuffer:
+    """供 csv.writer 使用的行缓冲，用于流式导出"""
+    
+    def __init__(self):
+        self.lines: List[str] = []
+    
+    def write(self, line: str):
+        self.lines.append(line)
+    
+    def pop(self) -> str:
+        content = "".join(self.lines)
+        self.lines.clear()
+        return content
+
+
+class AsyncLoopThread:
+    """共享事件循环，在后台线程中运行所有异步指令处理器"""
+    
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """启动事件循环线程（重复调用无副作用）"""
+        with self._lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            
+            def run_loop():
+                asyncio.set_event_loop(self.loop)
+                self.loop.call_soon(ready.set)
+                self.loop.run_forever()
+            
+            self.thread = threading.Thread(target=run_loop, daemon=True)
+            self.thread.start()
+            ready.wait()
+    
+    def submit(self, coro) -> Future:
+        """把协程提交到事件循环，返回 concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def stop(self):
+        """停止事件循环"""
+        with self._lock:
+            if self.loop and self.loop.is_running():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread = None
+
+
+def _handle_in_process(handler: CommandHandler, message: str) -> str:
+    """进程池中执行 CPU 密集型处理器"""
+    return handler.handle(message)
+
+
 class CommandFramework:
     """指令处理框架"""
     
-    def __init__(self, message_instance: Message):
+    def __init__(self, message_instance: Message, process_workers: Optional[int] = None):
         self.message = message_instance
         self.command_handlers: Dict[str, CommandHandler] = {}
         self.current_handler: Optional[CommandHandler] = None
         self.running = False
+        self.async_loop = AsyncLoopThread()
+        self.middlewares: List[Middleware] = []
+        # CPU 密集型处理器使用的进程池，首次使用时创建
+        self.process_workers = process_workers
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._process_pool_lock = threading.Lock()
+        # 指令名索引，用于繁体/全角写法匹配和未知指令的纠错提示，注册指令时更新
+        self.suggester = CommandSuggester()
         
         # 注册基础指令
         self._register_basic_commands()
     
-    def register_command(self, command: str, handler: CommandHandler):
-        """注册指令处理器"""
+    def register_command(self, command: str, handler: CommandHandler, aliases: Iterable[str] = ()):
+        """注册指令处理器，aliases 为指向同一处理器的别名"""
         self.command_handlers[command] = handler
+        self.suggester.add(command)
+        for alias in aliases:
+            self.command_handlers.setdefault(alias, handler)
+            self.suggester.add(alias)
+    
+    def register_plugins(self, loader: PluginLoader) -> List[str]:
+        """注册发现的插件（此时不导入插件模块），与已有指令重名的插件跳过，返回注册的指令名"""
+        registered = []
+        for spec in loader.discover():
+            if spec.name in self.command_handlers:
+                logger.warning("插件指令与已有指令重名，已跳过: %s", spec.name, extra={"plugin_module": spec.module})
+                continue
+            self.register_command(spec.name, LazyCommandHandler(spec, loader), spec.aliases)
+            registered.append(spec.name)
+        return registered
+    
+    def use(self, middleware: Middleware):
+        """添加中间件，按添加顺序执行 before，按相反顺序执行 after"""
+        self.middlewares.append(middleware)
     
     def _register_basic_commands(self):
         """注册基础指令"""
@@ -306,40 +972,352 @@ class CommandFramework:
         self.register_command("退出", ExitCommandHandler())
         self.register_command("关闭", CloseCommandHandler(self))
     
-    def handle_message(self, message: str) -> str:
-        """处理消息"""
+    def handler_for(self, message: str) -> Optional[CommandHandler]:
+        """消息将由哪个处理器处理（不修改状态，也不计算纠错提示）"""
+        return self._route(message, suggest=False)[0]
+    
+    def _route(self, message: str, suggest: bool = True
+               ) -> Tuple[Optional[CommandHandler], Optional[str], Optional[CommandHandler]]:
+        """查找消息对应的处理器，不修改状态
+        
+        返回 (处理器, 直接回复, 新的当前处理器)：处理器和直接回复二者有一个为 None；
+        新的当前处理器为 None 表示不切换，由调用方在中间件放行后再切换。
+        """
         # 如果当前有活跃的处理器，先尝试使用它
         if self.current_handler and self.current_handler.name != "菜单":
             if message.lower() in ["退出", "exit", "quit"]:
-                self.current_handler = self.command_handlers["菜单"]
-                return "已返回主菜单"
+                return None, "已返回主菜单", self.command_handlers["菜单"]
             else:
-                return self.current_handler.handle(message)
+                return self.current_handler, None, None
+        
+        # 否则查找对应的指令处理器，繁体、全角等写法归一化后与指令相同时也视为该指令
+        command = message if message in self.command_handlers else self.suggester.resolve(message)
+        if command in self.command_handlers:
+            handler = self.command_handlers[command]
+            return handler, None, handler if handler.name != "菜单" else None
         
-        # 否则查找对应的指令处理器
-        if message in self.command_handlers:
-            handler = self.command_handlers[message]
-            if handler.name != "菜单":
-                self.current_handler = handler
+        # “指令 参数” 形式
+        name = message.split(maxsplit=1)[0] if message.strip() else ""
+        handler = self.command_handlers.get(name)
+        if handler and handler.takes_arguments:
+            return handler, None, handler
+        suggestions = self.suggester.suggest(message) if suggest else None
+        if suggestions:
+            return None, f"❓ 未知指令，你是不是想输入：{'、'.join(suggestions)}？\n输入 '菜单' 查看所有可用功能", None
+        return None, "❓ 未知指令，输入 '菜单' 查看所有可用功能", None
+    
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                # 使用 spawn 避免在多线程进程中 fork 导致子进程死锁
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._process_pool
+    
+    def _reset_process_pool(self, pool: Optional[ProcessPoolExecutor] = None):
+        """终止进程池中的子进程（用于超时的 CPU 密集型处理器），下次使用时重新创建
+        
+        指定 pool 时只在它仍是当前进程池时重置，避免重复重置已经替换过的新进程池。
+        """
+        with self._process_pool_lock:
+            if pool is not None and pool is not self._process_pool:
+                return
+            pool, self._process_pool = self._process_pool, None
+        if pool is None:
+            return
+        # ProcessPoolExecutor 没有公开终止正在执行任务的接口，只能直接结束子进程
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def _runs_off_thread(handler: CommandHandler) -> bool:
+        """处理器是否在事件循环/进程池中执行，而不是在调用线程中"""
+        return handler.cpu_bound or handler.is_async()
+    
+    @staticmethod
+    def _run_handler(handler: CommandHandler, message: str) -> str:
+        """在调用线程中执行同步处理器"""
+        # 不在采样的 trace 中时不创建 span，也不构造属性字典
+        if not is_recording():
             return handler.handle(message)
+        with get_tracer().span("handler", attributes={"command": handler.name}):
+            return handler.handle(message)
+    
+    async def _run_async_handler(self, handler: CommandHandler, message: str) -> str:
+        """在事件循环上执行异步处理器（或等待进程池中的 CPU 密集型处理器），并施加超时"""
+        # 与 _run_handler 相同：不在采样的 trace 中时不构造属性字典，直接使用 NOOP_SPAN
+        span = get_tracer().span("handler", attributes={
+            "command": handler.name, "handler.cpu_bound": handler.cpu_bound}) if is_recording() else NOOP_SPAN
+        with span:
+            try:
+                if handler.cpu_bound:
+                    return await asyncio.wait_for(self._run_in_process(handler, message), timeout=handler.timeout)
+                return await asyncio.wait_for(handler.handle(message), timeout=handler.timeout)
+            except asyncio.TimeoutError:
+                span.set_error("timeout")
+                return f"⏱️ {handler.name} 处理超时（{handler.timeout}秒）"
+            except BrokenProcessPool as e:
+                span.set_error(e)
+                logger.error("进程池异常: %s", e, extra={"command": handler.name})
+                return f"⚠️ {handler.name} 处理失败，请稍后重试"
+    
+    async def _run_in_process(self, handler: CommandHandler, message: str) -> str:
+        """在进程池中执行处理器
+        
+        其他调用超时会终止整个进程池，此时正在执行的调用收到 BrokenProcessPool，
+        在新的进程池中重新提交一次；本次调用超时（被取消）时由它负责重置进程池。
+        """
+        for attempt in range(2):
+            pool = self._get_process_pool()
+            try:
+                future = pool.submit(_handle_in_process, handler, message)
+            except BrokenProcessPool:
+                # 子进程意外退出后进程池不再接受任务
+                self._reset_process_pool(pool)
+                if attempt:
+                    raise
+                continue
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                self._reset_process_pool(pool)
+                raise
+            except BrokenProcessPool:
+                self._reset_process_pool(pool)
+                if attempt:
+                    raise
+                logger.warning("进程池已被重置，重新提交", extra={"command": handler.name})
+    
+    def _context(self, message: str, handler: Optional[CommandHandler]) -> Optional[MessageContext]:
+        """中间件使用的上下文，没有中间件时不创建"""
+        return MessageContext(message, handler) if self.middlewares else None
+    
+    def _before(self, ctx: Optional[MessageContext]) -> Tuple[bool, Optional[str]]:
+        """依次执行中间件的 before，返回 (是否拦截, 拦截时的回复)"""
+        for middleware in self.middlewares:
+            result = middleware.before(ctx)
+            if result is DROP:
+                return True, None
+            if result is not None:
+                return True, result
+        return False, None
+    
+    def _after(self, ctx: Optional[MessageContext], response: Optional[str]) -> Optional[str]:
+        """按相反顺序执行中间件的 after"""
+        for middleware in reversed(self.middlewares):
+            response = middleware.after(ctx, response)
+        return response
+    
+    def handle_message(self, message: str) -> Optional[str]:
+        """处理消息（同步等待回复），被中间件丢弃时返回 None"""
+        handler, reply, next_handler = self._route(message)
+        ctx = self._context(message, handler)
+        intercepted, short_reply = self._before(ctx)
+        if intercepted:
+            return short_reply
+        if next_handler is not None:
+            self.current_handler = next_handler
+        if handler is None:
+            return self._after(ctx, reply)
+        if self._runs_off_thread(handler):
+            response = self.async_loop.submit(self._run_async_handler(handler, message)).result()
         else:
-            return "❓ 未知指令，输入 '菜单' 查看所有可用功能"
+            response = self._run_handler(handler, message)
+        return self._after(ctx, response)
+    
+    def dispatch_message(self, message: str, reply_callback: Callable[[str], Any]):
+        """处理消息并通过回调发送回复
+        
+        异步处理器被提交到共享事件循环后立即返回，不占用调用线程，
+        回复在线程池中通过 reply_callback 发出；被中间件丢弃的消息不会回复。
+        """
+        handler, reply, next_handler = self._route(message)
+        ctx = self._context(message, handler)
+        intercepted, short_reply = self._before(ctx)
+        if intercepted:
+            if short_reply:
+                reply_callback(short_reply)
+            return
+        # 被中间件拦截（限流、去重）的消息不切换当前功能
+        if next_handler is not None:
+            self.current_handler = next_handler
+        if handler is None or not self._runs_off_thread(handler):
+            response = self._after(ctx, reply if handler is None else self._run_handler(handler, message))
+            if response:
+                reply_callback(response)
+            return
+        
+        async def run_and_reply():
+            response = self._after(ctx, await self._run_async_handler(handler, message))
+            if response:
+                # 线程池不会传递 contextvars，带上当前 trace 的上下文，发送的 span 仍属于这条消息
+                await asyncio.get_running_loop().run_in_executor(
+                    None, contextvars.copy_context().run, reply_callback, response)
+        
+        def on_done(future: Future):
+            if future.exception():
+                logger.error("异步指令处理错误: %s", future.exception())
+        
+        self.async_loop.submit(run_and_reply()).add_done_callback(on_done)
+    
+    def dispatch_media(self, media: MediaFile, reply_callback: Callable[[str], Any]):
+        """把媒体消息交给当前功能的处理器，处理器返回内容时通过回调发送回复"""
+        handler = self.current_handler
+        if handler is None or handler.name == "菜单":
+            return
+        if not inspect.iscoroutinefunction(handler.handle_media):
+            with get_tracer().span("handler", attributes={"command": handler.name}) if is_recording() else NOOP_SPAN:
+                reply = handler.handle_media(media)
+            if reply:
+                reply_callback(reply)
+            return
+        
+        async def run_and_reply():
+            with get_tracer().span("handler", attributes={"command": handler.name}) if is_recording() else NOOP_SPAN:
+                reply = await asyncio.wait_for(handler.handle_media(media), timeout=handler.timeout)
+            if reply:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, contextvars.copy_context().run, reply_callback, reply)
+        
+        def on_done(future: Future):
+            if future.exception():
+                logger.error("异步媒体处理错误: %s", future.exception())
+        
+        self.async_loop.submit(run_and_reply()).add_done_callback(on_done)
+    
+    def shutdown(self):
+        """关闭指令框架"""
+        self.running = False
+        self.async_loop.stop()
+        with self._process_pool_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
 
 
 class WXFramework:
     """微信文件传输助手框架"""
     
-    def __init__(self):
+    def __init__(self, debounce_window: float = 0):
+        """
+        :param debounce_window: 大于 0 时丢弃该秒数内重复发送的相同消息（DebounceMiddleware）；
+            默认关闭，重复发送同一指令或在多步流程中连续回答相同内容都是正常输入
+        """
         # 不直接初始化WXFilehelper，因为它的__init__会阻塞等待登录
         self.wx_helper = None
         self.message = Message()
         self.task_manager = TimedTaskManager(self.message)
         self.command_framework = CommandFramework(self.message)
+        self.session_monitor = SessionHealthMonitor(
+            self.message, resume_session=self._resume_session, relogin=self._relogin)
+        self.memory_monitor = MemoryMonitor()
+        self.media_downloader = MediaDownloader(self.message)
+        self.history = MessageHistory()
+        # 本地 HTTP 发送网关，默认关闭，见 enable_gateway
+        self.gateway: Optional[SendGateway] = None
+        # 卡死检测，默认关闭，见 enable_watchdog
+        self.watchdog: Optional[Watchdog] = None
+        self.listener_heartbeat = Heartbeat("listener", deadline=90)
+        self.restart_session_on_stall = False
+        self._listener_generation = 0
+        # 定时任务触发前预热连接，避免整点发送时才做 DNS 解析和 TLS 握手
+        self.task_manager.on_upcoming = lambda fire_time: self.message.wx_req.warm_up()
+        self._register_memory_evictors()
+        
+        # 记录慢指令；去重需要显式开启
+        self.command_framework.use(TimingMiddleware())
+        if debounce_window > 0:
+            self.command_framework.use(DebounceMiddleware(window=debounce_window))
         self.running = False
         
         # 注册示例功能
         self._register_example_commands()
     
+    def _register_memory_evictors(self):
+        """注册内存超过软上限时的回收函数"""
+        def clear_expired_cookies():
+            # 登录时会重新创建 Message 和 WXRequest 的会话，每次回收时取当前的 cookie
+            cookies = self.message.wx_req.session.cookies
+            before = len(cookies)
+            cookies.clear_expired_cookies()
+            return f"清理 {before - len(cookies)} 个过期 cookie"
+        
+        self.memory_monitor.register_evictor("cookie", clear_expired_cookies)
+        self.memory_monitor.register_evictor(
+            "schedule", lambda: f"清理 {self.task_manager.prune_jobs()} 个失效任务")
+        self.memory_monitor.register_evictor(
+            "scripts", lambda: f"释放 {self.task_manager.script_registry.evict_compiled()} 个编译缓存")
+        self.memory_monitor.register_evictor(
+            "kv", lambda: f"清理 {self.task_manager.kv_store.purge_expired()} 个过期键")
+        self.memory_monitor.register_evictor(
+            "http", lambda: f"清理 {get_default_client().clear_cache()} 个 HTTP 缓存")
+    
+    def enable_gateway(self, **kwargs) -> SendGateway:
+        """开启本地 HTTP 发送网关，参数同 SendGateway（port、unix_socket、queue_size、token 等）
+        
+        需要在 start() 之前调用，登录成功后网关才开始监听。
+        """
+        self.gateway = SendGateway(self.message, **kwargs)
+        return self.gateway
+    
+    def enable_watchdog(self, listener_deadline: float = 90, scheduler_deadline: float = 30,
+                        script_stall_timeout: Optional[float] = None, restart: bool = True,
+                        restart_session: bool = False, max_restarts: int = 3, **kwargs) -> Watchdog:
+        """开启卡死检测，参数同 Watchdog（interval、dump_dir、max_dumps）
+        
+        :param listener_deadline: 消息监听循环两次心跳的最长间隔（秒），synccheck 单次请求最长约 10 秒
+        :param scheduler_deadline: 调度循环两次心跳的最长间隔（秒）
+        :param script_stall_timeout: 脚本运行超过该秒数时转储线程栈，None 表示不检查
+        :param restart: 卡死后启动新的循环线程
+        :param restart_session: 监听循环卡死时先用现有 cookie 重新初始化会话（webwxinit）
+        :param max_restarts: 每个循环一小时内最多重启的次数，超过后只转储线程栈，
+                             避免卡在同一个地方时不断创建新线程
+        
+        需要在 start() 之前调用，登录成功后开始检查。
+        """
+        self.watchdog = Watchdog(**kwargs)
+        self.listener_heartbeat.deadline = listener_deadline
+        self.task_manager.heartbeat.deadline = scheduler_deadline
+        self.task_manager.script_stall_timeout = script_stall_timeout
+        self.restart_session_on_stall = restart_session
+        
+        def limited(restart_loop: Callable[[Heartbeat], Any]) -> Optional[Callable[[Heartbeat], Any]]:
+            if not restart:
+                return None
+            restarts: Deque[float] = deque()
+            
+            def on_stall(heartbeat: Heartbeat):
+                now = time.monotonic()
+                while restarts and now - restarts[0] > 3600:
+                    restarts.popleft()
+                if len(restarts) >= max_restarts:
+                    logger.error("一小时内重启次数已达上限，不再重启: %s", heartbeat.name)
+                    return
+                restarts.append(now)
+                restart_loop(heartbeat)
+            return on_stall
+        
+        self.watchdog.watch(self.listener_heartbeat, limited(self._on_listener_stall))
+        self.watchdog.watch(self.task_manager.heartbeat, limited(self.task_manager.restart_scheduler))
+        return self.watchdog
+    
+    def _on_listener_stall(self, heartbeat: Heartbeat):
+        """监听循环卡死：按配置重新初始化会话，再启动新的监听线程"""
+        if not self.running:
+            return
+        if self.restart_session_on_stall:
+            try:
+                self._resume_session()
+            except Exception as e:
+                logger.error("重新初始化会话失败: %s", e)
+        logger.warning("重启消息监听线程", extra={"generation": self._listener_generation + 1})
+        self._start_message_listener()
+    
+    def enable_tracing(self, path: str = "traces.jsonl", sample_rate: float = 0.1, **kwargs) -> Tracer:
+        """开启请求追踪，采样的 trace 以 OTLP/JSON 格式写入 path，参数同 tracing.setup_tracing"""
+        return setup_tracing(path, sample_rate, **kwargs)
+    
     def _register_example_commands(self):
         """注册示例功能"""
         # 定时任务管理
@@ -349,6 +1327,13 @@ class WXFramework:
         self.command_framework.register_command("天气查询", WeatherCommandHandler())
         self.command_framework.register_command("时间查询", TimeCommandHandler())
         self.command_framework.register_command("帮助", HelpCommandHandler())
+        self.command_framework.register_command("内存", MemoryCommandHandler(self.memory_monitor))
+        self.command_framework.register_command("搜索", SearchCommandHandler(self.history))
+        
+        # plugins/ 目录和已安装包中的插件，使用时才导入
+        # 插件中的 CommandHandler / MediaFile 由加载器注入，与框架使用的是同一个类
+        self.plugin_loader = PluginLoader(namespace={"CommandHandler": CommandHandler, "MediaFile": MediaFile})
+        self.command_framework.register_plugins(self.plugin_loader)
     
     def start(self):
         """启动框架"""
@@ -356,11 +1341,23 @@ class WXFramework:
         
         # 处理登录
         if self._wait_login():
+            # 登录时会重新初始化 Message，登录后再挂上消息历史
+            self.message.history = self.history
+            
             # 启动定时任务管理器
+            self.task_manager.watchdog = self.watchdog
             self.task_manager.start()
+            self.memory_monitor.start()
             
             # 启动消息监听器
             self._start_message_listener()
+            
+            if self.watchdog:
+                self.watchdog.start()
+            
+            if self.gateway:
+                self.gateway.start()
+                print(f"📮 发送网关已启动: {self.gateway.address}")
         else:
             print("❌ 登录失败，程序退出")
             return False
@@ -374,64 +1371,136 @@ class WXFramework:
             self.wx_helper = WXFilehelper()
             return True
         except Exception as e:
-            print(f"登录失败: {e}")
+            logger.error("登录失败: %s", e)
+            return False
+    
+    def _resume_session(self) -> bool:
+        """使用现有 cookie 恢复会话"""
+        return bool(self.wx_helper and self.wx_helper.resume_session())
+    
+    def _relogin(self) -> bool:
+        """重新扫码登录"""
+        if not self.wx_helper:
             return False
+        print("🔑 会话已失效，请重新扫码登录")
+        return bool(self.wx_helper.wait_login())
     
     def _start_message_listener(self):
-        """启动消息监听器"""
+        """启动消息监听器；卡死后再次调用会启动新线程，旧线程恢复后自行退出"""
         self.running = True
+        self._listener_generation += 1
+        generation = self._listener_generation
+        self.listener_heartbeat.beat()
         
         def message_loop():
-            while self.running:
+            while self.running and generation == self._listener_generation:
+                self.listener_heartbeat.beat()
                 try:
+                    polled_at = time.time_ns()
                     has_msg = self.message.sync_msg_check()
                     if has_msg:
-                        self._handle_incoming_message()
+                        self._handle_incoming_message((polled_at, time.time_ns()))
                     time.sleep(0.3)
+                except SessionExpiredError as e:
+                    # 会话失效：暂停发送并尝试恢复，恢复后会重放缓存的消息
+                    # 重新登录要等待扫码，期间不检查心跳
+                    with self.listener_heartbeat.suspended():
+                        recovered = self.session_monitor.on_expired(e.retcode)
+                    if not recovered:
+                        time.sleep(1)
                 except Exception as e:
-                    print(f"消息监听错误: {e}")
+                    logger.error("消息监听错误: %s", e)
                     time.sleep(1)
         
-        listener_thread = threading.Thread(target=message_loop, daemon=True)
+        listener_thread = threading.Thread(target=message_loop, name=f"message-listener-{generation}", daemon=True)
         listener_thread.start()
     
-    def _handle_incoming_message(self):
-        """处理接收到的消息"""
-        try:
-            # 使用原有的receive_msg方法获取消息
-            url = f"{WX_FILEHELPER_HOST}/cgi-bin/mmwebwx-bin/webwxsync"
-            params = {'sid': self.message.sid, 'skey': self.message.skey,
-                      'pass_ticket': self.message.pass_ticket}
-            json_data = {"BaseRequest": self.message.generate_base_request(),
-                         "SyncKey": self.message.sync_key}
-
-            resp = self.message.wx_req.fetch(
-                url, method="post", params=params, json=json_data)
+    def _handle_incoming_message(self, polled_at: Optional[Tuple[int, int]] = None):
+        """处理接收到的消息
+        
+        每次 webwxsync 是一个 trace，每条消息是其中的一个 span。polled_at 为本轮 synccheck 的
+        (开始, 结束) 时间（纳秒），补记为 trace 的第一个 span；synccheck 是长轮询，
+        它的耗时包含了等待新消息到达的时间。
+        """
+        tracer = get_tracer()
+        with tracer.start_trace("wx.receive", kind=SPAN_KIND_SERVER,
+                                start_ns=polled_at[0] if polled_at else None) as trace:
+            if polled_at:
+                tracer.record_span("synccheck", *polled_at, kind=SPAN_KIND_CLIENT,
+                                   attributes={"wx.selector": str(self.message.last_selector)})
+            try:
+                # 使用原有的receive_msg方法获取消息
+                url = f"{WX_FILEHELPER_HOST}/cgi-bin/mmwebwx-bin/webwxsync"
+                params = {'sid': self.message.sid, 'skey': self.message.skey,
+                          'pass_ticket': self.message.pass_ticket}
+                json_data = {"BaseRequest": self.message.generate_base_request(),
+                             "SyncKey": self.message.sync_key}
+
+                resp = self.message.wx_req.fetch(
+                    url, method="post", params=params, json=json_data)
+                
+                if resp:
+                    data = json.loads(resp.content.decode('utf-8'))
+                    if data['BaseResponse']['Ret'] == 0:
+                        if data['AddMsgList']:
+                            for msg in data['AddMsgList']:
+                                with tracer.span("wx.message", attributes={
+                                        "wx.msg_id": str(msg.get('MsgId')), "wx.msg_type": msg['MsgType']}):
+                                    self._dispatch_incoming(msg, trace.trace_id)
+                            self.message.sync_key = data['SyncKey']
+                    elif str(data['BaseResponse']['Ret']) in EXPIRED_RETCODES:
+                        raise SessionExpiredError(data['BaseResponse']['Ret'])
+            except SessionExpiredError:
+                raise
+            except Exception as e:
+                trace.set_error(e)
+                logger.error("处理消息错误: %s", e, extra={"trace_id": trace.trace_id})
+    
+    def _dispatch_incoming(self, msg: Dict, trace_id: str):
+        """记录一条收到的消息并交给指令框架"""
+        if msg['MsgType'] == 1:  # 文本消息
+            user_message = msg['Content']
+            logger.info("收到消息", extra={"msg_id": msg.get('MsgId'), "trace_id": trace_id,
+                                          "content": user_message})
+            # 搜索指令和它的回复不记录，否则每次搜索都会搜到之前的查询和结果列表
+            searching = isinstance(self.command_framework.handler_for(user_message), SearchCommandHandler)
+            if not searching:
+                self.history.record(DIRECTION_IN, user_message, msg_id=msg.get('MsgId'))
             
-            if resp:
-                data = json.loads(resp.content.decode('utf-8'))
-                if data['BaseResponse']['Ret'] == 0:
-                    if data['AddMsgList']:
-                        for msg in data['AddMsgList']:
-                            if msg['MsgType'] == 1:  # 文本消息
-                                user_message = msg['Content']
-                                print(f"收到消息: {user_message}")
-                                
-                                # 处理指令
-                                response = self.command_framework.handle_message(user_message)
-                                
-                                # 发送回复
-                                self.message.send_msg(content=response)
-                                
-                        self.message.sync_key = data['SyncKey']
+            # 处理指令并发送回复，异步处理器不会阻塞监听线程
+            with self.history.suppressed() if searching else contextlib.nullcontext():
+                self.command_framework.dispatch_message(user_message, self._send_reply)
+        else:
+            # 图片、文件等媒体消息：后台流式下载，处理器拿到文件句柄
+            media = self.media_downloader.submit(msg)
+            if media:
+                self.history.record(DIRECTION_IN, media.file_name,
+                                    msg_type=media.msg_type, msg_id=media.msg_id)
+                logger.info("收到媒体消息", extra={"msg_id": media.msg_id, "trace_id": trace_id,
+                                                 "file_name": media.file_name})
+                self.command_framework.dispatch_media(media, self._send_reply)
+    
+    def _send_reply(self, response: str):
+        """发送指令回复"""
+        try:
+            self.message.send_msg(content=response)
         except Exception as e:
-            print(f"处理消息错误: {e}")
+            logger.error("发送回复失败: %s", e)
     
     def shutdown(self):
         """关闭框架"""
         print("🛑 正在关闭框架...")
         self.running = False
+        if self.watchdog:
+            self.watchdog.stop()
+        if self.gateway:
+            self.gateway.stop()
         self.task_manager.stop()
+        self.memory_monitor.stop()
+        self.media_downloader.shutdown()
+        self.command_framework.shutdown()
+        self.history.close()
+        shutdown_tracing()
         print("✅ 框架已关闭")
 
 
@@ -443,6 +1512,21 @@ class TimedTaskCommandHandler(CommandHandler):
         super().__init__("定时任务", "管理定时发送的消息")
         self.task_manager = task_manager
     
+    @staticmethod
+    def _format_stats(stats: Dict) -> str:
+        """任务运行统计，没有运行记录时为空"""
+        if not stats["runs"] and not stats["skipped"]:
+            return ""
+        
+        def seconds(value: Optional[float]) -> str:
+            return "-" if value is None else f"{value:.2f}s"
+        
+        text = f"  最近运行: {stats['runs']} 次，失败 {stats['failures']}，跳过 {stats['skipped']}，发送 {stats['sent']} 条\n"
+        if stats["runs"]:
+            text += (f"  耗时 p50/p95: {seconds(stats['duration_p50'])} / {seconds(stats['duration_p95'])}，"
+                     f"延迟 p50/p95: {seconds(stats['lag_p50'])} / {seconds(stats['lag_p95'])}\n")
+        return text
+    
     def handle(self, message: str) -> str:
         if message == "列表":
             tasks = self.task_manager.list_tasks()
@@ -454,7 +1538,12 @@ class TimedTaskCommandHandler(CommandHandler):
                 status = "✅ 启用" if task.enabled else "❌ 禁用"
                 result += f"• {task.task_id} ({status})\n"
                 result += f"  时间: {task.schedule_time} ({task.task_type})\n"
+                fire_time = self.task_manager.get_fire_time(task)
+                if not fire_time.startswith(task.schedule_time + ":00"):
+                    result += f"  实际触发: {fire_time}\n"
+                result += f"  重叠策略: {task.overlap_policy}\n"
                 result += f"  脚本: {task.script_path}\n"
+                result += self._format_stats(self.task_manager.get_task_stats(task.task_id))
                 if task.description:
                     result += f"  描述: {task.description}\n"
                 result += "\n"
@@ -483,7 +1572,7 @@ class TimedTaskCommandHandler(CommandHandler):
                 datetime.strptime(time_str, "%H:%M")
                 
                 # 验证脚本文件是否存在
-                if not os.path.exists(script_path):
+                if not self.task_manager.script_registry.exists(script_path):
                     return f"❌ 脚本文件不存在: {script_path}"
                 
                 task_id = self.task_manager.add_task(script_path, time_str, "daily", description)
@@ -501,23 +1590,76 @@ class TimedTaskCommandHandler(CommandHandler):
             else:
                 return "❌ 任务不存在"
         
-        elif message == "脚本目录":
-            scripts_dir = "scripts"
-            if not os.path.exists(scripts_dir):
-                os.makedirs(scripts_dir)
-                return f"📁 已创建脚本目录: {scripts_dir}"
+        elif message.startswith("策略"):
+            # 格式: 策略 任务ID skip|queue|allow
+            parts = message.split()
+            if len(parts) != 3 or parts[2] not in OVERLAP_POLICIES:
+                return "❌ 格式错误，正确格式: 策略 任务ID skip|queue|allow"
             
-            scripts = []
-            for file in os.listdir(scripts_dir):
-                if file.endswith('.py'):
-                    scripts.append(file)
+            if self.task_manager.set_overlap_policy(parts[1], parts[2]):
+                return f"✅ 任务 {parts[1]} 的重叠策略已设为 {parts[2]}"
+            else:
+                return "❌ 任务不存在"
+        
+        elif message.startswith("抖动"):
+            # 格式: 抖动 任务ID 秒数|默认
+            parts = message.split()
+            if len(parts) != 3 or not (parts[2].isdigit() or parts[2] == "默认"):
+                return "❌ 格式错误，正确格式: 抖动 任务ID 秒数|默认"
             
+            jitter = None if parts[2] == "默认" else int(parts[2])
+            try:
+                found = self.task_manager.set_jitter(parts[1], jitter)
+            except ValueError as e:
+                return f"❌ {e}"
+            if found:
+                if jitter is None:
+                    return f"✅ 任务 {parts[1]} 已恢复使用默认的错峰窗口"
+                return f"✅ 任务 {parts[1]} 的抖动窗口已设为 {parts[2]} 秒"
+            else:
+                return "❌ 任务不存在"
+        
+        elif message.startswith("导入"):
+            # 格式: 导入 文件路径（.csv / .json / .jsonl）
+            parts = message.split(" ", 1)
+            if len(parts) < 2 or not parts[1].strip():
+                return "❌ 请指定要导入的文件路径"
+            
+            file_path = parts[1].strip()
+            if not os.path.exists(file_path):
+                return f"❌ 文件不存在: {file_path}"
+            try:
+                task_ids = self.task_manager.import_tasks_from_file(file_path)
+            except (ValueError, KeyError) as e:
+                return f"❌ 导入失败，未做任何修改: {e}"
+            except OSError as e:
+                return f"❌ 读取文件失败: {e}"
+            return f"✅ 已导入 {len(task_ids)} 个定时任务"
+        
+        elif message.startswith("导出"):
+            # 格式: 导出 文件路径（.csv / .jsonl）
+            parts = message.split(" ", 1)
+            if len(parts) < 2 or not parts[1].strip():
+                return "❌ 请指定导出文件路径"
+            
+            try:
+                count = self.task_manager.export_tasks(parts[1].strip())
+            except OSError as e:
+                return f"❌ 导出失败: {e}"
+            return f"✅ 已导出 {count} 个定时任务到 {parts[1].strip()}"
+        
+        elif message == "脚本目录":
+            registry = self.task_manager.script_registry
+            scripts = registry.list_scripts()
             if not scripts:
-                return f"📁 脚本目录 {scripts_dir} 为空"
+                return f"📁 脚本目录 {registry.scripts_dir} 为空"
             
-            result = f"📁 脚本目录 ({scripts_dir}):\n\n"
+            result = f"📁 脚本目录 ({registry.scripts_dir}):\n\n"
             for script in scripts:
-                result += f"• {script}\n"
+                status = "" if script.compiled or not script.error else " ⚠️ 编译失败"
+                result += f"• {script.name} ({script.size} 字节){status}\n"
+                if script.summary():
+                    result += f"  {script.summary()}\n"
             return result
         
         else:
@@ -526,6 +1668,10 @@ class TimedTaskCommandHandler(CommandHandler):
 • 列表 - 查看所有定时任务
 • 添加 HH:MM 脚本路径 [描述] - 添加定时任务
 • 删除 任务ID - 删除定时任务
+• 策略 任务ID skip|queue|allow - 上次未执行完时跳过/排队/并行
+• 抖动 任务ID 秒数 - 在设定时间后的窗口内错开触发
+• 导入 文件路径 - 从 CSV/JSON 批量导入任务
+• 导出 文件路径 - 导出任务到 CSV/JSONL
 • 脚本目录 - 查看可用脚本
 
 💡 示例: 
@@ -556,6 +1702,78 @@ class TimeCommandHandler(CommandHandler):
         return f"🕐 当前时间：{current_time}"
 
 
+class MemoryCommandHandler(CommandHandler):
+    """内存诊断指令处理器"""
+    
+    def __init__(self, memory_monitor: MemoryMonitor):
+        super().__init__("内存", "查看内存占用和分配热点")
+        self.memory_monitor = memory_monitor
+    
+    def handle(self, message: str) -> str:
+        if message == "快照":
+            self.memory_monitor.snapshot()
+            lines = self.memory_monitor.top_allocations()
+            if not lines:
+                return "🧠 已开启 tracemalloc 跟踪，稍后再发送 '快照' 查看分配热点"
+            return "🧠 分配最多的位置：\n\n" + "\n".join(f"• {line}" for line in lines)
+        
+        elif message == "对比":
+            lines = self.memory_monitor.diff()
+            if not lines:
+                return "❌ 至少需要两次快照，请先发送 '快照'"
+            return "🧠 与上次快照相比增长最多的位置：\n\n" + "\n".join(f"• {line}" for line in lines)
+        
+        elif message == "回收":
+            results = self.memory_monitor.evict()
+            return "🧹 回收完成：\n\n" + "\n".join(f"• {line}" for line in results)
+        
+        else:
+            return f"""🧠 内存状态：
+
+{self.memory_monitor.status_text()}
+
+• 快照 - 抓取分配最多的位置（首次使用时开启 tracemalloc）
+• 对比 - 与上次快照对比增长
+• 回收 - 立即执行缓存回收"""
+
+
+class SearchCommandHandler(CommandHandler):
+    """消息历史搜索指令处理器"""
+    
+    takes_arguments = True
+    
+    def __init__(self, history: MessageHistory, limit: int = 10):
+        super().__init__("搜索", "全文搜索收发过的消息")
+        self.history = history
+        self.limit = limit
+    
+    def handle(self, message: str) -> str:
+        if message.startswith(self.name):
+            message = message[len(self.name):]
+        query = message.strip()
+        if not query:
+            return """🔍 消息搜索：
+
+• 直接发送关键词 - 搜索收发过的消息
+• 多个关键词用空格分隔，需全部命中
+• 退出 - 返回主菜单
+
+💡 示例: 搜索 会议纪要"""
+        
+        start = time.perf_counter()
+        records = self.history.search(query, limit=self.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        if not records:
+            return f"🔍 没有找到包含 “{query}” 的消息（{elapsed:.0f}ms）"
+        
+        result = f"🔍 “{query}” 的搜索结果（{len(records)} 条，{elapsed:.0f}ms）：\n\n"
+        for record in records:
+            arrow = "⬅️" if record.direction == DIRECTION_IN else "➡️"
+            when = datetime.fromtimestamp(record.timestamp).strftime("%Y-%m-%d %H:%M")
+            result += f"{arrow} {when}\n{record.snippet}\n\n"
+        return result.rstrip()
+
+
 class HelpCommandHandler(CommandHandler):
     """帮助指令处理器"""
     
@@ -582,7 +1800,34 @@ class HelpCommandHandler(CommandHandler):
 💡 输入 '菜单' 查看所有可用功能"""
 
 
+def _run_task_cli(argv: List[str]) -> int:
+    """定时任务的命令行入口，无需登录即可批量导入/导出"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="定时任务批量导入/导出")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("file", help="CSV / JSON / JSONL 文件路径")
+    args = parser.parse_args(argv)
+    
+    task_manager = TimedTaskManager(Message())
+    if args.action == "import":
+        try:
+            task_ids = task_manager.import_tasks_from_file(args.file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ 导入失败，未做任何修改: {e}")
+            return 1
+        print(f"✅ 已导入 {len(task_ids)} 个定时任务")
+    else:
+        count = task_manager.export_tasks(args.file)
+        print(f"✅ 已导出 {count} 个定时任务到 {args.file}")
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # python framework.py import|export 文件路径
+        sys.exit(_run_task_cli(sys.argv[1:]))
+    
     # 启动框架
     framework = WXFramework()
     try:
@@ -0,0 +1,342 @@
+"""
+本地 HTTP 发送网关
+
+让其他服务通过 HTTP（TCP 或 Unix socket）把通知推给文件传输助手：
+
+    POST /send          {"content": "文本"} 或 {"file_path": "/path/to/image.png"}
+    POST /send/batch    {"messages": [{"content": "..."}, {"file_path": "..."}]}
+    GET  /status/<id>   查询单条消息的发送状态
+    GET  /health        队列长度、会话是否暂停等
+
+请求只负责校验和入队，立即返回 202 和消息 ID；由单独的发送线程按顺序调用
+Message.send_msg。队列满时返回 429，调用方应稍后重试。POST 时加上 ?wait=秒数
+可以等待发送结果再返回。POST 请求体必须是 JSON（Content-Type: application/json），
+浏览器跨域的“简单请求”（text/plain 等）会被拒绝。
+
+消息状态：queued 排队中、sent 已发送、pending 会话失效暂存、failed 发送失败。
+pending 的消息在会话恢复、补发之后更新为 sent（补发出错时为 failed）。
+"""
+import functools
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from lib import Message
+from log import get_logger
+from tracing import get_tracer
+
+logger = get_logger("gateway")
+
+STATUS_QUEUED = "queued"
+STATUS_SENT = "sent"
+STATUS_PENDING = "pending"
+STATUS_FAILED = "failed"
+
+# 单个请求体上限，避免误传大文件内容
+MAX_BODY_SIZE = 1 << 20
+# 单次 ?wait 的最长等待时间（秒）
+MAX_WAIT = 30
+
+
+class OutboundItem:
+    """一条待发送的消息"""
+
+    def __init__(self, content: Optional[str] = None, file_path: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.content = content
+        self.file_path = file_path
+        self.status = STATUS_QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict:
+        result = {"id": self.id, "status": self.status}
+        if self.error:
+            result["error"] = self.error
+        if self.finished_at:
+            result["latency"] = round(self.finished_at - self.created_at, 3)
+        return result
+
+
+class SendGateway:
+    """本地发送网关：HTTP 接入 + 有界队列 + 顺序发送线程"""
+
+    def __init__(self, message: Message, host: str = "127.0.0.1", port: int = 8765,
+                 unix_socket: Optional[str] = None, queue_size: int = 1000,
+                 token: Optional[str] = None, status_capacity: int = 10000):
+        """
+        :param unix_socket: 指定后监听该 Unix socket 路径，忽略 host/port
+        :param queue_size: 待发送队列上限，超过时返回 429
+        :param token: 设置后请求需携带 Authorization: Bearer <token>
+        :param status_capacity: 保留状态的消息条数，更早的消息查询时返回 404
+        """
+        self.message = message
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.token = token
+        self.queue_size = queue_size
+        self.status_capacity = status_capacity
+        self._queue: "queue.Queue[Optional[OutboundItem]]" = queue.Queue(maxsize=queue_size)
+        self._items: "OrderedDict[str, OutboundItem]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.BaseServer] = None
+        self._threads: List[threading.Thread] = []
+        # 队列已满、放不下结束标记时，发送线程处理完队列后根据它退出
+        self._stopping = threading.Event()
+        self.sent_count = 0
+        self.failed_count = 0
+        self.rejected_count = 0
+
+    # ---- 入队 ----
+
+    @staticmethod
+    def parse_item(data) -> OutboundItem:
+        """校验单条消息，无效时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError("消息必须是 JSON 对象")
+        content, file_path = data.get("content"), data.get("file_path")
+        if bool(content) == bool(file_path):
+            raise ValueError("content 和 file_path 必须且只能提供一个")
+        if content is not None and not isinstance(content, str):
+            raise ValueError("content 必须是字符串")
+        if file_path is not None and not (isinstance(file_path, str) and os.path.isfile(file_path)):
+            raise ValueError(f"文件不存在: {file_path}")
+        return OutboundItem(content=content, file_path=file_path)
+
+    def enqueue(self, items: List[OutboundItem]) -> bool:
+        """整批入队，剩余容量不足时全部拒绝并返回 False"""
+        with self._lock:
+            if self._queue.qsize() + len(items) > self.queue_size:
+                self.rejected_count += len(items)
+                return False
+            for item in items:
+                self._items[item.id] = item
+                self._queue.put_nowait(item)
+            while len(self._items) > self.status_capacity:
+                self._items.popitem(last=False)
+        return True
+
+    def get_item(self, item_id: str) -> Optional[OutboundItem]:
+        with self._lock:
+            return self._items.get(item_id)
+
+    # ---- 发送 ----
+
+    def _send_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            if item is None:
+                return
+            with get_tracer().start_trace("gateway.send", attributes={
+                    "gateway.id": item.id, "gateway.queued": time.time() - item.created_at}) as trace:
+                try:
+                    sent = self.message.send_msg(content=item.content, file_path=item.file_path,
+                                                 on_replayed=functools.partial(self._replayed, item))
+                    # send_msg 返回 False 表示会话失效，消息已进入待发送队列，补发后由 _replayed 更新状态
+                    item.status = STATUS_SENT if sent else STATUS_PENDING
+                    self.sent_count += 1 if sent else 0
+                except Exception as e:
+                    item.status = STATUS_FAILED
+                    item.error = str(e)
+                    self.failed_count += 1
+                    trace.set_error(e)
+                    logger.error("网关消息发送失败: %s", e, extra={"id": item.id, "trace_id": trace.trace_id})
+            item.finished_at = time.time()
+            item.done.set()
+
+    def _replayed(self, item: OutboundItem, error: Optional[Exception]):
+        """会话恢复后 Message 补发了 pending 的消息"""
+        if error is None:
+            item.status = STATUS_SENT
+            self.sent_count += 1
+        else:
+            item.status = STATUS_FAILED
+            item.error = str(error)
+            self.failed_count += 1
+        item.finished_at = time.time()
+
+    # ---- 服务 ----
+
+    def _make_handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            server_version = "WXFilehelperGateway/1.0"
+            # 保持连接，批量推送时不必每条消息重新建立连接
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug("网关请求: " + format % args)
+
+            def _reply(self, code: int, payload: Dict):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                if code == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                if not gateway.token:
+                    return True
+                if self.headers.get("Authorization") == f"Bearer {gateway.token}":
+                    return True
+                self._reply(401, {"error": "unauthorized"})
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                path = urlparse(self.path).path
+                if path == "/health":
+                    self._reply(200, gateway.stats())
+                elif path.startswith("/status/"):
+                    item = gateway.get_item(path[len("/status/"):])
+                    if item:
+                        self._reply(200, item.to_dict())
+                    else:
+                        self._reply(404, {"error": "unknown id"})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def _read_body(self) -> Optional[bytes]:
+                """按 Content-Length 读取请求体，长度缺失或无效时回复错误并返回 None"""
+                value = self.headers.get("Content-Length")
+                if value is None:
+                    error = (411, "Content-Length required")
+                elif not (value.isascii() and value.isdigit()):
+                    error = (400, "invalid Content-Length")
+                elif int(value) > MAX_BODY_SIZE:
+                    error = (413, "request body too large")
+                else:
+                    return self.rfile.read(int(value))
+                # 请求体没有读取，不能继续复用这个连接
+                self.close_connection = True
+                self._reply(error[0], {"error": error[1]})
+                return None
+
+            def do_POST(self):
+                raw = self._read_body()
+                if raw is None or not self._authorized():
+                    return
+                # 只接受 JSON：浏览器跨域的“简单请求”不能携带 application/json，未设置 token 时也无法触达
+                content_type = self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+                if content_type != "application/json":
+                    self._reply(415, {"error": "Content-Type must be application/json"})
+                    return
+                url = urlparse(self.path)
+                if url.path not in ("/send", "/send/batch"):
+                    self._reply(404, {"error": "not found"})
+                    return
+                try:
+                    data = json.loads(raw or b"null")
+                    if url.path == "/send":
+                        items = [gateway.parse_item(data)]
+                    else:
+                        messages = data.get("messages") if isinstance(data, dict) else None
+                        if not isinstance(messages, list) or not messages:
+                            raise ValueError("messages 必须是非空数组")
+                        items = [gateway.parse_item(entry) for entry in messages]
+                    wait = min(float(parse_qs(url.query).get("wait", ["0"])[0]), MAX_WAIT)
+                except ValueError as e:
+                    self._reply(400, {"error": str(e)})
+                    return
+
+                if not gateway.enqueue(items):
+                    self._reply(429, {"error": "queue full", "queued": gateway._queue.qsize()})
+                    return
+                if wait > 0:
+                    deadline = time.monotonic() + wait
+                    for item in items:
+                        item.done.wait(max(0.0, deadline - time.monotonic()))
+                results = [item.to_dict() for item in items]
+                code = 200 if wait > 0 and all(item.done.is_set() for item in items) else 202
+                self._reply(code, results[0] if url.path == "/send" else {"messages": results})
+
+        return Handler
+
+    def _make_server(self) -> socketserver.BaseServer:
+        handler = self._make_handler()
+        if self.unix_socket:
+            if os.path.exists(self.unix_socket):
+                os.remove(self.unix_socket)
+            server = _ThreadingUnixHTTPServer(self.unix_socket, handler)
+            os.chmod(self.unix_socket, 0o600)
+            return server
+        server = ThreadingHTTPServer((self.host, self.port), handler)
+        server.daemon_threads = True
+        self.port = server.server_address[1]
+        return server
+
+    def start(self):
+        """启动 HTTP 服务和发送线程"""
+        if self._server:
+            return
+        self._server = self._make_server()
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._send_loop, name="gateway-sender", daemon=True),
+            threading.Thread(target=self._server.serve_forever, name="gateway-http", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info("发送网关已启动", extra={"address": self.address})
+
+    @property
+    def address(self) -> str:
+        return f"unix:{self.unix_socket}" if self.unix_socket else f"http://{self.host}:{self.port}"
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self.queue_size,
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "rejected": self.rejected_count,
+            "outbound_paused": self.message.outbound_paused,
+        }
+
+    def stop(self):
+        """停止接收请求，发送线程在处理完已入队的消息后退出"""
+        if not self._server:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # 不能阻塞在有界队列上；发送线程清空队列后看到 _stopping 自行退出
+            pass
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.remove(self.unix_socket)
+        self._server = None
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    """监听 Unix socket 的 HTTP 服务"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler 会把 client_address 当作 (host, port) 使用
+        return request, ("unix", 0)
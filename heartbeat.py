@@ -0,0 +1,187 @@
+"""
+心跳与卡死检测
+
+消息监听和定时任务调度都在后台守护线程中循环，卡在挂起的连接或死锁的脚本上时
+进程看起来一切正常，消息却不再有回复。每个循环每轮调用一次 Heartbeat.beat()，
+Watchdog 定期检查，超过期限没有心跳即视为卡死：
+
+    1. 把所有线程的调用栈写入 dump_dir 下的文本文件，便于事后定位卡在哪一行
+    2. 调用注册时提供的 on_stall 回调（在单独的线程中执行），例如重启该循环或会话
+
+Python 无法终止卡住的线程，重启的做法是启动新的循环线程，旧线程恢复后发现自己
+已被替换便退出（见 framework 中的 generation 计数）。
+"""
+import contextlib
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from log import get_logger
+
+logger = get_logger("heartbeat")
+
+
+class Heartbeat:
+    """一个循环的心跳，beat() 只记录时间，开销可以忽略"""
+
+    def __init__(self, name: str, deadline: float):
+        """
+        :param deadline: 两次心跳之间允许的最长间隔（秒）
+        """
+        self.name = name
+        self.deadline = deadline
+        self.last_beat = time.monotonic()
+        self.thread_id: Optional[int] = None
+        self.paused = False
+        self.stalled = False
+        self.stall_count = 0
+
+    def beat(self):
+        self.last_beat = time.monotonic()
+        self.thread_id = threading.get_ident()
+
+    @contextlib.contextmanager
+    def suspended(self):
+        """暂停检测，用于已知会长时间阻塞的操作（如等待扫码重新登录）"""
+        self.paused = True
+        try:
+            yield
+        finally:
+            self.paused = False
+            self.beat()
+
+    def age(self, now: Optional[float] = None) -> float:
+        """距离上次心跳的秒数"""
+        return (now or time.monotonic()) - self.last_beat
+
+    def overdue(self, now: Optional[float] = None) -> bool:
+        return not self.paused and self.age(now) > self.deadline
+
+
+class Watchdog:
+    """定期检查心跳，发现卡死时转储线程栈并调用回调"""
+
+    def __init__(self, interval: float = 5, dump_dir: str = "stall_dumps", max_dumps: int = 20):
+        """
+        :param interval: 检查间隔（秒）
+        :param dump_dir: 线程栈转储目录
+        :param max_dumps: 最多保留的转储文件数，超过时删除最早的
+        """
+        self.interval = interval
+        self.dump_dir = dump_dir
+        self.max_dumps = max_dumps
+        self.running = False
+        self._watched: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def watch(self, heartbeat: Heartbeat, on_stall: Optional[Callable[[Heartbeat], object]] = None):
+        """开始检查心跳，on_stall(heartbeat) 在检测到卡死时调用"""
+        heartbeat.last_beat = time.monotonic()
+        heartbeat.stalled = False
+        with self._lock:
+            self._watched[id(heartbeat)] = (heartbeat, on_stall)
+
+    def unwatch(self, heartbeat: Heartbeat):
+        with self._lock:
+            self._watched.pop(id(heartbeat), None)
+
+    def heartbeats(self) -> List[Heartbeat]:
+        with self._lock:
+            return [heartbeat for heartbeat, _ in self._watched.values()]
+
+    def check(self) -> List[Heartbeat]:
+        """检查一次，返回本次新发现卡死的心跳"""
+        now = time.monotonic()
+        stalled = []
+        with self._lock:
+            watched = list(self._watched.values())
+        for heartbeat, on_stall in watched:
+            if not heartbeat.overdue(now):
+                if heartbeat.stalled:
+                    heartbeat.stalled = False
+                    logger.warning("心跳已恢复: %s", heartbeat.name)
+                continue
+            if heartbeat.stalled:
+                continue
+            heartbeat.stalled = True
+            heartbeat.stall_count += 1
+            stalled.append(heartbeat)
+            path = self._dump_safely(f"{heartbeat.name} 超过 {heartbeat.age(now):.0f} 秒没有心跳"
+                                     f"（期限 {heartbeat.deadline:g} 秒）", heartbeat)
+            logger.error("检测到循环卡死: %s", heartbeat.name,
+                         extra={"age": round(heartbeat.age(now), 1), "dump": path})
+            if on_stall:
+                threading.Thread(target=self._run_callback, args=(on_stall, heartbeat),
+                                 name=f"stall-{heartbeat.name}", daemon=True).start()
+        return stalled
+
+    @staticmethod
+    def _run_callback(on_stall: Callable[[Heartbeat], object], heartbeat: Heartbeat):
+        try:
+            on_stall(heartbeat)
+        except Exception as e:
+            logger.error("卡死处理失败: %s", e, extra={"heartbeat": heartbeat.name})
+
+    def _dump_safely(self, reason: str, heartbeat: Optional[Heartbeat] = None) -> Optional[str]:
+        try:
+            return self.dump_stacks(reason, heartbeat)
+        except OSError as e:
+            logger.error("写入线程栈失败: %s", e)
+            return None
+
+    def dump_stacks(self, reason: str, heartbeat: Optional[Heartbeat] = None) -> str:
+        """把所有线程的调用栈写入文件，返回文件路径"""
+        os.makedirs(self.dump_dir, exist_ok=True)
+        now = datetime.now()
+        name = heartbeat.name.replace(os.sep, "_") if heartbeat else "manual"
+        path = os.path.join(self.dump_dir, f"stall-{now:%Y%m%d-%H%M%S}-{name}.txt")
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        lines = [f"# {now:%Y-%m-%d %H:%M:%S} {reason}", ""]
+        monotonic = time.monotonic()
+        for watched in self.heartbeats():
+            lines.append(f"# 心跳 {watched.name}: {watched.age(monotonic):.1f} 秒前"
+                         f"{'（已暂停）' if watched.paused else ''}")
+        lines.append("")
+        for thread_id, frame in sys._current_frames().items():
+            thread = threads.get(thread_id)
+            marker = " <-- 卡死" if heartbeat and thread_id == heartbeat.thread_id else ""
+            title = thread.name if thread else "unknown"
+            lines.append(f"Thread {title} (id={thread_id}, daemon={getattr(thread, 'daemon', '?')}){marker}")
+            lines.extend(line.rstrip("\n") for line in traceback.format_stack(frame))
+            lines.append("")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        self._prune_dumps()
+        return path
+
+    def _prune_dumps(self):
+        dumps = sorted(file_name for file_name in os.listdir(self.dump_dir) if file_name.startswith("stall-"))
+        for file_name in dumps[:-self.max_dumps] if self.max_dumps else []:
+            try:
+                os.remove(os.path.join(self.dump_dir, file_name))
+            except OSError:
+                pass
+
+    def start(self):
+        """启动检查线程"""
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+        threading.Thread(target=self._run, name="watchdog", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("卡死检测错误: %s", e)
@@ -0,0 +1,299 @@
+"""
+消息历史与全文检索
+
+收发的每一条消息都记录到 SQLite，并用 FTS5 建立全文索引。FTS5 使用 trigram 分词，
+中文不需要额外的分词词典，任意连续三个字以上的关键词都能走索引。trigram 索引无法查询
+一两个字的关键词，为此另建一个二元组索引：每条消息拆成相邻两个字组成的词（加上每段的
+最后一个字）写入 messages_bigram，两个字的关键词按词查询，一个字的按前缀查询，
+命中的候选再用 LIKE 确认。
+
+写入不在消息收发的线程中进行：record() 只把消息放进队列，后台写线程按批次在同一个
+事务中写入，避免每条消息一次 fsync。搜索前调用 flush()，写线程收到请求后立即写入
+手上的批次，不必等到批次的等待时间结束。
+"""
+import contextlib
+import contextvars
+import queue
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+from log import get_logger
+
+logger = get_logger("history")
+
+DIRECTION_IN = "in"
+DIRECTION_OUT = "out"
+
+# FTS5 trigram 分词要求关键词至少 3 个字符
+MIN_TRIGRAM_LENGTH = 3
+
+_STOP = object()
+
+# 为 True 时 record() 不记录，用于不应出现在搜索结果中的消息（如搜索指令本身和它的回复）
+_suppressed: contextvars.ContextVar = contextvars.ContextVar("history_suppressed", default=False)
+
+
+def bigrams(text: str) -> str:
+    """二元组索引的内容：每段文字中相邻两个字组成的词，加上该段的最后一个字"""
+    grams = []
+    for word in text.split():
+        grams.extend(word[i:i + 2] for i in range(len(word) - 1))
+        grams.append(word[-1])
+    return " ".join(grams)
+
+
+class HistoryRecord(NamedTuple):
+    """一条搜索结果"""
+    id: int
+    timestamp: float
+    direction: str
+    msg_type: int
+    content: str
+    snippet: str
+
+
+class MessageHistory:
+    """消息历史存储，写入批量异步进行"""
+
+    def __init__(self, db_path: str = "message_history.db", batch_size: int = 500,
+                 flush_interval: float = 1.0, queue_size: int = 100000):
+        """
+        :param batch_size: 每个写事务最多包含的消息数
+        :param flush_interval: 队列中有消息时最长等待多久写入（秒）
+        :param queue_size: 待写入队列上限，写线程跟不上时丢弃新消息而不是阻塞收发
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        self._create_bigram_index()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _create_schema(self):
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                direction TEXT NOT NULL,
+                msg_type INTEGER NOT NULL,
+                msg_id TEXT,
+                content TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content, content='messages', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            END;
+        """)
+
+    def _create_bigram_index(self):
+        """创建二元组索引，已有消息历史的数据库第一次升级时为旧消息补建索引"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_bigram'").fetchone()
+        if exists:
+            return
+        self._conn.executescript("""
+            CREATE VIRTUAL TABLE messages_bigram USING fts5(grams, tokenize='unicode61', detail='none');
+            CREATE TRIGGER IF NOT EXISTS messages_bigram_ad AFTER DELETE ON messages BEGIN
+                DELETE FROM messages_bigram WHERE rowid = old.id;
+            END;
+        """)
+        rows = self._conn.execute("SELECT id, content FROM messages").fetchall()
+        if rows:
+            self._conn.execute("BEGIN")
+            self._insert_bigrams(rows)
+            self._conn.execute("COMMIT")
+            logger.info("已为旧消息建立二元组索引", extra={"count": len(rows)})
+
+    def _insert_bigrams(self, rows: Iterable[tuple]):
+        self._conn.executemany("INSERT INTO messages_bigram (rowid, grams) VALUES (?, ?)",
+                               ((row_id, bigrams(content)) for row_id, content in rows))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def suppressed():
+        """在此期间（同一线程或协程中）发生的 record() 都不记录"""
+        token = _suppressed.set(True)
+        try:
+            yield
+        finally:
+            _suppressed.reset(token)
+
+    def record(self, direction: str, content: str, msg_type: int = 1,
+               msg_id: Optional[str] = None, timestamp: Optional[float] = None):
+        """记录一条消息（非阻塞）"""
+        if not content or _suppressed.get():
+            return
+        row = (timestamp or time.time(), direction, msg_type,
+               str(msg_id) if msg_id is not None else None, content)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("消息历史队列已满，丢弃记录", extra={"dropped": self.dropped})
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch, flushes = [], []
+            stop = item is _STOP
+            if isinstance(item, threading.Event):
+                flushes.append(item)
+            elif not stop:
+                batch.append(item)
+            # 攒够一批或等待超时后一起写入，收到 flush 请求时立即写入
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and not flushes and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    flushes.append(item)
+                else:
+                    batch.append(item)
+            try:
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                logger.error("写入消息历史失败: %s", e, extra={"count": len(batch)})
+            finally:
+                for _ in range(len(batch) + len(flushes) + (1 if stop else 0)):
+                    self._queue.task_done()
+                for flushed in flushes:
+                    flushed.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[tuple]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                ids = [self._conn.execute(
+                    "INSERT INTO messages (ts, direction, msg_type, msg_id, content) "
+                    "VALUES (?, ?, ?, ?, ?)", row).lastrowid for row in batch]
+                self._insert_bigrams(zip(ids, (row[4] for row in batch)))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def flush(self, timeout: Optional[float] = None):
+        """让写线程立即写入已收到的消息，并等待写入完成（timeout 为 None 时一直等待）"""
+        if not self._writer.is_alive():
+            return
+        flushed = threading.Event()
+        try:
+            self._queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return
+        flushed.wait(timeout)
+
+    @staticmethod
+    def _quote(term: str) -> str:
+        """把关键词转为 FTS5 短语，避免其中的符号被当作查询语法"""
+        return '"' + term.replace('"', '""') + '"'
+
+    def search(self, query: str, limit: int = 10, direction: Optional[str] = None) -> List[HistoryRecord]:
+        """
+        搜索消息，多个关键词以空格分隔，需全部命中
+
+        能走全文索引时按相关度（bm25）排序，相关度相同的新消息优先；否则按时间倒序。
+        """
+        terms = [term for term in query.split() if term]
+        if not terms:
+            return []
+        self.flush()
+        indexed = [term for term in terms if len(term) >= MIN_TRIGRAM_LENGTH]
+        short = [term for term in terms if len(term) < MIN_TRIGRAM_LENGTH]
+        # 一两个字的关键词走二元组索引（全是标点等分隔符的关键词分不出词，只能扫描）
+        bigram_terms = [term for term in short if any(char.isalnum() for char in term)]
+
+        conditions, params = [], []
+        for term in short:
+            conditions.append("m.content LIKE ? ESCAPE '\\'")
+            params.append("%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if direction:
+            conditions.append("m.direction = ?")
+            params.append(direction)
+
+        if indexed:
+            sql = ("SELECT m.id, m.ts, m.direction, m.msg_type, m.content, "
+                   "snippet(messages_fts, 0, '【', '】', '…', 24) "
+                   "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                   "WHERE messages_fts MATCH ?")
+            params.insert(0, " ".join(self._quote(term) for term in indexed))
+            order = "ORDER BY messages_fts.rank, m.id DESC"
+        elif bigram_terms:
+            sql = ("SELECT m.id, m.ts, m.direction, m.msg_type, m.content, m.content "
+                   "FROM messages_bigram JOIN messages m ON m.id = messages_bigram.rowid "
+                   "WHERE messages_bigram MATCH ?")
+            params.insert(0, " ".join(self._quote(term) + ("*" if len(term) == 1 else "")
+                                      for term in bigram_terms))
+            # 按 FTS 表的 rowid 倒序时直接倒序遍历索引，取够 limit 条即停止，不需要排序全部候选
+            order = "ORDER BY messages_bigram.rowid DESC"
+        else:
+            sql = "SELECT m.id, m.ts, m.direction, m.msg_type, m.content, m.content FROM messages m WHERE 1"
+            order = "ORDER BY m.id DESC"
+        for condition in conditions:
+            sql += " AND " + condition
+        sql += f" {order} LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        records = [HistoryRecord(*row) for row in rows]
+        if not indexed:
+            records = [r._replace(snippet=self._make_snippet(r.content, short[0])) for r in records]
+        return records
+
+    @staticmethod
+    def _make_snippet(content: str, term: str, width: int = 24) -> str:
+        """LIKE 查询没有 snippet()，手动截取关键词附近的文本"""
+        pos = content.find(term)
+        if pos < 0:
+            return content[:width * 2]
+        start = max(0, pos - width)
+        end = pos + len(term) + width
+        return (("…" if start else "") + content[start:pos] + f"【{term}】"
+                + content[pos + len(term):end] + ("…" if end < len(content) else ""))
+
+    def count(self) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def purge_before(self, timestamp: float) -> int:
+        """删除早于 timestamp 的消息，返回删除数量"""
+        self.flush()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM messages WHERE ts < ?", (timestamp,))
+        return cursor.rowcount
+
+    def close(self):
+        """写完队列中的消息后关闭"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        with self._lock:
+            self._conn.close()
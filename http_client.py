@@ -0,0 +1,270 @@
+"""
+脚本共享的 HTTP 客户端
+
+所有脚本共用一个带连接池的 requests 会话，同一主机的 TCP/TLS 连接在多次运行之间复用，
+定时任务每次调用 API 不必重新握手。
+
+    http_get(url, params=None, headers=None, timeout=None, cache_ttl=None, cache=True)
+    http_post(url, data=None, json=None, headers=None, timeout=None)
+
+超时按主机配置（set_host_timeout），未配置的主机使用默认超时。GET 的 200 响应会缓存在内存中：
+
+    - cache_ttl 指定时，缓存 cache_ttl 秒内直接返回，不发请求
+    - 否则按响应的 Cache-Control: max-age / Expires 计算有效期（no-store 不缓存）
+    - 过期后如果响应带有 ETag / Last-Modified，下次请求带上 If-None-Match / If-Modified-Since，
+      服务器返回 304 时沿用缓存的内容
+
+会话不保存 cookie，避免不同脚本之间互相影响；需要 cookie 的接口请在 headers 中自行携带。
+"""
+import json as json_module
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from log import get_logger
+from tracing import get_tracer, SPAN_KIND_CLIENT
+
+logger = get_logger("http_client")
+
+Timeout = Union[float, Tuple[float, float]]
+
+# 参与缓存键的请求头，其余请求头不影响缓存命中
+_VARY_HEADERS = ("accept", "accept-language", "authorization")
+
+
+class HTTPResponse:
+    """脚本拿到的响应，内容已完整读取"""
+
+    def __init__(self, url: str, status_code: int, headers: Dict[str, str], content: bytes,
+                 encoding: Optional[str] = None, from_cache: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = from_cache
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json_module.loads(self.content)
+
+    def __repr__(self):
+        return f"<HTTPResponse [{self.status_code}]{' cached' if self.from_cache else ''} {self.url}>"
+
+
+class _CacheEntry:
+    __slots__ = ("response", "expires_at", "etag", "last_modified")
+
+    def __init__(self, response: HTTPResponse, expires_at: float,
+                 etag: Optional[str], last_modified: Optional[str]):
+        self.response = response
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+def _freshness(headers: Dict[str, str], now: float) -> Optional[float]:
+    """按 Cache-Control / Expires 计算过期时间，不允许缓存时返回 None"""
+    cache_control = {}
+    for directive in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        cache_control[name] = value
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return now
+    max_age = cache_control.get("s-maxage") or cache_control.get("max-age")
+    if max_age is not None:
+        try:
+            return now + max(0, int(max_age))
+        except ValueError:
+            return now
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now
+
+
+class HttpClient:
+    """带连接池、按主机超时和响应缓存的 HTTP 客户端，线程安全"""
+
+    def __init__(self, default_timeout: Timeout = (3.05, 10), host_timeouts: Optional[Dict[str, Timeout]] = None,
+                 pool_connections: int = 16, pool_maxsize: int = 8, max_retries: int = 2,
+                 cache_size: int = 256, max_cache_body: int = 1 << 20):
+        """
+        :param default_timeout: 默认超时（秒），可以是 (连接超时, 读取超时)
+        :param host_timeouts: 按主机的超时，键为主机名，也匹配其子域名
+        :param pool_connections: 缓存连接池的主机数
+        :param pool_maxsize: 每个主机保持的连接数，应不小于同时执行的脚本数
+        :param max_retries: 连接失败、GET 遇到 502/503/504 时的重试次数；读取超时不重试，直接抛出
+        :param cache_size: 缓存的响应条数
+        :param max_cache_body: 超过该大小（字节）的响应不缓存
+        """
+        self.default_timeout = default_timeout
+        self.host_timeouts: Dict[str, Timeout] = dict(host_timeouts or {})
+        self.cache_size = cache_size
+        self.max_cache_body = max_cache_body
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        retry = Retry(total=max_retries, connect=max_retries, read=False, backoff_factor=0.3,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset({"GET", "HEAD"}),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    # ---- 超时 ----
+
+    def set_host_timeout(self, host: str, timeout: Timeout):
+        self.host_timeouts[host.lower()] = timeout
+
+    def timeout_for(self, url: str) -> Timeout:
+        """url 所在主机的超时，依次匹配主机名及其上级域名"""
+        host = (urlsplit(url).hostname or "").lower()
+        while host:
+            if host in self.host_timeouts:
+                return self.host_timeouts[host]
+            host = host.partition(".")[2]
+        return self.default_timeout
+
+    # ---- 缓存 ----
+
+    @staticmethod
+    def _cache_key(url: str, params: Optional[Dict], headers: Optional[Dict]) -> str:
+        key = url
+        if params:
+            key += ("&" if "?" in url else "?") + urlencode(sorted(params.items()), doseq=True)
+        if headers:
+            lowered = {name.lower(): value for name, value in headers.items()}
+            vary = [f"{name}={lowered[name]}" for name in _VARY_HEADERS if name in lowered]
+            if vary:
+                key += "\n" + "\n".join(vary)
+        return key
+
+    def _cache_get(self, key: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+            return entry
+
+    def _cache_put(self, key: str, entry: _CacheEntry):
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self) -> int:
+        """清空响应缓存，返回清理的条数"""
+        with self._lock:
+            count = len(self._cache)
+            self._cache.clear()
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = len(self._cache)
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses, "cached": size}
+
+    # ---- 请求 ----
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None, **kwargs) -> HTTPResponse:
+        """发送请求（不使用缓存）"""
+        with get_tracer().span(f"http {method.upper()}", kind=SPAN_KIND_CLIENT, attributes={
+                "http.request.method": method.upper(), "server.address": urlsplit(url).netloc}) as span:
+            resp = self.session.request(method, url, timeout=timeout or self.timeout_for(url), **kwargs)
+            span.set_attribute("http.response.status_code", resp.status_code)
+            return HTTPResponse(resp.url, resp.status_code, dict(resp.headers), resp.content, resp.encoding)
+
+    def get(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict[str, str]] = None,
+            timeout: Optional[Timeout] = None, cache_ttl: Optional[float] = None,
+            cache: bool = True) -> HTTPResponse:
+        """
+        GET 请求
+
+        :param cache_ttl: 缓存有效期（秒），覆盖响应头中的缓存策略
+        :param cache: False 时既不读取也不写入缓存
+        """
+        if not cache:
+            return self.request("GET", url, params=params, headers=headers, timeout=timeout)
+
+        key = self._cache_key(url, params, headers)
+        entry = self._cache_get(key)
+        now = time.time()
+        if entry is not None and now < entry.expires_at:
+            self.hits += 1
+            return entry.response
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag:
+                request_headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request_headers["If-Modified-Since"] = entry.last_modified
+        response = self.request("GET", url, params=params, headers=request_headers, timeout=timeout)
+        now = time.time()
+
+        if response.status_code == 304 and entry is not None:
+            # 内容未变：沿用缓存的内容，按新的响应头刷新有效期
+            self.revalidated += 1
+            expires_at = now + cache_ttl if cache_ttl is not None else _freshness(response.headers, now)
+            if expires_at is not None:
+                entry.expires_at = expires_at
+            entry.etag = response.headers.get("ETag", entry.etag)
+            return entry.response
+
+        self.misses += 1
+        if response.status_code == 200 and len(response.content) <= self.max_cache_body:
+            expires_at = now + cache_ttl if cache_ttl is not None else _freshness(response.headers, now)
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            # 已过期但可以协商的响应也保留，下次用于条件请求
+            if expires_at is not None and (expires_at > now or etag or last_modified):
+                cached = HTTPResponse(response.url, response.status_code, response.headers,
+                                      response.content, response.encoding, from_cache=True)
+                self._cache_put(key, _CacheEntry(cached, expires_at, etag, last_modified))
+        return response
+
+    def post(self, url: str, data: Any = None, json: Any = None, headers: Optional[Dict[str, str]] = None,
+             timeout: Optional[Timeout] = None) -> HTTPResponse:
+        """POST 请求，不缓存"""
+        return self.request("POST", url, data=data, json=json, headers=headers, timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client: Optional[HttpClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> HttpClient:
+    """进程内共享的默认客户端"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
@@ -0,0 +1,111 @@
+"""
+脚本持久化键值存储
+
+基于 SQLite 的嵌入式键值存储，供定时任务脚本跨次运行保存状态。
+值以 JSON 序列化保存，支持过期时间（TTL）；同一进程内通过锁串行化，
+多进程之间依靠 SQLite 的 WAL 模式和事务保证 incr 等操作的原子性。
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+def _expires_at(ttl: Optional[float], now: float) -> Optional[float]:
+    """ttl 对应的过期时间，None 表示永不过期；ttl 必须为正数"""
+    if ttl is None:
+        return None
+    if ttl <= 0:
+        raise ValueError(f"ttl 必须大于 0，永不过期请传 None: {ttl}")
+    return now + ttl
+
+
+class KVStore:
+    """线程安全的持久化键值存储"""
+
+    def __init__(self, db_path: str = "script_state.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """读取键值，不存在或已过期时返回 default"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入键值，ttl 为过期秒数（必须大于 0），None 表示永不过期"""
+        expires_at = _expires_at(ttl, time.time())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at))
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """原子地增加计数并返回新值
+
+        键不存在或已过期时从 0 开始计数，此时 ttl 才会生效；
+        已存在的键保留原有的过期时间，便于实现“每天计数”之类的场景。
+        """
+        now = time.time()
+        # 先校验 ttl，即使键已存在、ttl 不会生效也不接受非法值
+        new_expires_at = _expires_at(ttl, now)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM kv WHERE key = ? "
+                    "AND (expires_at IS NULL OR expires_at > ?)", (key, now)).fetchone()
+                if row:
+                    value = int(json.loads(row[0])) + amount
+                    expires_at = row[1]
+                else:
+                    value = amount
+                    expires_at = new_expires_at
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def delete(self, key: str) -> bool:
+        """删除键，返回是否存在"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        """清理已过期的键，返回清理数量"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_store: Optional[KVStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> KVStore:
+    """进程内共享的默认存储"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = KVStore()
+        return _default_store
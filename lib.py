@@ -1,6 +1,8 @@
 import os
 import json
+import contextvars
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import pathlib
 
@@ -14,10 +16,17 @@ from retry.api import retry_call
 import time
 import re
 import random
+from urllib.parse import urlsplit
 
 from io import BytesIO
 from PIL import Image
 
+from log import get_logger
+from prewarm import ConnectionWarmer, PrewarmAdapter
+from tracing import get_tracer, SPAN_KIND_CLIENT
+
+logger = get_logger("lib")
+
 # 取消 SSL 警告
 requests.packages.urllib3.disable_warnings()
 
@@ -26,6 +35,39 @@ WX_LOGIN_HOST = "https://login.wx.qq.com"
 WX_FILEHELPER_HOST = "https://szfilehelper.weixin.qq.com"
 WX_FILEUPLOAD_HOST = "https://file.wx2.qq.com"
 
+# synccheck / BaseResponse.Ret 返回码含义
+RETCODE_MEANINGS = {
+    "0": "正常",
+    "1100": "已在手机端退出登录",
+    "1101": "会话已失效（在其他设备登录或长时间未操作）",
+    "1102": "会话凭证无效（skey 失效）",
+    "1205": "操作过于频繁",
+}
+# 表示会话已失效、需要重新登录的返回码
+EXPIRED_RETCODES = {"1100", "1101", "1102"}
+
+# synccheck selector 含义
+SELECTOR_MEANINGS = {
+    "0": "无新消息",
+    "2": "有新消息",
+    "4": "联系人/资料更新",
+    "6": "有新消息（含特殊消息）",
+    "7": "手机端有操作",
+}
+
+
+class SessionExpiredError(Exception):
+    """会话已失效"""
+
+    def __init__(self, retcode):
+        self.retcode = str(retcode)
+        super().__init__(f"Session expired: retcode={self.retcode} ({describe_retcode(self.retcode)})")
+
+
+def describe_retcode(retcode):
+    """返回码的中文说明"""
+    return RETCODE_MEANINGS.get(str(retcode), "未知返回码")
+
 
 class Message:
     """
@@ -55,8 +97,61 @@ class Message:
         self.username = None
         self.username_hash = None
 
+        # 接收图片/文件等媒体消息的下载器（见 media.MediaDownloader），为 None 时只记录日志
+        self.media_downloader = None
+
+        # 消息历史（见 history.MessageHistory），为 None 时不记录
+        self.history = None
+
+        # 最近一次 synccheck 的结果
+        self.last_retcode = None
+        self.last_selector = None
+
+        # 会话失效期间暂停发送，待发送的消息按顺序缓存为 (content, file_path, on_replayed)，恢复后重放
+        self.outbound_paused = False
+        self.pending_sends = []
+        self._outbound_lock = threading.Lock()
+
+        # send_files 同时上传的文件数
+        self.upload_workers = 4
+
         self.wx_req = WXRequest()
 
+    def pause_outbound(self):
+        """暂停发送，之后的消息进入待发送队列"""
+        with self._outbound_lock:
+            self.outbound_paused = True
+
+    def resume_outbound(self):
+        """恢复发送并按原顺序重放待发送的消息，返回重放成功的数量
+
+        入队时指定了 on_replayed 的消息，重放成功后调用 on_replayed(None)，
+        重放出错时调用 on_replayed(异常)；会话再次失效、仍留在队列中的消息不调用。
+        """
+        with self._outbound_lock:
+            self.outbound_paused = False
+            pending, self.pending_sends = self.pending_sends, []
+        sent = 0
+        for index, (content, file_path, on_replayed) in enumerate(pending):
+            try:
+                if not self._send(content, file_path, requeue=False):
+                    # 重放过程中会话再次失效：失败的这条和其后的消息按原顺序放回队列最前面，
+                    # 排在重放期间新进入队列的消息之前
+                    with self._outbound_lock:
+                        self.pending_sends[:0] = pending[index:]
+                    break
+                sent += 1
+                error = None
+            except Exception as e:
+                logger.error("重放消息失败: %s", e)
+                error = e
+            if on_replayed:
+                try:
+                    on_replayed(error)
+                except Exception as e:
+                    logger.error("重放回调出错: %s", e)
+        return sent
+
     def generate_message_id(self):
         """生成消息 id"""
         return str(time.time()).replace('.', '')+str(random.randint(0, 9))
@@ -87,7 +182,10 @@ class Message:
 
     def wx_upload_file(self, file_path):
         """上传文件"""
+        with get_tracer().span("wx.upload", attributes={"file.path": file_path}):
+            return self._upload_file(file_path)
 
+    def _upload_file(self, file_path):
         url = f"{WX_FILEUPLOAD_HOST}/cgi-bin/mmwebwx-bin/webwxuploadmedia"
         file_obj = Utils.load_image(file_path)
 
@@ -109,8 +207,9 @@ class Message:
                 "filename": (file_obj['name'], file_obj['content'], file_obj['type'])
             })
 
-        self.wx_req.update_headers({"Content-Type": data.content_type})
-        resp = self.wx_req.fetch(url, method="post", params=params, data=data)
+        # Content-Type 含 multipart 边界，按请求传入，避免并发上传时互相覆盖共享的 headers
+        resp = self.wx_req.fetch(url, method="post", params=params, data=data,
+                                 headers={"Content-Type": data.content_type})
 
         if resp:
             resp_json = resp.json()
@@ -132,7 +231,7 @@ class Message:
         """
 
         msg_id = self.generate_message_id()
-        print("[测试]msg_id:", msg_id)
+        logger.debug("构建消息", extra={"msg_id": msg_id, "type": type_})
         # 解决中文乱码问题
         msg_data = json.dumps({
             "BaseRequest": self.generate_base_request(),
@@ -149,9 +248,78 @@ class Message:
         }, ensure_ascii=False).encode("utf-8")
         return msg_data
 
-    def send_msg(self, content=None, file_path=None):
-        """发送消息"""
+    def send_msg(self, content=None, file_path=None, on_replayed=None):
+        """
+        发送消息
 
+        会话失效期间消息会进入待发送队列并返回 False，会话恢复后自动重放；
+        需要知道重放结果时传入 on_replayed，见 resume_outbound
+        """
+        return self._send(content, file_path, on_replayed=on_replayed)
+
+    def _send(self, content=None, file_path=None, requeue=True, on_replayed=None):
+        """发送一条消息；requeue 为 False 时（重放）会话失效不会把消息放入队列，由调用方处理"""
+        if requeue:
+            if self._queue_if_paused([(content, file_path, on_replayed)]):
+                return False
+        elif self.outbound_paused:
+            return False
+
+        with get_tracer().span("wx.send", attributes={"wx.msg_type": 1 if content else 3}):
+            if content:
+                return self._post_msg(content=content, requeue=requeue, on_replayed=on_replayed)
+            elif file_path:
+                media_id = self.wx_upload_file(file_path)
+                logger.debug("文件已上传", extra={"media_id": media_id, "file_path": file_path})
+                return self._post_msg(file_path=file_path, media_id=media_id, requeue=requeue,
+                                      on_replayed=on_replayed)
+
+    def send_files(self, file_paths, max_workers=None):
+        """
+        批量发送文件
+
+        最多 max_workers（默认 upload_workers）个文件同时上传，发送按传入顺序依次进行，
+        前面的文件上传完成后立即发送，不必等全部上传结束。
+        返回与 file_paths 一一对应的结果：True 已发送；False 未发送
+        （会话失效时已进入待发送队列，否则为上传/发送失败，见日志）。
+        """
+        file_paths = list(file_paths)
+        results = [False] * len(file_paths)
+        if not file_paths:
+            return results
+        if self._queue_if_paused([(None, path, None) for path in file_paths]):
+            return results
+
+        workers = min(max_workers or self.upload_workers, len(file_paths))
+        with get_tracer().span("wx.send_files", attributes={"wx.file_count": len(file_paths)}), \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as executor:
+            # 每个上传带上当前 trace 的上下文，上传的 span 挂在本次批量发送下
+            uploads = [executor.submit(contextvars.copy_context().run, self.wx_upload_file, path)
+                       for path in file_paths]
+            for index, (path, upload) in enumerate(zip(file_paths, uploads)):
+                if self._queue_if_paused([(None, path, None)]):
+                    continue
+                try:
+                    media_id = upload.result()
+                    logger.debug("文件已上传", extra={"media_id": media_id, "file_path": path})
+                    results[index] = self._post_msg(file_path=path, media_id=media_id)
+                except Exception as e:
+                    logger.error("发送文件失败: %s", e, extra={"file_path": path})
+        return results
+
+    def _queue_if_paused(self, sends):
+        """会话失效期间把消息列表 [(content, file_path, on_replayed), ...] 放入待发送队列，返回是否已暂停"""
+        with self._outbound_lock:
+            if self.outbound_paused:
+                self.pending_sends.extend(sends)
+                return True
+        return False
+
+    def _post_msg(self, content=None, file_path=None, media_id=None, requeue=True, on_replayed=None):
+        """发送文本消息，或已上传文件（media_id）对应的图片消息
+
+        会话失效时暂停发送，requeue 为 True 时把这条消息放入待发送队列
+        """
         if content:
             url = f"{WX_FILEHELPER_HOST}/cgi-bin/mmwebwx-bin/webwxsendmsg"
 
@@ -160,31 +328,38 @@ class Message:
                 "pass_ticket": self.pass_ticket
             }
             data = self.bind_msg_data(type_=1, content=content)
-        elif file_path:
+        else:
             url = f"{WX_FILEHELPER_HOST}/cgi-bin/mmwebwx-bin/webwxsendmsgimg"
             params = {
                 "fun": "async",
                 "f": "json",
                 "pass_ticket": self.pass_ticket
             }
-
-            media_id = self.wx_upload_file(file_path)
-            print(media_id)
             data = self.bind_msg_data(type_=3, media_id=media_id)
 
-        self.wx_req.update_headers({"Content-Type": "application/json"})
         resp = self.wx_req.fetch(
-            url, method="post", params=params, data=data)
+            url, method="post", params=params, data=data, headers={"Content-Type": "application/json"})
         if resp:
             data = resp.json()
-            if data['BaseResponse']['Ret'] == 0:
+            ret = str(data['BaseResponse']['Ret'])
+            if ret == '0':
+                if self.history:
+                    self.history.record("out", content or file_path, msg_type=1 if content else 3)
                 return True
+            elif ret in EXPIRED_RETCODES:
+                with self._outbound_lock:
+                    self.outbound_paused = True
+                    if requeue:
+                        self.pending_sends.append((content, file_path, on_replayed))
+                return False
             else:
                 raise ValueError("Send msg failed")
 
     def sync_msg_check(self):
         """
         监听消息
+
+        有新消息返回 True；会话失效（retcode 1100/1101/1102）时抛出 SessionExpiredError
         """
         url = f'{WX_FILEHELPER_HOST}/cgi-bin/mmwebwx-bin/synccheck'
         params = {
@@ -203,6 +378,10 @@ class Message:
                 r'retcode:"(.*?)"', resp.text)
             selector = Utils.match(
                 r'selector:"(.*?)"', resp.text)
+            self.last_retcode = retcode
+            self.last_selector = selector
+            if str(retcode) in EXPIRED_RETCODES:
+                raise SessionExpiredError(retcode)
             if retcode and selector:
                 if str(retcode) == '0' and str(selector) != '0':
                     return True
@@ -229,8 +408,15 @@ class Message:
                     for msg in data['AddMsgList']:
                         if msg['MsgType'] == 1:
                             # 文本消息
-                            print(msg['Content'])
+                            logger.info("收到消息", extra={"msg_id": msg.get('MsgId'), "content": msg['Content']})
+                            if self.history:
+                                self.history.record("in", msg['Content'], msg_id=msg.get('MsgId'))
+                        elif self.media_downloader:
+                            # 图片、文件等媒体消息，后台下载
+                            self.media_downloader.submit(msg)
                     self.sync_key = data['SyncKey']
+            elif str(data['BaseResponse']['Ret']) in EXPIRED_RETCODES:
+                raise SessionExpiredError(data['BaseResponse']['Ret'])
             else:
                 raise ValueError("Webwxsync failed")
 
@@ -335,20 +521,37 @@ class WXRequest:
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36"
         } or headers
         self.session = self.__bind_request_session()
+        # webwxinit 之后和定时任务触发之前预热发送、上传用到的连接
+        self.warmer = ConnectionWarmer(self.session, (WX_FILEHELPER_HOST, WX_FILEUPLOAD_HOST))
 
     def __bind_request_session(self):
         session = requests.session()
         session.headers = self.headers
+        # HTTPS 连接使用本地 DNS 缓存，重连时恢复 TLS 会话
+        session.mount("https://", PrewarmAdapter())
         return session
 
-    def fetch(self, url, method="get", params=None, data=None, json=None, timeout=10):
-        resp = self.session.request(
-            # method, url, params=params, data=data, json=json, timeout=timeout, allow_redirects=False, verify=False, proxies={'https': 'http://127.0.0.1:8888'})
-            method, url, params=params, data=data, json=json, timeout=timeout, allow_redirects=False)
-        if resp and resp.status_code == requests.codes.ok:
-            return resp
-        else:
-            raise Exception(f"HTTPRequest failed: [{resp.status}] {url}")
+    def warm_up(self, background=True):
+        """预热到文件传输助手和上传服务器的连接，10 秒内重复调用会被忽略"""
+        return self.warmer.warm_up(background=background)
+
+    def fetch(self, url, method="get", params=None, data=None, json=None, timeout=10, stream=False, headers=None):
+        """发送请求，headers 只作用于本次请求，与会话 headers 合并（同名时以它为准）"""
+        parts = urlsplit(url)
+        # span 以接口名命名，如 synccheck、webwxsync、webwxsendmsg
+        with get_tracer().span(parts.path.rsplit("/", 1)[-1] or parts.netloc, kind=SPAN_KIND_CLIENT, attributes={
+                "http.request.method": method.upper(), "server.address": parts.netloc,
+                "url.path": parts.path}) as span:
+            resp = self.session.request(
+                # method, url, params=params, data=data, json=json, timeout=timeout, allow_redirects=False, verify=False, proxies={'https': 'http://127.0.0.1:8888'})
+                method, url, params=params, data=data, json=json, timeout=timeout, allow_redirects=False,
+                stream=stream, headers=headers)
+            span.set_attribute("http.response.status_code", resp.status_code)
+            if resp and resp.status_code == requests.codes.ok:
+                return resp
+            else:
+                resp.close()
+                raise Exception(f"HTTPRequest failed: [{resp.status_code}] {url}")
 
     def update_headers(self, headers):
         """临时添加自定义 headers"""
@@ -381,6 +584,12 @@ class WXFilehelper:
         status = self.__webwx_init()
         return status
 
+    def resume_session(self):
+        """
+        使用现有 cookie 和凭证重新初始化会话，不需要重新扫码
+        """
+        return self.__webwx_init()
+
     def __generate_QRLogin_uuid(self):
         """
         生成 QRLogin uuid
@@ -486,6 +695,9 @@ class WXFilehelper:
                 print(
                     f"\rLogin success, Welcome [{self.message.username}]~", end='\n\n')
 
+                # 登录后的第一次发送或上传不必再等待 DNS 解析和 TLS 握手
+                self.wx_req.warm_up()
+
                 return True
             else:
                 raise ValueError(str(resp.json()))
@@ -0,0 +1,153 @@
+"""
+结构化日志
+
+所有模块通过 get_logger 获取日志器。日志记录只被放入内存队列，由后台线程
+格式化为 JSON Lines 写出，消息处理线程不会因为 stdout / journald 写入缓慢而阻塞；
+队列满时直接丢弃并计数。内容相同的警告和错误在时间窗口内只输出一次，
+窗口结束后附带被抑制的次数。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+ROOT_LOGGER = "wxfilehelper"
+
+# LogRecord 自带的属性，其余属性视为 extra 字段输出
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """内容相同的 WARNING 及以上日志在 interval 秒内只放行一条"""
+
+    def __init__(self, interval: float = 60):
+        super().__init__()
+        self.interval = interval
+        # (logger, 行号, 日志内容) -> [窗口开始时间, 被抑制次数]
+        self._seen: Dict[Tuple[str, int, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.interval <= 0:
+            return True
+        key = (record.name, record.lineno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+            if entry and entry[1]:
+                record.suppressed = entry[1]
+            self._seen[key] = [now, 0]
+            if len(self._seen) > 1000:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.interval}
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞调用方"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用线程中只做最少的工作：合并参数，异常栈留给后台线程格式化
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: str = "INFO", log_file: Optional[str] = None,
+                  rate_limit_interval: float = 60, queue_size: int = 10000):
+    """
+    配置日志输出，可重复调用以修改配置
+
+    :param level: 日志级别
+    :param log_file: 输出文件路径，None 表示输出到 stderr
+    :param rate_limit_interval: 重复警告/错误的抑制窗口（秒），0 表示不抑制
+    :param queue_size: 日志队列容量，满了之后新日志会被丢弃
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        root = logging.getLogger(ROOT_LOGGER)
+        if _listener is not None:
+            _listener.stop()
+            root.removeHandler(_queue_handler)
+
+        if log_file:
+            output = logging.FileHandler(log_file, encoding="utf-8")
+        else:
+            output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter())
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _queue_handler.addFilter(RateLimitFilter(rate_limit_interval))
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, output,
+                                                   respect_handler_level=True)
+        _listener.start()
+
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        root.propagate = False
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def dropped_count() -> int:
+    """因队列满而丢弃的日志数量"""
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志器，首次调用时使用默认配置"""
+    if _queue_handler is None:
+        setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -0,0 +1,183 @@
+"""
+接收媒体消息
+
+把发到文件传输助手的图片、语音、视频和文件下载到本地。下载在有界线程池中并发进行，
+数据按块流式写入磁盘并同时计算 SHA-256，最终按内容哈希存放，相同内容只保存一份。
+指令处理器拿到的是 MediaFile 句柄而不是字节，只有在读取路径或打开文件时才会等待下载完成。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from lib import Message, WX_FILEHELPER_HOST, WX_FILEUPLOAD_HOST
+from log import get_logger
+
+logger = get_logger("media")
+
+MSG_TYPE_TEXT = 1
+MSG_TYPE_IMAGE = 3
+MSG_TYPE_VOICE = 34
+MSG_TYPE_VIDEO = 43
+MSG_TYPE_APP = 49
+# MsgType 为 49 时，AppMsgType 为 6 表示文件
+APP_MSG_TYPE_FILE = 6
+
+
+class MediaStore:
+    """按内容哈希存放文件的本地存储"""
+
+    def __init__(self, root: str = "media"):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        self._lock = threading.Lock()
+
+    def path_for(self, digest: str, suffix: str = "") -> str:
+        """哈希对应的存放路径：media/ab/abcdef....后缀"""
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    def store_stream(self, chunks: Iterable[bytes], suffix: str = "") -> Tuple[str, str, int, bool]:
+        """
+        把数据块流式写入存储
+
+        :return: (sha256, 路径, 字节数, 是否与已有文件重复)
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        sha256.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            digest = sha256.hexdigest()
+            path = self.path_for(digest, suffix)
+            with self._lock:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                    return digest, path, size, True
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return digest, path, size, False
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class MediaFile:
+    """下载中的媒体文件句柄"""
+
+    def __init__(self, msg_id: str, msg_type: int, file_name: str, future: Future):
+        self.msg_id = msg_id
+        self.msg_type = msg_type
+        self.file_name = file_name
+        self._future = future
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def wait(self, timeout: Optional[float] = None) -> "MediaFile":
+        """等待下载完成，下载失败时抛出异常"""
+        self._future.result(timeout)
+        return self
+
+    @property
+    def path(self) -> str:
+        """本地路径（会等待下载完成）"""
+        return self._future.result()[1]
+
+    @property
+    def sha256(self) -> str:
+        return self._future.result()[0]
+
+    @property
+    def size(self) -> int:
+        return self._future.result()[2]
+
+    def open(self, mode: str = "rb"):
+        """打开本地文件（会等待下载完成）"""
+        return open(self.path, mode)
+
+    def add_done_callback(self, callback: Callable[["MediaFile"], None]):
+        """下载完成（或失败）后在下载线程中调用 callback(self)"""
+        self._future.add_done_callback(lambda _: callback(self))
+
+    def __repr__(self):
+        state = "done" if self.done() else "pending"
+        return f"<MediaFile {self.file_name} msg_id={self.msg_id} {state}>"
+
+
+class MediaDownloader:
+    """媒体消息下载器"""
+
+    def __init__(self, message: Message, store: Optional[MediaStore] = None,
+                 max_workers: int = 4, chunk_size: int = 64 * 1024, timeout: float = 60):
+        self.message = message
+        self.store = store or MediaStore()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media")
+
+    def _request_for(self, msg: Dict) -> Optional[Tuple[str, Dict, str]]:
+        """根据消息类型返回 (下载地址, 参数, 文件名)，不支持的类型返回 None"""
+        msg_id = msg["MsgId"]
+        msg_type = msg["MsgType"]
+        base = {"skey": self.message.skey, "mmweb_appid": "wx_webfilehelper"}
+        cgi = f"{WX_FILEHELPER_HOST}/cgi-bin/mmwebwx-bin"
+        if msg_type == MSG_TYPE_IMAGE:
+            return f"{cgi}/webwxgetmsgimg", dict(base, MsgID=msg_id), f"{msg_id}.jpg"
+        if msg_type == MSG_TYPE_VOICE:
+            return f"{cgi}/webwxgetvoice", dict(base, msgid=msg_id), f"{msg_id}.mp3"
+        if msg_type == MSG_TYPE_VIDEO:
+            return f"{cgi}/webwxgetvideo", dict(base, msgid=msg_id), f"{msg_id}.mp4"
+        if msg_type == MSG_TYPE_APP and msg.get("AppMsgType") == APP_MSG_TYPE_FILE:
+            params = {
+                "sender": msg.get("FromUserName"),
+                "mediaid": msg.get("MediaId"),
+                "encryfilename": msg.get("EncryFileName"),
+                "fromuser": self.message.uin,
+                "pass_ticket": self.message.pass_ticket,
+                "webwx_data_ticket": self.message.webwx_data_ticket,
+                "sid": self.message.sid,
+            }
+            return (f"{WX_FILEUPLOAD_HOST}/cgi-bin/mmwebwx-bin/webwxgetmedia", params,
+                    msg.get("FileName") or str(msg_id))
+        return None
+
+    def submit(self, msg: Dict) -> Optional[MediaFile]:
+        """提交下载，立即返回 MediaFile 句柄；不是媒体消息时返回 None"""
+        request = self._request_for(msg)
+        if request is None:
+            return None
+        url, params, file_name = request
+        future = self.executor.submit(self._download, url, params, file_name)
+        media = MediaFile(str(msg["MsgId"]), msg["MsgType"], file_name, future)
+        media.add_done_callback(self._log_result)
+        return media
+
+    def _download(self, url: str, params: Dict, file_name: str) -> Tuple[str, str, int, bool]:
+        suffix = os.path.splitext(file_name)[1]
+        resp = self.message.wx_req.fetch(url, params=params, timeout=self.timeout, stream=True)
+        try:
+            return self.store.store_stream(resp.iter_content(self.chunk_size), suffix)
+        finally:
+            resp.close()
+
+    @staticmethod
+    def _log_result(media: MediaFile):
+        try:
+            digest, path, size, duplicated = media._future.result()
+        except Exception as e:
+            logger.error("媒体下载失败: %s", e, extra={"msg_id": media.msg_id})
+            return
+        logger.info("媒体已保存", extra={"msg_id": media.msg_id, "path": path,
+                                        "size": size, "duplicated": duplicated})
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
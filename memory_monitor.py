@@ -0,0 +1,181 @@
+"""
+内存监控
+
+定期记录进程 RSS，用 tracemalloc 抓取分配最多的代码位置并与上一次快照对比
+（按需抓取，或设置 snapshot_interval 定期抓取并把增长最多的位置写入日志）；
+RSS 超过软上限时依次调用注册的回收函数（清理 cookie、过期缓存等），
+尽量在被系统 OOM 杀掉之前主动释放内存。
+"""
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from log import get_logger
+
+logger = get_logger("memory")
+
+
+def get_rss() -> int:
+    """当前进程的常驻内存（字节）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # 非 Linux 平台退回到峰值 RSS（macOS 单位为字节，其余为 KB）
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_size(size: float) -> str:
+    """格式化字节数"""
+    if abs(size) < 1024:
+        return f"{int(size)}B"
+    for unit in ("KB", "MB"):
+        size /= 1024
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+    return f"{size / 1024:.1f}GB"
+
+
+class MemoryMonitor:
+    """进程内存监控"""
+
+    def __init__(self, interval: float = 300, top_n: int = 10,
+                 soft_limit_mb: Optional[float] = None, trace_frames: int = 1,
+                 snapshot_interval: Optional[float] = None):
+        """
+        :param interval: RSS 采样间隔（秒）
+        :param top_n: 报告中显示的分配位置数量
+        :param soft_limit_mb: RSS 软上限（MB），超过时触发回收，None 表示不限制
+        :param trace_frames: tracemalloc 记录的调用栈深度
+        :param snapshot_interval: 定期抓取 tracemalloc 快照的间隔（秒），None 表示只按需抓取；
+                                  开启后 tracemalloc 会一直跟踪分配，有一定的 CPU 和内存开销
+        """
+        self.interval = interval
+        self.top_n = top_n
+        self.soft_limit_mb = soft_limit_mb
+        self.trace_frames = trace_frames
+        self.snapshot_interval = snapshot_interval
+        self.running = False
+        # RSS 采样记录：(时间, 字节数)，只保留最近的样本
+        self.samples: List[Tuple[datetime, int]] = []
+        self.max_samples = 288
+        self.evictions = 0
+        self._evictors: Dict[str, Callable[[], object]] = {}
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._previous_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def register_evictor(self, name: str, callback: Callable[[], object]):
+        """注册回收函数，超过软上限时按注册顺序调用"""
+        self._evictors[name] = callback
+
+    def start(self):
+        """启动后台采样线程"""
+        if self.running:
+            return
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        next_sample = next_snapshot = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if now >= next_sample:
+                next_sample = now + self.interval
+                try:
+                    self.sample()
+                except Exception as e:
+                    logger.error("内存采样失败: %s", e)
+            if self.snapshot_interval and now >= next_snapshot:
+                next_snapshot = now + self.snapshot_interval
+                try:
+                    self.periodic_snapshot()
+                except Exception as e:
+                    logger.error("内存快照失败: %s", e)
+            wake = min(next_sample, next_snapshot) if self.snapshot_interval else next_sample
+            time.sleep(max(0.0, wake - time.monotonic()))
+
+    def periodic_snapshot(self) -> List[str]:
+        """抓取快照，并把与上一次快照相比增长最多的位置写入日志"""
+        self.snapshot()
+        growth = self.diff()
+        if growth:
+            logger.info("内存分配增长最多的位置:\n%s", "\n".join(growth))
+        return growth
+
+    def sample(self) -> int:
+        """记录一次 RSS，超过软上限时触发回收"""
+        rss = get_rss()
+        with self._lock:
+            self.samples.append((datetime.now(), rss))
+            del self.samples[:-self.max_samples]
+        if self.soft_limit_mb and rss > self.soft_limit_mb * 1024 * 1024:
+            logger.warning("内存超过软上限，开始回收",
+                           extra={"rss": rss, "soft_limit_mb": self.soft_limit_mb})
+            self.evict()
+        return rss
+
+    def evict(self) -> List[str]:
+        """调用所有回收函数并执行一次完整 GC，返回每个回收函数的结果说明"""
+        results = []
+        for name, callback in self._evictors.items():
+            try:
+                result = callback()
+                results.append(f"{name}: {result if result is not None else '完成'}")
+            except Exception as e:
+                results.append(f"{name}: 失败 {e}")
+        results.append(f"gc: 回收 {gc.collect()} 个对象")
+        self.evictions += 1
+        return results
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        """抓取 tracemalloc 快照，首次调用时开启跟踪"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        with self._lock:
+            self._previous_snapshot, self._snapshot = self._snapshot, snapshot
+        return snapshot
+
+    def top_allocations(self, limit: Optional[int] = None) -> List[str]:
+        """最新快照中分配最多的代码位置"""
+        snapshot = self._snapshot or self.snapshot()
+        stats = snapshot.statistics("lineno")[:limit or self.top_n]
+        return [f"{format_size(stat.size)} ({stat.count} 块) {stat.traceback}" for stat in stats]
+
+    def diff(self, limit: Optional[int] = None) -> List[str]:
+        """最新两次快照之间增长最多的代码位置"""
+        with self._lock:
+            current, previous = self._snapshot, self._previous_snapshot
+        if current is None or previous is None:
+            return []
+        stats = current.compare_to(previous, "lineno")[:limit or self.top_n]
+        return [f"{format_size(stat.size_diff):>9} ({stat.count_diff:+d} 块) {stat.traceback}"
+                for stat in stats]
+
+    def status_text(self) -> str:
+        """当前内存概况"""
+        rss = get_rss()
+        text = f"RSS: {format_size(rss)}"
+        if self.samples:
+            first_time, first_rss = self.samples[0]
+            text += f"（自 {first_time.strftime('%m-%d %H:%M')} 起变化 {format_size(rss - first_rss)}）"
+        if self.soft_limit_mb:
+            text += f"\n软上限: {self.soft_limit_mb}MB，已触发回收 {self.evictions} 次"
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            text += f"\ntracemalloc: 当前 {format_size(current)}，峰值 {format_size(peak)}"
+        return text
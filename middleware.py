@@ -0,0 +1,122 @@
+"""
+指令中间件
+
+CommandFramework 在分发消息前后依次调用中间件：
+
+    before(ctx)            处理器执行前调用。返回 None 继续；返回字符串则直接以它作为回复，
+                           不再执行处理器；返回 DROP 则丢弃这条消息，既不执行也不回复。
+    after(ctx, response)   得到回复后按相反顺序调用，可以修改回复；返回 None 表示不发送。
+
+这样重复、过于频繁的指令在执行处理器和发送回复之前就会被拦下。
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from log import get_logger
+
+logger = get_logger("middleware")
+
+# before() 返回该值时丢弃消息
+DROP = object()
+
+
+class MessageContext:
+    """一次消息分发的上下文"""
+
+    def __init__(self, message: str, handler: Any = None):
+        self.message = message
+        self.handler = handler  # 处理器，None 表示框架直接回复（如未知指令）
+        self.started_at = time.monotonic()
+        self.extras: Dict[str, Any] = {}
+
+    @property
+    def command(self) -> str:
+        """处理器名称，框架直接回复时为空字符串"""
+        return self.handler.name if self.handler else ""
+
+
+class Middleware:
+    """中间件基类，按需覆盖 before / after"""
+
+    def before(self, ctx: MessageContext) -> Any:
+        return None
+
+    def after(self, ctx: MessageContext, response: Optional[str]) -> Optional[str]:
+        return response
+
+
+class RateLimitMiddleware(Middleware):
+    """按指令限流：period 秒内最多执行 max_calls 次
+
+    超出后第一次回复提示，之后直接丢弃，直到窗口内的调用数回落。
+    per_command 可以为单个指令设置不同的 (max_calls, period)。
+    """
+
+    def __init__(self, max_calls: int = 5, period: float = 10,
+                 per_command: Optional[Dict[str, Tuple[int, float]]] = None):
+        self.max_calls = max_calls
+        self.period = period
+        self.per_command = per_command or {}
+        self._calls: Dict[str, Deque[float]] = {}
+        self._notified: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def before(self, ctx: MessageContext) -> Any:
+        if not ctx.handler:
+            return None
+        max_calls, period = self.per_command.get(ctx.command, (self.max_calls, self.period))
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls.setdefault(ctx.command, deque())
+            while calls and now - calls[0] >= period:
+                calls.popleft()
+            if len(calls) < max_calls:
+                calls.append(now)
+                self._notified[ctx.command] = False
+                return None
+            if self._notified.get(ctx.command):
+                return DROP
+            self._notified[ctx.command] = True
+        logger.info("指令限流", extra={"command": ctx.command})
+        return f"⏳ 操作太频繁，请 {int(period - (now - calls[0])) + 1} 秒后再试"
+
+
+class DebounceMiddleware(Middleware):
+    """window 秒内重复发送的相同消息只处理第一条"""
+
+    def __init__(self, window: float = 3):
+        self.window = window
+        self._last_seen: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def before(self, ctx: MessageContext) -> Any:
+        key = (ctx.command, ctx.message)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_seen.get(key)
+            self._last_seen[key] = now
+            if len(self._last_seen) > 1000:
+                self._last_seen = {k: t for k, t in self._last_seen.items() if now - t < self.window}
+        if last is not None and now - last < self.window:
+            logger.debug("丢弃重复消息", extra={"command": ctx.command, "content": ctx.message})
+            return DROP
+        return None
+
+
+class TimingMiddleware(Middleware):
+    """记录指令耗时，超过 slow_threshold 秒时输出警告，可选回调 callback(ctx, 秒数)"""
+
+    def __init__(self, slow_threshold: float = 1.0,
+                 callback: Optional[Callable[[MessageContext, float], None]] = None):
+        self.slow_threshold = slow_threshold
+        self.callback = callback
+
+    def after(self, ctx: MessageContext, response: Optional[str]) -> Optional[str]:
+        elapsed = time.monotonic() - ctx.started_at
+        if elapsed >= self.slow_threshold:
+            logger.warning("指令处理较慢: %s", ctx.command, extra={"elapsed": round(elapsed, 3)})
+        if self.callback:
+            self.callback(ctx, elapsed)
+        return response
@@ -0,0 +1,216 @@
+"""
+指令插件发现
+
+插件是 plugins/ 目录下的 .py 文件，或者通过 entry point（组名 wxfilehelper.plugins，
+值为 "模块:处理器类"）安装的第三方包。插件在模块顶层用字面量声明元数据：
+
+    PLUGIN_NAME = "抽签"                 # 指令名称，目录插件默认为文件名
+    PLUGIN_DESCRIPTION = "从选项中随机选一个"
+    PLUGIN_ALIASES = ["choose"]          # 别名，可选
+    PLUGIN_HANDLER = "PickCommandHandler" # 处理器类，默认为第一个继承 CommandHandler 的类
+
+元数据和处理器类的 takes_arguments / cpu_bound / timeout 属性都通过 ast 从源码读取，
+发现阶段不会导入插件模块；模块在指令第一次被使用时才导入（见 framework.LazyCommandHandler）。
+
+插件不需要 from framework import CommandHandler：加载器在执行插件模块前把 namespace
+中的名称（框架传入 CommandHandler 和 MediaFile）注入模块的全局变量。framework.py 作为
+__main__ 运行时，插件再导入 framework 会得到第二份模块，处理器继承的是另一个 CommandHandler。
+"""
+import ast
+import importlib.util
+import os
+import sys
+import threading
+from importlib.metadata import entry_points
+from typing import Any, Dict, List, Optional
+
+from log import get_logger
+
+logger = get_logger("plugins")
+
+ENTRY_POINT_GROUP = "wxfilehelper.plugins"
+# 不导入模块也能读取的处理器类属性
+HANDLER_ATTRIBUTES = ("takes_arguments", "cpu_bound", "timeout")
+
+
+class PluginSpec:
+    """插件元数据"""
+
+    def __init__(self, name: str, module: str, handler_class: str, description: str = "",
+                 aliases: Optional[List[str]] = None, origin: str = "",
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.module = module  # 可导入的模块名
+        self.handler_class = handler_class
+        self.description = description
+        self.aliases = aliases or []
+        self.origin = origin  # 源文件路径
+        self.attributes = attributes or {}
+
+    def __repr__(self):
+        return f"<PluginSpec {self.name} {self.module}:{self.handler_class}>"
+
+
+def _literal(node: ast.AST) -> Any:
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+
+def read_metadata(path: str, handler_class: Optional[str] = None) -> Dict[str, Any]:
+    """
+    从源码中读取插件元数据，不执行模块
+
+    :return: {"name", "description", "aliases", "handler_class", "attributes"}，
+             找不到处理器类时 handler_class 为 None
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    constants: Dict[str, Any] = {}
+    classes: Dict[str, ast.ClassDef] = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            if node.targets[0].id.startswith("PLUGIN_"):
+                constants[node.targets[0].id] = _literal(node.value)
+        elif isinstance(node, ast.ClassDef):
+            classes[node.name] = node
+
+    handler_class = handler_class or constants.get("PLUGIN_HANDLER")
+    if handler_class is None:
+        for name, node in classes.items():
+            bases = [base.id if isinstance(base, ast.Name) else getattr(base, "attr", "") for base in node.bases]
+            if any(base.endswith("CommandHandler") for base in bases):
+                handler_class = name
+                break
+
+    attributes: Dict[str, Any] = {}
+    class_node = classes.get(handler_class)
+    if class_node is not None:
+        for node in class_node.body:
+            target = None
+            if isinstance(node, ast.Assign) and len(node.targets) == 1:
+                target = node.targets[0]
+            elif isinstance(node, ast.AnnAssign) and node.value is not None:
+                target = node.target
+            if isinstance(target, ast.Name) and target.id in HANDLER_ATTRIBUTES:
+                attributes[target.id] = _literal(node.value)
+
+    aliases = constants.get("PLUGIN_ALIASES") or []
+    return {
+        "name": constants.get("PLUGIN_NAME"),
+        "description": constants.get("PLUGIN_DESCRIPTION") or ast.get_docstring(tree) or "",
+        "aliases": [str(alias) for alias in aliases] if isinstance(aliases, (list, tuple)) else [],
+        "handler_class": handler_class,
+        "attributes": attributes,
+    }
+
+
+def import_plugin(module_name: str, namespace: Optional[Dict[str, Any]] = None):
+    """导入插件模块，执行模块代码前先注入 namespace 中的名称；已导入时直接返回"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    found = importlib.util.find_spec(module_name)
+    if found is None or found.loader is None:
+        raise ImportError(f"找不到插件模块: {module_name}", name=module_name)
+    module = importlib.util.module_from_spec(found)
+    module.__dict__.update(namespace or {})
+    sys.modules[module_name] = module
+    try:
+        found.loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(module_name, None)
+        raise
+    return module
+
+
+def create_handler(spec: PluginSpec, namespace: Optional[Dict[str, Any]] = None):
+    """导入插件模块并创建处理器实例，进程池的子进程也通过它重建插件处理器"""
+    return getattr(import_plugin(spec.module, namespace), spec.handler_class)()
+
+
+class PluginLoader:
+    """发现插件并按需导入"""
+
+    def __init__(self, plugin_dir: Optional[str] = "plugins", entry_point_group: Optional[str] = ENTRY_POINT_GROUP,
+                 namespace: Optional[Dict[str, Any]] = None):
+        """
+        :param namespace: 导入插件模块前注入其全局变量的名称，如 {"CommandHandler": CommandHandler}
+        """
+        self.plugin_dir = plugin_dir
+        self.entry_point_group = entry_point_group
+        self.namespace: Dict[str, Any] = dict(namespace or {})
+        self._lock = threading.Lock()
+
+    def discover(self) -> List[PluginSpec]:
+        """列出所有插件（目录插件在前），不导入插件模块"""
+        specs = []
+        if self.plugin_dir and os.path.isdir(self.plugin_dir):
+            specs.extend(self._discover_dir())
+        if self.entry_point_group:
+            specs.extend(self._discover_entry_points())
+        return specs
+
+    def _discover_dir(self) -> List[PluginSpec]:
+        specs = []
+        plugin_dir = os.path.abspath(self.plugin_dir)
+        for file_name in sorted(os.listdir(plugin_dir)):
+            if not file_name.endswith(".py") or file_name.startswith("_"):
+                continue
+            path = os.path.join(plugin_dir, file_name)
+            module = file_name[:-3]
+            # 插件按文件名导入，与已有模块（如 calc、framework）重名时跳过
+            existing = importlib.util.find_spec(module) if module not in sys.modules else None
+            if module in sys.modules or (existing and os.path.abspath(existing.origin or "") != path):
+                logger.warning("插件与已有模块重名，已跳过: %s", file_name)
+                continue
+            spec = self._spec_from_source(path, module, None, default_name=module)
+            if spec:
+                specs.append(spec)
+        return specs
+
+    def _discover_entry_points(self) -> List[PluginSpec]:
+        specs = []
+        for entry_point in entry_points(group=self.entry_point_group):
+            module, _, attr = entry_point.value.partition(":")
+            try:
+                # find_spec 只定位源文件；子模块会导入其所在的包，但不会导入插件模块本身
+                found = importlib.util.find_spec(module)
+            except (ImportError, ValueError) as e:
+                logger.warning("插件 %s 无法定位: %s", entry_point.name, e)
+                continue
+            if found is None or not found.origin or not found.origin.endswith(".py"):
+                logger.warning("插件 %s 找不到源文件", entry_point.name)
+                continue
+            spec = self._spec_from_source(found.origin, module, attr or None, default_name=entry_point.name)
+            if spec:
+                specs.append(spec)
+        return specs
+
+    @staticmethod
+    def _spec_from_source(path: str, module: str, handler_class: Optional[str],
+                          default_name: str) -> Optional[PluginSpec]:
+        try:
+            metadata = read_metadata(path, handler_class)
+        except (OSError, SyntaxError, UnicodeDecodeError) as e:
+            logger.warning("读取插件元数据失败: %s", e, extra={"path": path})
+            return None
+        if not metadata["handler_class"]:
+            logger.warning("插件中没有找到指令处理器类", extra={"path": path})
+            return None
+        return PluginSpec(metadata["name"] or default_name, module, metadata["handler_class"],
+                          metadata["description"], metadata["aliases"], path, metadata["attributes"])
+
+    def load(self, spec: PluginSpec):
+        """导入插件模块并创建处理器实例"""
+        with self._lock:
+            if self.plugin_dir:
+                plugin_dir = os.path.abspath(self.plugin_dir)
+                # 追加到末尾，不覆盖同名的标准库和项目模块；进程池（spawn）的子进程也会继承
+                if os.path.dirname(spec.origin) == plugin_dir and plugin_dir not in sys.path:
+                    sys.path.append(plugin_dir)
+            handler = create_handler(spec, self.namespace)
+        logger.info("插件已加载", extra={"plugin": spec.name, "plugin_module": spec.module})
+        return handler
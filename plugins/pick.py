@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+抽签插件示例
+
+插件只在第一次使用“抽签”指令时导入，框架启动时只读取下面的元数据。
+CommandHandler 由插件加载器注入，不需要（也不应该）从 framework 导入。
+"""
+import random
+
+PLUGIN_NAME = "抽签"
+PLUGIN_DESCRIPTION = "从多个选项中随机选一个"
+PLUGIN_ALIASES = ["选择"]
+
+
+class PickCommandHandler(CommandHandler):  # noqa: F821
+    """抽签指令处理器"""
+    
+    takes_arguments = True
+    
+    def __init__(self):
+        super().__init__(PLUGIN_NAME, PLUGIN_DESCRIPTION)
+    
+    def handle(self, message: str) -> str:
+        for prefix in [PLUGIN_NAME] + PLUGIN_ALIASES:
+            if message.startswith(prefix):
+                message = message[len(prefix):]
+                break
+        options = message.split()
+        if len(options) < 2:
+            return """🎲 抽签：
+
+• 发送多个选项，用空格分隔
+• 退出 - 返回主菜单
+
+💡 示例: 抽签 火锅 烧烤 面条"""
+        return f"🎲 抽中了: {random.choice(options)}"
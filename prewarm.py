@@ -0,0 +1,300 @@
+"""
+连接预热与 DNS / TLS 复用
+
+空闲一段时间后的第一次上传（WX_FILEUPLOAD_HOST）和定时任务的第一次发送（WX_FILEHELPER_HOST）
+都要先做 DNS 解析、TCP 握手和完整的 TLS 握手，多出几百毫秒。这里把这些开销移出关键路径：
+
+    - DNSCache：解析结果按 TTL 缓存在本地，过期后重新解析；解析失败时在 stale_ttl 内沿用旧结果
+    - ResumingSSLContext：按主机保存 TLS 会话，连接断开后重连时恢复会话（session ticket），
+      省去证书交换和验证
+    - PrewarmAdapter：使用以上两者的 requests 适配器，只作用于挂载它的会话
+    - ConnectionWarmer：webwxinit 之后、定时任务触发之前向各主机发一个 HEAD 请求，
+      在连接池中备好一条活跃连接；服务器已关闭的空闲连接会在这时被发现并重建
+
+synccheck 是长轮询，会一直占用一条到 WX_FILEHELPER_HOST 的连接；预热建立的是连接池中的
+另一条空闲连接，供随后的发送使用。
+"""
+import socket
+import ssl
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from log import get_logger
+
+logger = get_logger("prewarm")
+
+
+class DNSCache:
+    """进程内的 DNS 缓存，线程安全"""
+
+    def __init__(self, ttl: float = 300, stale_ttl: float = 3600):
+        """
+        :param ttl: 解析结果的有效期（秒）
+        :param stale_ttl: 重新解析失败时，旧结果最多再沿用多久（秒）
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # (主机, 端口) -> (地址列表, 解析时间)
+        self._entries: Dict[Tuple[str, int], Tuple[List[str], float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _lookup(host: str, port: int) -> List[str]:
+        addresses = []
+        for family, _, _, _, sockaddr in socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        return addresses
+
+    def resolve(self, host: str, port: int = 443) -> List[str]:
+        """返回 host 的地址列表（按解析顺序），无法解析时返回空列表"""
+        key = (host.lower(), port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return self.refresh(host, port, stale=entry)
+
+    def refresh(self, host: str, port: int = 443,
+                stale: Optional[Tuple[List[str], float]] = None) -> List[str]:
+        """立即重新解析，用于预热时把解析移出请求路径"""
+        key = (host.lower(), port)
+        try:
+            addresses = self._lookup(host, port)
+        except OSError as e:
+            if stale is None:
+                with self._lock:
+                    stale = self._entries.get(key)
+            if stale is not None and time.monotonic() - stale[1] < self.ttl + self.stale_ttl:
+                logger.warning("DNS 解析失败，沿用缓存的地址: %s", e, extra={"host": host})
+                return stale[0]
+            return []
+        if addresses:
+            with self._lock:
+                self._entries[key] = (addresses, time.monotonic())
+        return addresses
+
+    def invalidate(self, host: str):
+        """删除 host 的缓存（所有地址都连接失败时调用）"""
+        host = host.lower()
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == host]:
+                del self._entries[key]
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+
+_default_dns_cache: Optional[DNSCache] = None
+_default_dns_cache_lock = threading.Lock()
+
+
+def get_default_dns_cache() -> DNSCache:
+    """进程内共享的 DNS 缓存"""
+    global _default_dns_cache
+    with _default_dns_cache_lock:
+        if _default_dns_cache is None:
+            _default_dns_cache = DNSCache()
+        return _default_dns_cache
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """按主机保存 TLS 会话的 SSLContext，新连接自动尝试恢复同一主机上次的会话"""
+
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT):
+        super().__init__()
+        self._sessions: Dict[str, ssl.SSLSession] = {}
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if session is None and server_hostname and not server_side:
+            session = self._sessions.get(server_hostname)
+        return super().wrap_socket(sock, server_side=server_side,
+                                   do_handshake_on_connect=do_handshake_on_connect,
+                                   suppress_ragged_eofs=suppress_ragged_eofs,
+                                   server_hostname=server_hostname, session=session)
+
+    def save_session(self, hostname: str, sock: ssl.SSLSocket):
+        """保存连接当前的会话；TLS 1.3 的 session ticket 在握手之后才到达，读过响应后再保存"""
+        try:
+            session = sock.session
+        except (AttributeError, ValueError, OSError):
+            return
+        if session is not None and (session.has_ticket or session.id):
+            self._sessions[hostname] = session
+
+    def forget_session(self, hostname: str):
+        self._sessions.pop(hostname, None)
+
+
+def create_ssl_context() -> ResumingSSLContext:
+    """与 urllib3 默认设置一致的客户端上下文，证书使用 requests 自带的 CA 包"""
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.options |= ssl.OP_NO_COMPRESSION
+    # 主机名由 urllib3 校验，这里关闭以便 verify=False 时可以设置 CERT_NONE
+    context.check_hostname = False
+    context.hostname_checks_common_name = False
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(requests.certs.where())
+    context.set_alpn_protocols(["http/1.1"])
+    return context
+
+
+class PrewarmedHTTPSConnection(HTTPSConnection):
+    """使用 DNS 缓存解析地址、重连时恢复 TLS 会话的连接"""
+
+    dns_cache: Optional[DNSCache] = None
+
+    def _new_conn(self) -> socket.socket:
+        dns_cache = self.dns_cache or get_default_dns_cache()
+        host = self._dns_host
+        addresses = dns_cache.resolve(host, self.port)
+        if not addresses:
+            # 交给 urllib3 解析，以便抛出同样的 NameResolutionError
+            return super()._new_conn()
+        last_error: Optional[Exception] = None
+        try:
+            for address in addresses:
+                # 只替换用于连接的地址，SNI 和证书校验仍然使用 self.host
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    last_error = e
+        finally:
+            self._dns_host = host
+        # 缓存的地址全部不可用，下次重新解析
+        dns_cache.invalidate(host)
+        raise last_error
+
+    def connect(self):
+        super().connect()
+        context = self.ssl_context
+        if isinstance(context, ResumingSSLContext) and isinstance(self.sock, ssl.SSLSocket):
+            context.handshakes += 1
+            if self.sock.session_reused:
+                context.resumed += 1
+            self._save_session()
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        self._save_session()
+        return response
+
+    def _save_session(self):
+        # 恢复的会话不会再校验证书，只保存校验过证书的连接的会话
+        context = self.ssl_context
+        if self.is_verified and isinstance(context, ResumingSSLContext) and isinstance(self.sock, ssl.SSLSocket):
+            context.save_session(self.host, self.sock)
+
+
+class PrewarmedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PrewarmedHTTPSConnection
+
+
+class PrewarmAdapter(HTTPAdapter):
+    """HTTPS 连接使用 DNS 缓存和 TLS 会话恢复的 requests 适配器"""
+
+    def __init__(self, dns_cache: Optional[DNSCache] = None, **kwargs):
+        self.dns_cache = dns_cache or get_default_dns_cache()
+        self.ssl_context = create_ssl_context()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("ssl_context", self.ssl_context)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        connection_cls = type("PrewarmedHTTPSConnection", (PrewarmedHTTPSConnection,),
+                              {"dns_cache": self.dns_cache})
+        pool_cls = type("PrewarmedHTTPSConnectionPool", (PrewarmedHTTPSConnectionPool,),
+                        {"ConnectionCls": connection_cls})
+        self.poolmanager.pool_classes_by_scheme = {"http": HTTPConnectionPool, "https": pool_cls}
+
+    def __setstate__(self, state):
+        # 反序列化时 __init__ 不会执行，重新创建上下文再初始化连接池
+        self.dns_cache = get_default_dns_cache()
+        self.ssl_context = create_ssl_context()
+        super().__setstate__(state)
+
+    def stats(self) -> Dict[str, int]:
+        return {"handshakes": self.ssl_context.handshakes, "resumed": self.ssl_context.resumed,
+                "dns_hits": self.dns_cache.hits, "dns_misses": self.dns_cache.misses}
+
+
+class ConnectionWarmer:
+    """向指定主机发送 HEAD 请求，让连接池中保持可用的连接"""
+
+    def __init__(self, session: requests.Session, hosts: Iterable[str], timeout: float = 5,
+                 min_interval: float = 10):
+        """
+        :param hosts: 要预热的地址，如 "https://szfilehelper.weixin.qq.com"
+        :param timeout: 预热请求的超时（秒）
+        :param min_interval: 两次预热之间的最短间隔（秒），过于频繁的预热请求会被忽略
+        """
+        self.session = session
+        self.hosts = list(hosts)
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.last_warm_up = 0.0
+        self._lock = threading.Lock()
+
+    def warm_up(self, hosts: Optional[Iterable[str]] = None, background: bool = True) -> bool:
+        """
+        预热连接，返回是否执行了预热
+
+        :param hosts: 默认为构造时指定的全部主机
+        :param background: 在后台线程中执行，不阻塞调用方
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_warm_up < self.min_interval:
+                return False
+            self.last_warm_up = now
+        hosts = list(hosts) if hosts is not None else self.hosts
+        if background:
+            threading.Thread(target=self._warm_up, args=(hosts,), name="prewarm", daemon=True).start()
+        else:
+            self._warm_up(hosts)
+        return True
+
+    def _warm_up(self, hosts: List[str]):
+        threads = [threading.Thread(target=self._warm_host, args=(host,), daemon=True) for host in hosts[1:]]
+        for thread in threads:
+            thread.start()
+        if hosts:
+            self._warm_host(hosts[0])
+        for thread in threads:
+            thread.join()
+
+    def _warm_host(self, host: str):
+        adapter = self.session.get_adapter(host)
+        dns_cache = getattr(adapter, "dns_cache", None)
+        hostname = urlsplit(host).hostname
+        started = time.monotonic()
+        try:
+            if dns_cache is not None and hostname:
+                # 预热时顺便刷新 DNS，解析不会落在随后的请求上
+                dns_cache.refresh(hostname, urlsplit(host).port or 443)
+            # 状态码无关紧要，只需要建立（或确认）连接；读完响应后连接回到连接池
+            self.session.head(f"{host.rstrip('/')}/", timeout=self.timeout, allow_redirects=False)
+            logger.debug("连接已预热", extra={"host": host, "elapsed_ms": round((time.monotonic() - started) * 1000)})
+        except requests.RequestException as e:
+            logger.warning("连接预热失败: %s", e, extra={"host": host})
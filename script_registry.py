@@ -0,0 +1,238 @@
+"""
+脚本索引
+
+在内存中维护 scripts/ 目录的索引（文件名、大小、修改时间、编译状态、文档字符串），
+目录变化时增量更新并在后台线程中重新编译。安装了 watchdog 时使用文件系统事件，
+否则退回到定时轮询。
+"""
+import ast
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from log import get_logger
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog 是可选依赖
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = get_logger("scripts")
+
+
+class ScriptInfo:
+    """单个脚本的索引信息"""
+
+    def __init__(self, name: str, path: str, size: int, mtime: float):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.code = None  # 编译后的代码对象
+        self.error: Optional[str] = None  # 编译错误
+        self.docstring = ""
+
+    @property
+    def compiled(self) -> bool:
+        return self.code is not None
+
+    def summary(self) -> str:
+        """文档字符串的第一行"""
+        return self.docstring.strip().split("\n", 1)[0] if self.docstring else ""
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    """把 watchdog 事件转发给 ScriptRegistry"""
+
+    def __init__(self, registry: 'ScriptRegistry'):
+        super().__init__()
+        self.registry = registry
+
+    def on_any_event(self, event):
+        for path in (getattr(event, "src_path", None), getattr(event, "dest_path", None)):
+            if path and path.endswith(".py"):
+                self.registry.refresh_path(path)
+
+
+class ScriptRegistry:
+    """scripts 目录的内存索引"""
+
+    def __init__(self, scripts_dir: str = "scripts", poll_interval: float = 2.0):
+        self.scripts_dir = scripts_dir
+        self.poll_interval = poll_interval
+        self.scripts: Dict[str, ScriptInfo] = {}
+        self.running = False
+        self._lock = threading.RLock()
+        self._scanned = False
+        self._compile_queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._compiler: Optional[threading.Thread] = None
+        self._observer = None
+
+    def start(self):
+        """扫描目录并启动监听和后台编译线程"""
+        if self.running:
+            return
+        os.makedirs(self.scripts_dir, exist_ok=True)
+        self.running = True
+        # 每个编译线程使用自己的队列，上一次 stop 留下的结束标记不会影响新线程
+        self._compile_queue = queue.Queue()
+        self.rescan()
+
+        self._compiler = threading.Thread(target=self._compile_loop, args=(self._compile_queue,), daemon=True)
+        self._compiler.start()
+        self._threads.append(self._compiler)
+
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_WatchdogHandler(self), self.scripts_dir, recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            poller = threading.Thread(target=self._poll_loop, daemon=True)
+            poller.start()
+            self._threads.append(poller)
+
+    def stop(self):
+        """停止监听和编译线程"""
+        self.running = False
+        if self._compiler is not None and self._compiler.is_alive():
+            self._compile_queue.put(None)
+        self._compiler = None
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        self._threads = []
+
+    def rescan(self):
+        """全量扫描目录，只对新增或变化的脚本重新编译"""
+        seen = set()
+        if os.path.isdir(self.scripts_dir):
+            with os.scandir(self.scripts_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".py") and entry.is_file():
+                        seen.add(entry.name)
+                        self._update(entry.name, entry.path, entry.stat())
+        with self._lock:
+            for name in list(self.scripts):
+                if name not in seen:
+                    del self.scripts[name]
+            self._scanned = True
+
+    def refresh_path(self, path: str):
+        """增量更新单个脚本（新增、修改或删除）"""
+        name = os.path.basename(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                self.scripts.pop(name, None)
+            return
+        self._update(name, path, stat)
+
+    def _update(self, name: str, path: str, stat: os.stat_result):
+        """记录脚本元数据，变化时加入编译队列"""
+        with self._lock:
+            info = self.scripts.get(name)
+            if info and info.mtime == stat.st_mtime and info.size == stat.st_size:
+                return
+            self.scripts[name] = ScriptInfo(name, path, stat.st_size, stat.st_mtime)
+        if self.running:
+            self._compile_queue.put(name)
+        else:
+            self._compile(name)
+
+    def _compile(self, name: str) -> Optional[ScriptInfo]:
+        """编译脚本并提取文档字符串"""
+        with self._lock:
+            info = self.scripts.get(name)
+        if info is None:
+            return None
+        try:
+            with open(info.path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            tree = ast.parse(source, filename=info.path)
+            info.docstring = ast.get_docstring(tree) or ""
+            info.code = compile(tree, info.path, "exec")
+            info.error = None
+        except (OSError, SyntaxError, ValueError) as e:
+            info.code = None
+            info.error = str(e)
+        return info
+
+    def evict_compiled(self) -> int:
+        """释放已编译的代码对象，下次执行时重新编译，返回释放数量"""
+        count = 0
+        with self._lock:
+            for info in self.scripts.values():
+                if info.code is not None:
+                    info.code = None
+                    count += 1
+        return count
+
+    def _compile_loop(self, compile_queue: "queue.Queue[Optional[str]]"):
+        """后台编译线程"""
+        while self.running:
+            name = compile_queue.get()
+            if name is None:
+                break
+            self._compile(name)
+
+    def _poll_loop(self):
+        """没有 watchdog 时的轮询线程"""
+        while self.running:
+            time.sleep(self.poll_interval)
+            try:
+                self.rescan()
+            except OSError as e:
+                logger.error("扫描脚本目录失败: %s", e)
+
+    def _ensure_scanned(self):
+        if not self._scanned:
+            self.rescan()
+
+    def _lookup(self, script_path: str) -> Optional[ScriptInfo]:
+        """按路径查找 scripts 目录中的脚本，目录外的脚本返回 None"""
+        directory = os.path.dirname(os.path.abspath(script_path))
+        if directory != os.path.abspath(self.scripts_dir):
+            return None
+        self._ensure_scanned()
+        with self._lock:
+            return self.scripts.get(os.path.basename(script_path))
+
+    def list_scripts(self) -> List[ScriptInfo]:
+        """按文件名排序列出脚本"""
+        self._ensure_scanned()
+        with self._lock:
+            return sorted(self.scripts.values(), key=lambda info: info.name)
+
+    def exists(self, script_path: str) -> bool:
+        """脚本是否存在，scripts 目录内的脚本只查内存索引"""
+        directory = os.path.dirname(os.path.abspath(script_path))
+        if directory != os.path.abspath(self.scripts_dir):
+            return os.path.exists(script_path)
+        return self._lookup(script_path) is not None
+
+    def get_code(self, script_path: str):
+        """获取脚本的代码对象
+
+        执行前会对比文件的修改时间，避免监听尚未感知到变化时执行旧代码；
+        不在 scripts 目录中的脚本返回 None，由调用方自行读取。
+        """
+        info = self._lookup(script_path)
+        if info is None:
+            return None
+        self.refresh_path(info.path)
+        with self._lock:
+            info = self.scripts.get(info.name)
+        if info is None:
+            return None
+        if info.code is None and info.error is None:
+            info = self._compile(info.name)
+        if info.error:
+            raise SyntaxError(f"脚本编译失败: {info.error}")
+        return info.code
@@ -0,0 +1,114 @@
+"""
+会话健康监控
+
+根据 synccheck / webwxsync 的返回码维护会话状态机：
+
+    active ──失效──▶ expired ──▶ resuming ──成功──▶ active
+                                    │
+                                  失败
+                                    ▼
+                                 relogin ──成功──▶ active
+                                    │
+                                  失败
+                                    ▼
+                                  failed（稍后重试）
+
+会话失效后立即暂停发送，恢复成功后按顺序重放期间缓存的消息。
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from lib import Message, describe_retcode
+from log import get_logger
+
+logger = get_logger("session")
+
+STATE_ACTIVE = "active"
+STATE_EXPIRED = "expired"
+STATE_RESUMING = "resuming"
+STATE_RELOGIN = "relogin"
+STATE_FAILED = "failed"
+
+
+class SessionHealthMonitor:
+    """会话健康状态机"""
+
+    def __init__(self, message: Message,
+                 resume_session: Optional[Callable[[], bool]] = None,
+                 relogin: Optional[Callable[[], bool]] = None,
+                 retry_interval: float = 30):
+        """
+        :param resume_session: 使用现有 cookie 恢复会话，成功返回 True
+        :param relogin: 重新扫码登录，成功返回 True
+        :param retry_interval: 恢复失败后再次尝试的间隔（秒）
+        """
+        self.message = message
+        self.resume_session = resume_session
+        self.relogin = relogin
+        self.retry_interval = retry_interval
+        self.state = STATE_ACTIVE
+        self.last_retcode: Optional[str] = None
+        self.last_failure_at = 0.0
+        # 状态变化记录：(时间, 状态, 说明)
+        self.history: List[Tuple[datetime, str, str]] = []
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str, reason: str = ""):
+        self.state = state
+        self.history.append((datetime.now(), state, reason))
+        del self.history[:-50]
+        logger.warning("会话状态: %s %s", state, reason, extra={"state": state})
+
+    @property
+    def healthy(self) -> bool:
+        return self.state == STATE_ACTIVE
+
+    def on_expired(self, retcode) -> bool:
+        """检测到会话失效时调用，阻塞直到恢复成功或本轮尝试失败，返回是否已恢复"""
+        with self._lock:
+            if self.state == STATE_FAILED and time.time() - self.last_failure_at < self.retry_interval:
+                return False
+
+            self.last_retcode = str(retcode)
+            self.message.pause_outbound()
+            self._set_state(STATE_EXPIRED, f"retcode={retcode} {describe_retcode(retcode)}")
+
+            if self.resume_session:
+                self._set_state(STATE_RESUMING)
+                if self._attempt(self.resume_session):
+                    return self._recovered("cookie 恢复成功")
+
+            if self.relogin:
+                self._set_state(STATE_RELOGIN)
+                if self._attempt(self.relogin):
+                    return self._recovered("重新登录成功")
+
+            self.last_failure_at = time.time()
+            self._set_state(STATE_FAILED, f"{self.retry_interval} 秒后重试")
+            return False
+
+    def _attempt(self, action: Callable[[], bool]) -> bool:
+        try:
+            return bool(action())
+        except Exception as e:
+            logger.error("会话恢复失败: %s", e)
+            return False
+
+    def _recovered(self, reason: str) -> bool:
+        self._set_state(STATE_ACTIVE, reason)
+        sent = self.message.resume_outbound()
+        if sent:
+            logger.info("已重放待发送消息", extra={"count": sent})
+        return True
+
+    def status_text(self) -> str:
+        """当前状态说明"""
+        text = f"会话状态: {self.state}"
+        if self.last_retcode:
+            text += f"\n最近失效原因: {self.last_retcode} ({describe_retcode(self.last_retcode)})"
+        pending = len(self.message.pending_sends)
+        if pending:
+            text += f"\n待发送消息: {pending} 条"
+        return text
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时任务模拟运行
+
+用虚拟时钟驱动 TimedTaskManager，几秒内快进数天到数周，检查大量任务的触发时间，
+并统计它们产生的发送量。不需要登录，脚本发送的消息只记录不发出。
+
+脚本的 kv_get / kv_set / kv_incr 使用内存中的临时存储，不会读写真实的 script_state.db；
+http_get / http_post 只记录请求（见 Simulation.http.requests）并返回空的 200 响应，不发起网络请求。
+
+用法：
+    python simulate.py                          # 模拟 timed_tasks.json 中的任务 7 天
+    python simulate.py --days 28 --bucket day   # 模拟 4 周，按天统计
+    python simulate.py --tasks tasks.jsonl      # 模拟导入文件中的任务
+    python simulate.py --no-exec                # 只模拟触发，不执行脚本
+
+模拟期间 schedule 模块读取的是虚拟时间，不要在正在运行的机器人进程中调用 Simulation。
+脚本中直接调用 datetime.now() / time.time() 得到的仍是真实时间。
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional
+
+import schedule
+
+from framework import TimedTaskManager, TimedTask
+from http_client import HTTPResponse
+from kvstore import KVStore
+from task_history import TaskRun, TaskRunHistory, OUTCOME_OK
+
+
+class VirtualClock:
+    """可以手动拨动的时钟"""
+
+    def __init__(self, start: datetime.datetime):
+        self.current = start
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+    def time(self) -> float:
+        return self.current.timestamp()
+
+    def advance_to(self, moment: datetime.datetime):
+        if moment > self.current:
+            self.current = moment
+
+
+@contextlib.contextmanager
+def virtual_schedule_clock(clock: VirtualClock):
+    """让 schedule 模块中的 datetime.datetime.now() 返回虚拟时间"""
+
+    class VirtualDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            current = clock.now()
+            return current if tz is None else current.astimezone(tz)
+
+    shim = types.ModuleType("datetime")
+    shim.__dict__.update(datetime.__dict__)
+    shim.datetime = VirtualDatetime
+    original = schedule.datetime
+    schedule.datetime = shim
+    try:
+        yield clock
+    finally:
+        schedule.datetime = original
+
+
+class SentMessage(NamedTuple):
+    timestamp: float
+    task_id: str
+    content: Optional[str]
+    file_path: Optional[str]
+
+
+class SimulatedMessage:
+    """替代 Message：记录发送内容和虚拟时间，不发起网络请求"""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.current_task = ""
+        self.sent: List[SentMessage] = []
+        self.outbound_paused = False
+        self.pending_sends = []
+
+    def send_msg(self, content=None, file_path=None):
+        self.sent.append(SentMessage(self.clock.time(), self.current_task, content, file_path))
+        return True
+
+    def send_files(self, file_paths, max_workers=None):
+        """与 Message.send_files 相同的返回值：每个文件一个 True，按传入顺序记录"""
+        return [self.send_msg(file_path=file_path) for file_path in file_paths]
+
+
+class SimulatedRequest(NamedTuple):
+    timestamp: float
+    task_id: str
+    method: str
+    url: str
+    kwargs: Dict
+
+
+class SimulatedHttpClient:
+    """替代 HttpClient：记录脚本发出的请求，返回空的 200 响应，不访问网络"""
+
+    def __init__(self, message: SimulatedMessage):
+        self.message = message
+        self.requests: List[SimulatedRequest] = []
+
+    def request(self, method: str, url: str, **kwargs) -> HTTPResponse:
+        self.requests.append(SimulatedRequest(self.message.clock.time(), self.message.current_task,
+                                              method.upper(), url, kwargs))
+        return HTTPResponse(url, 200, {}, b"")
+
+    def get(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("POST", url, **kwargs)
+
+
+class SimulatedRunHistory(TaskRunHistory):
+    """不读写文件、不限制条数的运行记录"""
+
+    def __init__(self):
+        super().__init__(path="", capacity=None)
+        self.timeline: List[tuple] = []
+
+    def load(self):
+        pass
+
+    def save(self):
+        pass
+
+    def record(self, task_id: str, run: TaskRun):
+        super().record(task_id, run)
+        self.timeline.append((task_id, run))
+
+
+class _InlineExecutor:
+    """在调用线程中立即执行，模拟时不需要线程池"""
+
+    def __init__(self, message: SimulatedMessage):
+        self.message = message
+
+    def submit(self, fn, task, *args) -> Future:
+        self.message.current_task = task.task_id
+        future = Future()
+        try:
+            future.set_result(fn(task, *args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class Simulation:
+    """用虚拟时钟驱动 TimedTaskManager"""
+
+    def __init__(self, tasks: List[TimedTask], start: Optional[datetime.datetime] = None,
+                 execute_scripts: bool = True, stagger_window: int = 0, tick: float = 1.0):
+        """
+        :param start: 虚拟起始时间，默认为明天 00:00
+        :param execute_scripts: False 时只记录触发，不执行脚本
+        :param tick: 调度线程的轮询间隔（秒），到期时间会按它向上取整，模拟真实的调度延迟
+        """
+        if start is None:
+            start = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1),
+                                              datetime.time())
+        self.clock = VirtualClock(start)
+        self.start = start
+        self.tick = tick
+        self.message = SimulatedMessage(self.clock)
+        self.history = SimulatedRunHistory()
+        # 脚本状态和 HTTP 请求都与真实环境隔离
+        self.kv_store = KVStore(":memory:")
+        self.http = SimulatedHttpClient(self.message)
+        self.scheduler = schedule.Scheduler()
+        # 在临时目录中创建管理器，避免读取或修改真实的 timed_tasks.json
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                self.manager = TimedTaskManager(self.message, stagger_window=stagger_window,
+                                                kv_store=self.kv_store, run_history=self.history,
+                                                scheduler=self.scheduler, clock=self.clock.time,
+                                                http_client=self.http)
+            finally:
+                os.chdir(cwd)
+        self.manager.task_file = os.devnull
+        self.manager.tasks = {task.task_id: task for task in tasks}
+        self.manager.executor = _InlineExecutor(self.message)
+        if not execute_scripts:
+            self.manager._execute_task = self._record_only
+
+    def _record_only(self, task: TimedTask, scheduled_at: float):
+        now = self.clock.time()
+        self.history.record(task.task_id, TaskRun(now, 0.0, max(0.0, now - scheduled_at), OUTCOME_OK, 0))
+
+    def run(self, days: float) -> "Simulation":
+        """快进 days 天"""
+        end = self.start + datetime.timedelta(days=days)
+        with virtual_schedule_clock(self.clock):
+            self.manager.schedule_all()
+            while True:
+                next_run = self.scheduler.get_next_run()
+                if next_run is None or next_run >= end:
+                    break
+                # 调度线程每 tick 秒检查一次，到期任务最晚在下一次检查时执行
+                offset = (next_run - self.start).total_seconds()
+                ticks = -(-offset // self.tick)
+                self.clock.advance_to(self.start + datetime.timedelta(seconds=ticks * self.tick))
+                self.scheduler.run_pending()
+            self.clock.advance_to(end)
+        return self
+
+    # ---- 报告 ----
+
+    def timeline_lines(self, limit: int = 50) -> List[str]:
+        lines = []
+        for task_id, run in self.history.timeline[:limit]:
+            when = datetime.datetime.fromtimestamp(run.started_at).strftime("%Y-%m-%d %a %H:%M:%S")
+            lines.append(f"{when}  {task_id:<22} {run.outcome:<7} 耗时 {run.duration:6.3f}s  "
+                         f"延迟 {run.lag:4.0f}s  发送 {run.sent}")
+        if len(self.history.timeline) > limit:
+            lines.append(f"… 共 {len(self.history.timeline)} 次运行")
+        return lines
+
+    def histogram_lines(self, bucket: str = "hour", width: int = 40) -> List[str]:
+        """按小时（24 个时段合并所有天）或按天统计运行次数和发送量"""
+        def key(timestamp: float) -> str:
+            moment = datetime.datetime.fromtimestamp(timestamp)
+            return moment.strftime("%m-%d %a") if bucket == "day" else moment.strftime("%H:00")
+
+        runs = Counter(key(run.started_at) for _, run in self.history.timeline)
+        sent = Counter(key(message.timestamp) for message in self.message.sent)
+        keys = sorted(set(runs) | set(sent))
+        # 柱状图表示发送量，没有发送记录（如 --no-exec）时表示运行次数
+        bars = sent if self.message.sent else runs
+        peak = max([*bars.values(), 1])
+        lines = [f"{'时段':<10}{'运行':>6}{'发送':>6}"]
+        for k in keys:
+            bar = "█" * max(1, round(bars[k] / peak * width)) if bars[k] else ""
+            lines.append(f"{k:<12}{runs[k]:>6}{sent[k]:>6}  {bar}")
+        return lines
+
+    def summary(self) -> Dict:
+        per_minute = Counter(int(message.timestamp // 60) for message in self.message.sent)
+        busiest = max(per_minute.items(), key=lambda item: item[1], default=None)
+        return {
+            "runs": len(self.history.timeline),
+            "sent": len(self.message.sent),
+            "http_requests": len(self.http.requests),
+            "failures": sum(1 for _, run in self.history.timeline if run.outcome == "error"),
+            "peak_minute": (datetime.datetime.fromtimestamp(busiest[0] * 60).strftime("%Y-%m-%d %H:%M"),
+                            busiest[1]) if busiest else None,
+            "slots": self.manager.get_slot_stats(),
+        }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="定时任务模拟运行")
+    parser.add_argument("--tasks", default="timed_tasks.json",
+                        help="任务文件：timed_tasks.json 或可导入的 CSV/JSON/JSONL")
+    parser.add_argument("--days", type=float, default=7, help="模拟天数，默认 7")
+    parser.add_argument("--start", help="虚拟起始时间，如 2025-01-06 或 '2025-01-06 08:00'，默认明天零点")
+    parser.add_argument("--stagger", type=int, default=0, help="错峰窗口（秒），同 TimedTaskManager 的 stagger_window")
+    parser.add_argument("--bucket", choices=("hour", "day"), default="hour", help="直方图按小时或按天统计")
+    parser.add_argument("--timeline", type=int, default=50, help="时间线最多显示多少次运行")
+    parser.add_argument("--no-exec", action="store_true", help="不执行脚本，只模拟触发")
+    args = parser.parse_args(argv)
+
+    try:
+        tasks = _load_tasks(args.tasks)
+    except (OSError, ValueError) as e:
+        print(f"❌ 读取任务失败: {e}")
+        return 1
+    if not tasks:
+        print("📝 没有可模拟的任务")
+        return 0
+
+    start = datetime.datetime.fromisoformat(args.start) if args.start else None
+    started = time.perf_counter()
+    sim = Simulation(tasks, start=start, execute_scripts=not args.no_exec,
+                     stagger_window=args.stagger).run(args.days)
+    elapsed = time.perf_counter() - started
+
+    print(f"🕐 模拟 {len(tasks)} 个任务，{sim.start:%Y-%m-%d %H:%M} 起 {args.days:g} 天，用时 {elapsed:.2f}s\n")
+    print("\n".join(sim.timeline_lines(args.timeline)))
+    print()
+    print("\n".join(sim.histogram_lines(args.bucket)))
+    summary = sim.summary()
+    print(f"\n共运行 {summary['runs']} 次，失败 {summary['failures']} 次，发送 {summary['sent']} 条消息")
+    if summary["http_requests"]:
+        print(f"脚本发起 {summary['http_requests']} 个 HTTP 请求（只记录，未实际发出）")
+    if summary["peak_minute"]:
+        print(f"发送最集中的一分钟: {summary['peak_minute'][0]}（{summary['peak_minute'][1]} 条）")
+    return 0
+
+
+def _load_tasks(path: str) -> List[TimedTask]:
+    """读取任务：timed_tasks.json 保留原任务ID，其他格式按导入规则校验"""
+    if os.path.basename(path) == "timed_tasks.json":
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [TimedTask.from_dict(data) for data in json.load(f).values()]
+    message = SimulatedMessage(VirtualClock(datetime.datetime.now()))
+    manager = TimedTaskManager(message, kv_store=KVStore(":memory:"), run_history=SimulatedRunHistory(),
+                               scheduler=schedule.Scheduler(), http_client=SimulatedHttpClient(message))
+    manager.tasks = {}
+    manager.save_tasks = lambda: None
+    manager.import_tasks_from_file(path)
+    return list(manager.tasks.values())
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,202 @@
+"""
+指令纠错提示
+
+收到未注册的指令时，从已注册的指令名和别名中找出编辑距离最近的几个，回复
+“你是不是想输入 …”。比较前先做归一化：全角转半角、英文小写、去掉空白，
+常用繁体字转为简体，所以“時間查詢”与“时间查询”视为同一个指令。
+
+指令名在注册时建立删除邻域索引，查询时只对少量候选计算 Levenshtein 距离，
+几千个指令时单次查询也在 1 毫秒以内。没有使用 BK 树：指令名只有几个字，
+彼此之间的距离集中在很少几个值上，BK 树几乎无法剪枝。
+
+未知指令的消息里普通聊天内容居多，多行文本和首个词比最长的指令还长的文本不做查找；
+查找结果按原文缓存（满了按写入顺序淘汰），重复发送的同一句话不再归一化和查找，
+注册新指令时清空。读缓存不加锁，命中时只是一次字典查找。
+"""
+import functools
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+# 常用繁体字 -> 简体字（不依赖 OpenCC，覆盖指令中常见的字即可）
+_TRADITIONAL_PAIRS = (
+    "時时 間间 詢询 問问 氣气 幫帮 單单 選选 關关 閉闭 務务 設设 執执 腳脚 譯译 計计 記记 憶忆 體体 統统 "
+    "態态 刪删 據据 聽听 說说 話话 讀读 寫写 發发 圖图 檔档 錄录 鐘钟 鬧闹 開开 啟启 動动 這这 個个 們们 "
+    "來来 對对 為为 會会 無无 與与 萬万 點点 現现 從从 後后 裡里 機机 東东 車车 長长 門门 數数 歷历 尋寻 "
+    "見见 覺觉 學学 習习 實实 驗验 測测 試试 語语 請请 讓让 認认 識识 證证 頁页 題题 顯显 應应 該该 給给 "
+    "結结 線线 紅红 綠绿 藍蓝 黃黄 飛飞 馬马 魚鱼 鳥鸟 雲云 電电 腦脑 網网 絡络 號号 碼码 帳账 戶户 錢钱 "
+    "價价 買买 賣卖 貨货 費费 質质 轉转 換换 過过 還还 進进 運运 遠远 邊边 達达 際际 陽阳 陰阴 隊队 雙双 "
+    "難难 離离 靈灵 風风 颱台 預预 報报 處处 備备 復复 複复 雜杂 亂乱 爭争 產产 業业 專专 豐丰 臨临 麗丽 "
+    "樂乐 書书 畫画 筆笔 節节 範范 築筑 簡简 類类 紀纪 約约 級级 組组 細细 終终 經经 絕绝 繼继 續续 總总 "
+    "練练 織织 繪绘 維维 緊紧 編编 緩缓 縮缩 繫系 縣县 羅罗 義义 聞闻 聯联 聲声 職职 脈脉 臉脸 舊旧 華华 "
+    "葉叶 蘇苏 蘋苹 藥药 蟲虫 衛卫 衝冲 裝装 規规 視视 親亲 觀观 訂订 討讨 訓训 託托 訪访 許许 診诊 評评 "
+    "詞词 詳详 誌志 誤误 課课 調调 談谈 諾诺 謝谢 講讲 議议 護护 變变 貝贝 負负 財财 責责 貼贴 資资 賞赏 "
+    "賽赛 贊赞 讚赞 趕赶 跡迹 軟软 較较 載载 輔辅 輕轻 輪轮 輸输 辦办 農农 郵邮 鄉乡 醫医 釋释 針针 銀银 "
+    "銷销 鋼钢 錯错 鍵键 鏡镜 閃闪 閱阅 闆板 陣阵 陸陆 險险 隨随 隱隐 雖虽 靜静 頂顶 項项 順顺 須须 頓顿 "
+    "領领 頭头 頻频 顏颜 額额 願愿 顧顾 飯饭 飲饮 餅饼 養养 館馆 驚惊 髮发 鬥斗 鮮鲜 麵面 黨党 齊齐 齒齿 "
+    "龍龙 龜龟 臺台 灣湾 滿满 漢汉 濕湿 溫温 澤泽 燈灯 營营 爐炉 爾尔 牆墙 狀状 獎奖 獨独 獲获 環环 當当 "
+    "疊叠 盤盘 盡尽 監监 確确 禮礼 種种 稱称 積积 穩稳 窮穷 競竞 籃篮 糧粮 紙纸 純纯 納纳 紐纽 億亿 儲储 "
+    "優优 兒儿 內内 兩两 冊册 劃划 劇剧 劍剑 勝胜 勞劳 區区 協协 卻却 參参 員员 嗎吗 嚴严 園园 圍围 國国 "
+    "團团 壓压 壞坏 夠够 夢梦 奮奋 婦妇 媽妈 孫孙 寧宁 寶宝 審审 將将 導导 屬属 層层 歲岁 島岛 師师 帶带 "
+    "幣币 幹干 廣广 廳厅 張张 強强 彈弹 歸归 徑径 徹彻 恆恒 悅悦 惡恶 愛爱 慣惯 慶庆 憂忧 戰战 戲戏 掃扫 "
+    "掛挂 採采 揮挥 損损 搖摇 擇择 擊击 擔担 擴扩 擬拟 攝摄 敗败 敵敌 斷断 於于 暫暂 曆历 曉晓 條条 極极 "
+    "構构 標标 樓楼 樣样 橋桥 檢检 權权 歡欢 殺杀 決决 沒没 況况 淨净 減减 湯汤 準准 滅灭 潔洁 濟济 灑洒 "
+    "燒烧 熱热 輯辑 週周 鬆松 聖圣 擺摆 麼么 麥麦 鐵铁 閒闲 隻只 並并 佈布 係系 側侧 傳传 傷伤 僅仅 剛刚 "
+    "創创 勵励 匯汇 歐欧 殘残 眾众 簽签 籤签 緣缘 罰罚 聰聪 脫脱 興兴 舉举 蓋盖 薦荐 藝艺 補补 覽览 觸触 "
+    "訊讯 詩诗 誠诚 誰谁 論论 諮咨 謎谜 譜谱 豬猪 貓猫 貴贵 貸贷 賀贺 賴赖 趨趋 躍跃 軍军 輛辆 轟轰 辭辞 "
+    "連连 遊游 違违 遙遥 適适 遲迟 遷迁 遺遗 醜丑 鈴铃 鋪铺 錶表 鍋锅 鎖锁 鏈链 閣阁 闊阔 陳陈 階阶 雞鸡 "
+    "韻韵 響响 顆颗 飄飘 飽饱 飾饰 餘余 駕驾 騎骑 驅驱 髒脏 鳳凤 鴨鸭 鵝鹅 鹽盐 齡龄 選选 單单 錄录 啓启"
+)
+_TRADITIONAL_TO_SIMPLIFIED = str.maketrans({pair[0]: pair[1] for pair in _TRADITIONAL_PAIRS.split()})
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(text: str) -> str:
+    """归一化指令：全角转半角、繁体转简体、英文小写、去掉所有空白"""
+    text = unicodedata.normalize("NFKC", text).translate(_TRADITIONAL_TO_SIMPLIFIED).lower()
+    return "".join(text.split())
+
+
+def edit_distance(a: str, b: str, limit: Optional[int] = None) -> int:
+    """
+    Levenshtein 距离
+
+    :param limit: 给定时，一旦确定距离超过 limit 就提前返回 limit + 1
+    """
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletes(word: str, depth: int) -> Set[str]:
+    """删除不超过 depth 个字符能得到的所有字符串（包括原词）"""
+    result = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+class DeletionIndex:
+    """
+    删除邻域索引（SymSpell 的做法）
+
+    两个词的编辑距离不超过 k 时，各自删除不超过 k 个字符后一定能得到相同的字符串。
+    注册时把每个词的删除邻域放进字典，查询时只需生成查询词的删除邻域、按字典取出候选，
+    再逐个计算编辑距离确认，耗时与词的数量基本无关。
+    """
+
+    def __init__(self, max_distance: int = 2):
+        self.max_distance = max_distance
+        self._index: Dict[str, Set[str]] = {}
+        self._words: Set[str] = set()
+        self.max_length = 0
+
+    def add(self, word: str) -> bool:
+        """插入一个词，已存在时返回 False"""
+        if word in self._words:
+            return False
+        self._words.add(word)
+        self.max_length = max(self.max_length, len(word))
+        for key in _deletes(word, self.max_distance):
+            self._index.setdefault(key, set()).add(word)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """返回距离不超过 max_distance 的 (距离, 词)，按距离排序"""
+        max_distance = min(max_distance, self.max_distance)
+        # 比最长的词还长出 max_distance 以上时不可能命中，也避免为长句生成大量删除邻域
+        if len(word) > self.max_length + max_distance:
+            return []
+        candidates: Set[str] = set()
+        for key in _deletes(word, max_distance):
+            candidates |= self._index.get(key, set())
+        results = []
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                results.append((distance, candidate))
+        results.sort()
+        return results
+
+
+class CommandSuggester:
+    """指令名索引：按归一化后的名称精确匹配，或按编辑距离给出建议"""
+
+    def __init__(self, max_suggestions: int = 3, cache_size: int = 256):
+        self.max_suggestions = max_suggestions
+        self.cache_size = cache_size
+        self._index = DeletionIndex(max_distance=2)
+        # 归一化后的名称 -> 原始指令名（同一归一化形式只保留最先注册的）
+        self._names: Dict[str, str] = {}
+        # 原文 -> 建议结果（包括没有建议的空结果）
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, command: str):
+        key = normalize(command)
+        if not key:
+            return
+        with self._lock:
+            self._names.setdefault(key, command)
+            if self._index.add(key):
+                self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def resolve(self, text: str) -> Optional[str]:
+        """归一化后与某个指令完全相同时返回该指令名（如繁体或全角写法）"""
+        return self._names.get(normalize(text))
+
+    @staticmethod
+    def max_distance(key: str) -> int:
+        """允许的编辑距离：4 个字以内错 1 个，更长的错 2 个"""
+        return 1 if len(key) <= 4 else 2
+
+    def suggest(self, text: str) -> List[str]:
+        """最接近的指令名，最多 max_suggestions 个；整句没有结果时再用第一个词查找"""
+        cached = self._cache.get(text)
+        if cached is not None:
+            return list(cached)
+        words = text.split()
+        # 多行文本，或首个词比最长的指令还长出最大编辑距离以上，不可能是输错的指令
+        if not words or "\n" in text.strip() or \
+                len(words[0]) > self._index.max_length + self._index.max_distance:
+            return []
+
+        names = []
+        candidates = [normalize(text)]
+        if len(words) > 1:
+            candidates.append(normalize(words[0]))
+        for key in candidates:
+            if not key:
+                continue
+            with self._lock:
+                matches = self._index.search(key, self.max_distance(key))
+                names = [self._names[word] for _, word in matches if word != key][:self.max_suggestions]
+            if names:
+                break
+
+        with self._lock:
+            while self._cache and len(self._cache) >= self.cache_size:
+                del self._cache[next(iter(self._cache))]
+            if self.cache_size > 0:
+                self._cache[text] = tuple(names)
+        return names
@@ -0,0 +1,117 @@
+"""
+定时任务执行记录
+
+每个任务保留最近 capacity 次运行（环形缓冲），记录开始时间、耗时、相对计划时间的延迟、
+结果和发送的消息数，用于找出慢脚本和过于拥挤的触发时间段。
+
+记录以紧凑的 JSON 数组保存：{task_id: [[开始时间, 耗时, 延迟, 结果, 消息数], ...]}，
+运行时只标记为待保存，由调用方定期调用 save_if_dirty 批量落盘。
+"""
+import json
+import math
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional
+
+from log import get_logger
+
+logger = get_logger("task_history")
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_SKIPPED = "skipped"
+
+
+class TaskRun(NamedTuple):
+    """一次任务运行"""
+    started_at: float  # 开始执行的时间戳
+    duration: float    # 执行耗时（秒）
+    lag: float         # 开始执行时间 - 计划触发时间（秒）
+    outcome: str       # ok / error / skipped
+    sent: int          # 脚本发送的消息数
+
+
+def percentile(values: Iterable[float], pct: float) -> Optional[float]:
+    """最近秩法百分位数，没有数据时返回 None"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class TaskRunHistory:
+    """按任务保存最近若干次运行记录"""
+
+    def __init__(self, path: str = "task_runs.json", capacity: int = 50):
+        self.path = path
+        self.capacity = capacity
+        self._runs: Dict[str, Deque[TaskRun]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def record(self, task_id: str, run: TaskRun):
+        with self._lock:
+            runs = self._runs.get(task_id)
+            if runs is None:
+                runs = self._runs[task_id] = deque(maxlen=self.capacity)
+            runs.append(run)
+            self._dirty = True
+
+    def runs(self, task_id: str) -> List[TaskRun]:
+        """任务的运行记录，按时间从早到晚"""
+        with self._lock:
+            return list(self._runs.get(task_id, ()))
+
+    def forget(self, task_id: str):
+        with self._lock:
+            if self._runs.pop(task_id, None) is not None:
+                self._dirty = True
+
+    def stats(self, task_id: str) -> Dict:
+        """运行次数、失败/跳过次数以及耗时和延迟的 p50/p95"""
+        runs = self.runs(task_id)
+        executed = [run for run in runs if run.outcome != OUTCOME_SKIPPED]
+        return {
+            "runs": len(executed),
+            "failures": sum(1 for run in executed if run.outcome == OUTCOME_ERROR),
+            "skipped": len(runs) - len(executed),
+            "sent": sum(run.sent for run in executed),
+            "duration_p50": percentile((run.duration for run in executed), 50),
+            "duration_p95": percentile((run.duration for run in executed), 95),
+            "lag_p50": percentile((run.lag for run in executed), 50),
+            "lag_p95": percentile((run.lag for run in executed), 95),
+            "last_run": runs[-1]._asdict() if runs else None,
+        }
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._runs = {task_id: deque((TaskRun(*row) for row in rows), maxlen=self.capacity)
+                          for task_id, rows in data.items()}
+        except Exception as e:
+            logger.error("加载任务运行记录失败: %s", e)
+            self._runs = {}
+
+    def save(self):
+        with self._lock:
+            data = {task_id: [[round(run.started_at, 3), round(run.duration, 3), round(run.lag, 3),
+                               run.outcome, run.sent] for run in runs]
+                    for task_id, runs in self._runs.items()}
+            self._dirty = False
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_file, self.path)
+
+    def save_if_dirty(self):
+        if self._dirty:
+            try:
+                self.save()
+            except OSError as e:
+                logger.error("保存任务运行记录失败: %s", e)
@@ -0,0 +1,51 @@
+import json
+import os
+import sys
+
+import pytest
+
+# 模块都在仓库根目录下，直接运行 pytest 时也能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import Message  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, ret):
+        self.ret = ret
+
+    def json(self):
+        return {"BaseResponse": {"Ret": self.ret}}
+
+
+class FakeWXRequest:
+    """替代 WXRequest：记录发出的文本消息，fail_once 中的消息第一次发送时返回会话失效"""
+
+    def __init__(self, fail_once=()):
+        self.fail_once = set(fail_once)
+        self.delivered = []
+
+    def fetch(self, url, method="get", data=None, **kwargs):
+        content = json.loads(data)["Msg"]["Content"]
+        if content in self.fail_once:
+            self.fail_once.discard(content)
+            return FakeResponse(1101)
+        self.delivered.append(content)
+        return FakeResponse(0)
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cwd(tmp_path, monkeypatch):
+    """在临时目录中运行，框架生成的数据库和任务文件不会写进仓库"""
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def make_message():
+    """创建不联网的 Message，发送结果由 FakeWXRequest 决定"""
+    def make(fail_once=()):
+        message = Message()
+        message.uin, message.sid, message.skey = "1", "sid", "skey"
+        message.wx_req = FakeWXRequest(fail_once)
+        return message
+    return make
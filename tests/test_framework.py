@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import schedule
+
+import framework
+from framework import (DAY_SECONDS, OVERLAP_QUEUE, CommandFramework, CommandHandler, TimedTask,
+                       TimedTaskManager, WXFramework)
+from kvstore import KVStore
+from lib import Message
+from middleware import DebounceMiddleware
+
+
+def test_debounce_is_opt_in():
+    assert not any(isinstance(m, DebounceMiddleware) for m in WXFramework().command_framework.middlewares)
+    framework = WXFramework(debounce_window=3)
+    assert any(isinstance(m, DebounceMiddleware) for m in framework.command_framework.middlewares)
+
+
+def test_repeated_input_is_handled_by_default():
+    framework = WXFramework().command_framework
+    assert framework.handle_message("菜单") == framework.handle_message("菜单") is not None
+
+
+def make_manager(**kwargs):
+    return TimedTaskManager(Message(), kv_store=KVStore(":memory:"), scheduler=schedule.Scheduler(), **kwargs)
+
+
+def test_stop_releases_cancelled_runs():
+    manager = make_manager(max_workers=1)
+    manager.executor = ThreadPoolExecutor(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def execute(task, scheduled_at):
+        started.set()
+        release.wait(5)
+    manager._execute_task = execute
+
+    running = TimedTask("task_running", "a.py", "08:00", overlap_policy=OVERLAP_QUEUE)
+    waiting = TimedTask("task_waiting", "b.py", "08:00")
+    manager._submit_task(running)
+    assert started.wait(5)
+    manager._submit_task(running)
+    manager._submit_task(waiting)
+
+    manager.stop()
+    # 线程池中尚未开始的运行被取消，排队的重叠运行被丢弃
+    assert manager._active_runs == {"task_running": 1}
+    assert not manager._queued_runs
+    release.set()
+    for _ in range(100):
+        if not manager._active_runs:
+            break
+        time.sleep(0.05)
+    assert manager._active_runs == {}
+
+
+@pytest.mark.parametrize("window", [DAY_SECONDS, DAY_SECONDS * 2])
+def test_fire_window_must_be_shorter_than_a_day(window):
+    with pytest.raises(ValueError, match="一天"):
+        make_manager(stagger_window=window)
+    manager = make_manager()
+    manager.tasks["t"] = TimedTask("t", "job.py", "08:00")
+    with pytest.raises(ValueError, match="一天"):
+        manager.set_jitter("t", window)
+    with open("job.py", "w", encoding="utf-8") as f:
+        f.write("")
+    with pytest.raises(ValueError, match="一天"):
+        manager.import_tasks([{"script_path": "job.py", "schedule_time": "08:00", "jitter": window}])
+
+
+def test_fire_time_near_midnight_stays_spread_within_the_day():
+    manager = make_manager(stagger_window=DAY_SECONDS - 1)
+    fire_times = set()
+    for i in range(200):
+        task = TimedTask(f"task_{i}", "a.py", "23:59")
+        offset = manager.get_fire_offset(task)
+        fire_time = manager.get_fire_time(task)
+        seconds = sum(int(part) * scale for part, scale in zip(fire_time.split(":"), (3600, 60, 1)))
+        assert 0 <= seconds < DAY_SECONDS
+        if offset > 23 * 3600 + 59 * 60:
+            # 前后都放不下的偏移不能全部挤到 00:00:00
+            assert seconds >= 23 * 3600 + 59 * 60
+        fire_times.add(fire_time)
+    assert "00:00:00" not in fire_times
+    assert len(fire_times) > 150
+
+
+@pytest.mark.parametrize("content", ["42", '"x"', "null", "true"])
+def test_import_rejects_scalar_json(content):
+    with open("tasks.json", "w", encoding="utf-8") as f:
+        f.write(content)
+    manager = make_manager()
+    with pytest.raises(ValueError, match="顶层应为数组或对象"):
+        manager.import_tasks_from_file("tasks.json")
+    assert manager.tasks == {}
+
+
+class AsyncEcho(CommandHandler):
+    async def handle(self, message):
+        return message
+
+    async def handle_media(self, media):
+        return "media"
+
+
+class SyncEcho(CommandHandler):
+    def handle(self, message):
+        return message
+
+    def handle_media(self, media):
+        return "media"
+
+
+def test_handlers_skip_span_outside_sampled_trace(monkeypatch):
+    class NoSpanTracer:
+        def span(self, *args, **kwargs):
+            raise AssertionError("不在采样的 trace 中时不应创建 span")
+    monkeypatch.setattr(framework, "get_tracer", NoSpanTracer)
+    commands = CommandFramework(Message())
+    commands.register_command("异步", AsyncEcho("异步", ""))
+    commands.register_command("同步", SyncEcho("同步", ""))
+    try:
+        for name in ("异步", "同步"):
+            assert commands.handle_message(name) == name
+            replies = []
+            done = threading.Event()
+            commands.dispatch_media(object(), lambda reply: (replies.append(reply), done.set()))
+            assert done.wait(5) and replies == ["media"]
+            commands.handle_message("退出")
+        # 等事件循环上的媒体处理协程结束后再关闭
+        while commands.async_loop.submit(_other_tasks()).result(5):
+            time.sleep(0.01)
+    finally:
+        commands.shutdown()
+
+
+async def _other_tasks():
+    return len(asyncio.all_tasks()) - 1
@@ -0,0 +1,101 @@
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from gateway import SendGateway, STATUS_PENDING, STATUS_SENT
+
+
+@pytest.fixture
+def gateway(make_message):
+    gateway = SendGateway(make_message(), port=0)
+    gateway.start()
+    yield gateway
+    gateway.stop()
+
+
+def request(gateway, method, path, body=None, headers=None):
+    """返回 (状态码, JSON)"""
+    req = urllib.request.Request(gateway.address + path, data=body, method=method,
+                                 headers=headers if headers is not None else {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_pending_message_is_updated_after_replay(gateway):
+    gateway.message.pause_outbound()
+    code, item = request(gateway, "POST", "/send?wait=5", json.dumps({"content": "日报"}).encode())
+    assert code == 200 and item["status"] == STATUS_PENDING
+
+    gateway.message.resume_outbound()
+    code, item = request(gateway, "GET", f"/status/{item['id']}")
+    assert item["status"] == STATUS_SENT
+    assert gateway.message.wx_req.delivered == ["日报"]
+    assert gateway.stats()["sent"] == 1
+
+
+def test_stop_does_not_block_on_full_queue(make_message):
+    message = make_message()
+    release = threading.Event()
+    send_msg = message.send_msg
+
+    def blocking_send_msg(**kwargs):
+        release.wait(5)
+        return send_msg(**kwargs)
+
+    message.send_msg = blocking_send_msg
+    gateway = SendGateway(message, port=0, queue_size=2)
+    gateway.start()
+    sender = gateway._threads[0]
+    assert gateway.enqueue([gateway.parse_item({"content": "a"})])
+    time.sleep(0.2)  # 发送线程取走 a，卡在发送中
+    assert gateway.enqueue([gateway.parse_item({"content": "b"}), gateway.parse_item({"content": "c"})])
+
+    stopper = threading.Thread(target=gateway.stop)
+    stopper.start()
+    stopper.join(timeout=2)
+    assert not stopper.is_alive()
+
+    release.set()
+    sender.join(timeout=5)
+    assert not sender.is_alive()
+    assert message.wx_req.delivered == ["a", "b", "c"]
+
+
+def raw_post(gateway, headers: bytes, body: bytes = b"") -> int:
+    """手工构造请求，返回状态码"""
+    with socket.create_connection((gateway.host, gateway.port), timeout=5) as sock:
+        sock.sendall(b"POST /send HTTP/1.1\r\nHost: localhost\r\n" + headers + b"\r\n" + body)
+        return int(sock.recv(1024).split(b" ", 2)[1])
+
+
+@pytest.mark.parametrize("headers, code", [
+    (b"Content-Type: application/json\r\n", 411),
+    (b"Content-Type: application/json\r\nContent-Length: abc\r\n", 400),
+    (b"Content-Type: application/json\r\nContent-Length: -5\r\n", 400),
+    (b"Content-Type: application/json\r\nContent-Length: 99999999\r\n", 413),
+])
+def test_invalid_content_length_is_rejected(gateway, headers, code):
+    assert raw_post(gateway, headers) == code
+
+
+@pytest.mark.parametrize("content_type", [None, "text/plain", "application/x-www-form-urlencoded"])
+def test_non_json_content_type_is_rejected(gateway, content_type):
+    headers = {"Content-Type": content_type} if content_type else {}
+    code, _ = request(gateway, "POST", "/send", b'{"content": "x"}', headers=headers)
+    assert code == 415
+    assert gateway.message.wx_req.delivered == []
+
+
+def test_json_with_charset_is_accepted(gateway):
+    code, _ = request(gateway, "POST", "/send?wait=5", b'{"content": "x"}',
+                      headers={"Content-Type": "application/json; charset=utf-8"})
+    assert code == 200
+    assert gateway.message.wx_req.delivered == ["x"]
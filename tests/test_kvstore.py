@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from kvstore import KVStore
+
+
+@pytest.fixture
+def store():
+    store = KVStore(":memory:")
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("ttl", [0, -1, -0.5])
+def test_set_rejects_non_positive_ttl(store, ttl):
+    with pytest.raises(ValueError):
+        store.set("key", "value", ttl=ttl)
+    assert store.get("key") is None
+
+
+@pytest.mark.parametrize("ttl", [0, -1])
+def test_incr_rejects_non_positive_ttl(store, ttl):
+    with pytest.raises(ValueError):
+        store.incr("counter", ttl=ttl)
+    assert store.get("counter") is None
+
+
+def test_ttl_none_never_expires_and_small_ttl_expires(store):
+    store.set("forever", 1, ttl=None)
+    store.set("short", 1, ttl=0.05)
+    assert store.incr("count", ttl=0.05) == 1
+    time.sleep(0.1)
+    assert store.get("forever") == 1
+    assert store.get("short") is None
+    assert store.incr("count", ttl=0.05) == 1
@@ -0,0 +1,27 @@
+def test_replay_keeps_order_when_session_expires_again(make_message):
+    message = make_message(fail_once={"c"})
+    message.pause_outbound()
+    for content in "abcd":
+        assert message.send_msg(content=content) is False
+
+    assert message.resume_outbound() == 2
+    assert message.outbound_paused
+    assert [entry[0] for entry in message.pending_sends] == ["c", "d"]
+
+    # 再次失效期间的新消息排在未重放的消息之后
+    assert message.send_msg(content="e") is False
+    assert [entry[0] for entry in message.pending_sends] == ["c", "d", "e"]
+
+    assert message.resume_outbound() == 3
+    assert message.pending_sends == []
+    assert message.wx_req.delivered == ["a", "b", "c", "d", "e"]
+
+
+def test_replay_reports_result_to_callback(make_message):
+    message = make_message()
+    message.pause_outbound()
+    results = []
+    message.send_msg(content="a", on_replayed=results.append)
+    assert results == []
+    message.resume_outbound()
+    assert results == [None]
@@ -0,0 +1,48 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+from framework import CommandHandler, LazyCommandHandler
+from plugins import PluginLoader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def loader():
+    loader = PluginLoader(os.path.join(ROOT, "plugins"), entry_point_group=None,
+                          namespace={"CommandHandler": CommandHandler})
+    yield loader
+    sys.modules.pop("pick", None)
+
+
+def test_plugin_uses_injected_base_class(loader):
+    spec, = loader.discover()
+    handler = loader.load(spec)
+    assert isinstance(handler, CommandHandler)
+    assert handler.handle("抽签 甲 乙").startswith("🎲 抽中了")
+
+
+def test_lazy_plugin_pickles_through_loader(loader):
+    spec, = loader.discover()
+    handler = pickle.loads(pickle.dumps(LazyCommandHandler(spec, loader)))
+    assert type(handler).__name__ == "PickCommandHandler"
+
+
+def test_plugin_does_not_reimport_framework_when_run_as_main():
+    # 模拟 python framework.py：framework 作为 __main__ 运行时加载插件，不应再导入一份 framework
+    code = (
+        "import runpy, sys\n"
+        "sys.argv = ['framework.py', '--help']\n"
+        "main = runpy.run_path('framework.py', run_name='not_main')\n"
+        "loader = main['PluginLoader']('plugins', None, namespace={'CommandHandler': main['CommandHandler']})\n"
+        "spec, = loader.discover()\n"
+        "handler = loader.load(spec)\n"
+        "assert isinstance(handler, main['CommandHandler'])\n"
+        "assert 'framework' not in sys.modules, 'framework imported twice'\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
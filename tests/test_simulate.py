@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+import http_client
+import kvstore
+from kvstore import KVStore
+from framework import TimedTask
+from simulate import Simulation
+
+START = datetime.datetime(2025, 1, 6)
+
+
+class _ForbiddenHttpClient:
+    def get(self, *args, **kwargs):
+        raise AssertionError("模拟运行不应访问网络")
+
+    post = get
+
+
+@pytest.fixture
+def live_state(tmp_path, monkeypatch):
+    """替换进程内默认的 KVStore 和 HttpClient，模拟运行不应使用它们"""
+    monkeypatch.chdir(tmp_path)
+    store = KVStore(str(tmp_path / "script_state.db"))
+    monkeypatch.setattr(kvstore, "_default_store", store)
+    monkeypatch.setattr(http_client, "_default_client", _ForbiddenHttpClient())
+    yield store
+    store.close()
+
+
+def write_script(tmp_path, name, source):
+    path = tmp_path / name
+    path.write_text(source, encoding="utf-8")
+    return str(path)
+
+
+def test_simulation_does_not_touch_live_store_or_network(tmp_path, live_state):
+    live_state.set("runs", 100)
+    script = write_script(tmp_path, "counter.py",
+                          "n = kv_incr('runs')\n"
+                          "kv_set('last', n)\n"
+                          "http_get('https://example.com/api', params={'n': n})\n"
+                          "http_post('https://example.com/hook', json={'n': n})\n"
+                          "send_message(f'第 {n} 次')\n")
+    sim = Simulation([TimedTask("task_1", script, "09:00")], start=START).run(3)
+
+    assert [run.outcome for _, run in sim.history.timeline] == ["ok"] * 3
+    assert live_state.get("runs") == 100
+    assert live_state.get("last") is None
+    assert sim.kv_store.get("runs") == 3
+    assert [(r.method, r.url) for r in sim.http.requests] == \
+        [("GET", "https://example.com/api"), ("POST", "https://example.com/hook")] * 3
+    assert [m.content for m in sim.message.sent] == ["第 1 次", "第 2 次", "第 3 次"]
+    assert sim.summary()["http_requests"] == 6
+
+
+def test_simulation_records_send_files(tmp_path, live_state):
+    images = [tmp_path / f"{i}.png" for i in range(3)]
+    for image in images:
+        image.write_bytes(b"\x89PNG")
+    script = write_script(tmp_path, "album.py",
+                          f"sent = send_files({[str(image) for image in images]!r})\n"
+                          "send_message(f'已发送 {sent} 张')\n")
+    sim = Simulation([TimedTask("task_1", script, "09:00")], start=START).run(1)
+
+    (_, run), = sim.history.timeline
+    assert run.outcome == "ok"
+    assert run.sent == 4
+    assert [m.file_path for m in sim.message.sent[:3]] == [str(image) for image in images]
+    assert sim.message.sent[3].content == "已发送 3 张"
+    assert all(m.task_id == "task_1" for m in sim.message.sent)
+    assert sim.summary()["sent"] == 4
+    hour, runs, sent = sim.histogram_lines()[1].split()[:3]
+    assert (hour, runs, sent) == ("09:00", "1", "4")
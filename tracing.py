@@ -0,0 +1,346 @@
+"""
+请求追踪
+
+每条收到的消息和每次定时任务运行都是一个 trace，其中的 HTTP 请求（WXRequest.fetch）、
+指令处理、上传和发送是它的 span，用来定位回复慢在哪一步：synccheck、webwxsync、
+处理器、webwxuploadmedia 还是 webwxsendmsg。
+
+当前 span 保存在 contextvars 中，事件循环中的协程会自动继承；提交到线程池时需要用
+contextvars.copy_context().run 包装。是否采样在 trace 开始时决定，未采样的 trace
+仍然有 trace ID（写入日志便于关联），但其中的 span 不会创建也不会导出。
+没有开启追踪（或采样率为 0）时 span() 直接返回 NOOP_SPAN，start_trace() 只分配
+trace ID，热点路径上几乎没有额外开销。
+
+采样的 span 由后台线程批量写入文件，每行是一个 OpenTelemetry OTLP/JSON 格式的
+ExportTraceServiceRequest，可以直接导入 Jaeger、Tempo 或 otel-collector 的 file receiver。
+"""
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from log import get_logger
+
+logger = get_logger("tracing")
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+_STOP = object()
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON 中 64 位整数以字符串表示
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+class Span:
+    """一个计时区间，用 with 语句使其成为当前 span"""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "status_message", "sampled", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str] = None,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+                 start_ns: Optional[int] = None, sampled: bool = True):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes if attributes is not None else {}
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.sampled = sampled
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, error: Any):
+        self.status = STATUS_ERROR
+        self.status_message = str(error)
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.sampled:
+            self.tracer.export(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.set_error(exc)
+        _current_span.reset(self._token)
+        self._token = None
+        self.end()
+
+    def to_otlp(self) -> Dict:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        if self.status_message:
+            data["status"]["message"] = self.status_message
+        return data
+
+
+class _NoopSpan:
+    """不记录的 span：没有当前 trace 或 trace 未被采样时返回，所有操作为空"""
+
+    trace_id = None
+    sampled = False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_error(self, error: Any):
+        pass
+
+    def end(self, end_ns: Optional[int] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _UnsampledSpan(_NoopSpan):
+    """未采样 trace 的根 span：只带 trace ID 并成为当前 span，不计时也不导出"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self._token = None
+
+    def __enter__(self) -> "_UnsampledSpan":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self._token = None
+
+
+class FileSpanExporter:
+    """把 span 批量写入 JSON Lines 文件，写入在后台线程中进行"""
+
+    def __init__(self, path: str = "traces.jsonl", service_name: str = "wxfilehelper",
+                 batch_size: int = 512, flush_interval: float = 2.0, queue_size: int = 10000,
+                 max_bytes: int = 50 * 1024 * 1024):
+        """
+        :param batch_size: 每行最多包含的 span 数
+        :param flush_interval: 队列中有 span 时最长等待多久写出（秒）
+        :param queue_size: 待写出队列上限，写线程跟不上时丢弃新 span 而不是阻塞调用方
+        :param max_bytes: 文件超过该大小时轮转为 path.1，0 表示不轮转
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.exported = 0
+        self._resource = {"attributes": _otlp_attributes({
+            "service.name": service_name, "process.pid": os.getpid()})}
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+        self._writer.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = item is _STOP
+            if not stop:
+                batch.append(item)
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                logger.error("写入追踪数据失败: %s", e, extra={"path": self.path})
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch: List[Span]):
+        line = json.dumps({"resourceSpans": [{
+            "resource": self._resource,
+            "scopeSpans": [{"scope": {"name": "wxfilehelper"},
+                            "spans": [span.to_otlp() for span in batch]}],
+        }]}, ensure_ascii=False, separators=(",", ":"))
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self.exported += len(batch)
+
+    def flush(self):
+        """等待队列中的 span 全部写出"""
+        self._queue.join()
+
+    def shutdown(self):
+        self._queue.put(_STOP)
+        self._writer.join(timeout=5)
+
+
+class Tracer:
+    """创建 span 并按采样率决定是否导出"""
+
+    def __init__(self, exporter: Optional[FileSpanExporter] = None, sample_rate: float = 1.0):
+        """
+        :param exporter: 为 None 时不导出任何 span（只分配 trace ID）
+        :param sample_rate: 被采样的 trace 比例，0～1
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter else 0.0
+
+    def start_trace(self, name: str, kind: int = SPAN_KIND_INTERNAL,
+                    attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None) -> Span:
+        """开始一个新的 trace，返回其根 span（用 with 语句使其成为当前 span）"""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return _UnsampledSpan(_new_id(128))
+        return Span(self, name, _new_id(128), kind=kind, attributes=attributes, start_ns=start_ns)
+
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL,
+             attributes: Optional[Dict[str, Any]] = None):
+        """当前 span 的子 span；未开启追踪、不在 trace 中或 trace 未被采样时返回 NOOP_SPAN"""
+        if not self.sample_rate:
+            return NOOP_SPAN
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, kind, attributes)
+
+    def record_span(self, name: str, start_ns: int, end_ns: int,
+                    attributes: Optional[Dict[str, Any]] = None, kind: int = SPAN_KIND_INTERNAL):
+        """补记一个已经结束的子 span，用于在 trace 开始之前发生的操作"""
+        span = self.span(name, kind, attributes)
+        if span is not NOOP_SPAN:
+            span.start_ns = start_ns
+            span.end(end_ns)
+
+    def export(self, span: Span):
+        if self.exporter:
+            self.exporter.export(span)
+
+
+_tracer = Tracer()
+_setup_lock = threading.Lock()
+
+
+def setup_tracing(path: str = "traces.jsonl", sample_rate: float = 0.1, **exporter_options) -> Tracer:
+    """
+    开启追踪，可重复调用以修改配置
+
+    :param path: 输出文件路径
+    :param sample_rate: 被采样的 trace 比例，默认 10%
+    :param exporter_options: 传给 FileSpanExporter 的其他参数
+    """
+    global _tracer
+    with _setup_lock:
+        previous = _tracer.exporter
+        _tracer = Tracer(FileSpanExporter(path, **exporter_options), sample_rate)
+    if previous:
+        previous.shutdown()
+    return _tracer
+
+
+def shutdown_tracing():
+    """写出剩余的 span 并停止追踪"""
+    global _tracer
+    with _setup_lock:
+        exporter, _tracer = _tracer.exporter, Tracer()
+    if exporter:
+        exporter.shutdown()
+
+
+atexit.register(shutdown_tracing)
+
+
+def get_tracer() -> Tracer:
+    """当前的 tracer，未调用 setup_tracing 时不导出任何 span"""
+    return _tracer
+
+
+def current_span():
+    """当前 span，不在 trace 中时返回 None"""
+    return _current_span.get()
+
+
+def is_recording() -> bool:
+    """当前是否在被采样的 trace 中；为 False 时 span() 只会返回 NOOP_SPAN，热点路径可以直接跳过"""
+    span = _current_span.get()
+    return span is not None and span.sampled
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span is not None else None